@@ -0,0 +1,236 @@
+"""Choose the trials of a round and decide when the round can stop
+
+TrialProcess.run asks a schedule for every trial and reports every result
+back to it:
+
+    obj = schedule.next()                    # None ends the round
+    index = obj.record(records, ...)
+    schedule.update(obj, records, index)
+
+upcoming() lists the trials that will probably follow, so their stimuli are
+decoded in the background.
+
+Exhaustive runs every trial in the given order, which is what the main
+rounds always did, and stops after max_correctness correct responses,
+which is what the practice does.
+
+ConditionStopping treats every condition type as an estimate to converge.
+The accuracy of a condition has a Beta posterior and its mean response
+time a standard error. The next trial is taken, in the given order, from
+the condition that is furthest from converging, and a condition stops once
+it has run min_trials and both of its estimates are precise enough.
+benchmarks/bench_adaptive.py compares its trial counts and estimate errors
+with the exhaustive rounds.
+
+Stopping early trades precision for trials, as a round of the exhaustive
+schedule already runs each condition only about as often as its estimates
+need. The default thresholds are the loosest that keep the errors within
+the noise of the simulation: over 160 simulated sessions they save about 5%
+of the trials with an accuracy RMSE of 0.082 and a response time RMSE of
+47.5 ms, against 0.077 and 46.6 ms for the exhaustive rounds and 0.081 and
+47.1 ms for this schedule running every trial. Looser thresholds, e.g.
+accuracy_sd=0.1 and rt_se=0.05, save about 22% of the trials but raise the
+errors to 0.087 and 53.7 ms.
+"""
+from collections import deque
+from records import RIGHT, NO_RESPONSE
+import math
+
+# the trials every condition runs before it can stop
+MIN_TRIALS = 8
+
+# a condition stops when the posterior SD of its accuracy and the standard
+# error of its mean response time (in seconds) are both below these, see
+# the module docstring for what looser thresholds cost
+ACCURACY_SD = 0.07
+RT_SE = 0.045
+
+
+class Exhaustive(object):
+    """
+    A schedule that runs the trials in order
+
+    Attributes
+    ----------
+    max_correctness : int, float
+        the number of correct responses that ends the round
+    correct : int
+        the number of correct responses so far
+    """
+
+    def __init__(self, trial_objs, max_correctness=math.inf):
+        self.max_correctness = max_correctness
+        self.correct = 0
+        self.__trial_objs = trial_objs
+        self.__next = 0
+
+    def next(self):
+        """Get the next trial object, None if the round is over"""
+        if self.__next >= len(self.__trial_objs) or \
+                self.correct >= self.max_correctness:
+            return None
+        self.__next += 1
+        return self.__trial_objs[self.__next - 1]
+
+    def upcoming(self, n):
+        return self.__trial_objs[self.__next:self.__next + n]
+
+    def update(self, obj, records, index):
+        """Record the result of a trial
+
+        Parameters
+        ----------
+        obj : trial.TrialObject
+            the trial returned by next()
+        records : records.TrialRecords
+            the results of the round
+        index : int
+            the index of the trial in records
+        """
+        if records.correct[index] == RIGHT:
+            self.correct += 1
+
+    def report(self):
+        return {"trials" : self.__next, "remaining" : len(self.__trial_objs) - self.__next}
+
+
+class Condition(object):
+    """
+    A class used to estimate the accuracy and the mean response time of a
+    condition type from its trials
+
+    A missing response is an error and has no response time, like in
+    summary.summarize.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.trials = deque()
+        self.n = 0
+        self.correct = 0
+        self.responses = 0
+        self.rt_sum = 0.0
+        self.rt_sum2 = 0.0
+
+    def add(self, correct, rt):
+        self.n += 1
+        if correct == RIGHT:
+            self.correct += 1
+        if correct != NO_RESPONSE and not math.isnan(rt):
+            self.responses += 1
+            self.rt_sum += rt
+            self.rt_sum2 += rt * rt
+
+    def accuracy(self):
+        """The mean and the SD of the Beta(1, 1) posterior of the accuracy"""
+        a = 1 + self.correct
+        b = 1 + self.n - self.correct
+        return a / (a + b), math.sqrt(a * b / ((a + b) ** 2 * (a + b + 1)))
+
+    def mean_rt(self):
+        """The mean response time and its standard error, the error is
+        infinite with less than two responses"""
+        if self.responses == 0:
+            return math.nan, math.inf
+        mean = self.rt_sum / self.responses
+        if self.responses < 2:
+            return mean, math.inf
+        variance = max(self.rt_sum2 - self.responses * mean * mean, 0) \
+            / (self.responses - 1)
+        return mean, math.sqrt(variance / self.responses)
+
+    def distance(self, accuracy_sd, rt_se):
+        """How far the estimates are from converging, below 1 when both are
+        precise enough"""
+        return max(self.accuracy()[1] / accuracy_sd, self.mean_rt()[1] / rt_se)
+
+
+class ConditionStopping(object):
+    """
+    A schedule that stops every condition type once its estimates converge
+
+    Attributes
+    ----------
+    conditions : dict
+        a Condition for every type, in the order of their first trial
+    min_trials : int
+    accuracy_sd : float
+    rt_se : float
+    """
+
+    def __init__(self, trial_objs, min_trials=MIN_TRIALS,
+                 accuracy_sd=ACCURACY_SD, rt_se=RT_SE):
+        """
+        Parameters
+        ----------
+        trial_objs : list
+            the trial objects of the round, in the order they are taken
+            from every condition
+        min_trials : int, optional
+            the trials every condition runs before it can stop
+        accuracy_sd : float, optional
+            the posterior SD of the accuracy a condition stops at
+        rt_se : float, optional
+            the standard error of the mean response time a condition stops
+            at
+        """
+        self.min_trials = min_trials
+        self.accuracy_sd = accuracy_sd
+        self.rt_se = rt_se
+        self.conditions = {}
+        for obj in trial_objs:
+            condition = self.conditions.get(obj.type())
+            if condition == None:
+                condition = self.conditions[obj.type()] = Condition(obj.type())
+            condition.trials.append(obj)
+
+    def converged(self, condition):
+        return condition.n >= self.min_trials and \
+            condition.distance(self.accuracy_sd, self.rt_se) <= 1
+
+    def __priority(self, condition):
+        # the conditions below min_trials first, the fewest trials first
+        if condition.n < self.min_trials:
+            return (1, -condition.n)
+        return (0, condition.distance(self.accuracy_sd, self.rt_se))
+
+    def __active(self):
+        return [condition for condition in self.conditions.values()
+                if condition.trials and not self.converged(condition)]
+
+    def next(self):
+        """Get the next trial object, None if every condition has stopped"""
+        active = self.__active()
+        if not active:
+            return None
+        return max(active, key=self.__priority).trials.popleft()
+
+    def upcoming(self, n):
+        active = sorted(self.__active(), key=self.__priority, reverse=True)
+        return [condition.trials[0] for condition in active[:n]]
+
+    def update(self, obj, records, index):
+        """Record the result of a trial, see Exhaustive.update"""
+        self.conditions[obj.type()].add(records.correct[index],
+                                        records.response_time[index])
+
+    def report(self):
+        """Get the estimates of every condition
+
+        Returns
+        -------
+        A dictionary from every condition type to its number of trials,
+        remaining trials, convergence and estimates
+        """
+        report = {}
+        for name, condition in self.conditions.items():
+            accuracy, accuracy_sd = condition.accuracy()
+            mean_rt, rt_se = condition.mean_rt()
+            report[name] = {"trials" : condition.n,
+                            "remaining" : len(condition.trials),
+                            "converged" : self.converged(condition),
+                            "accuracy" : accuracy,
+                            "accuracy_sd" : accuracy_sd,
+                            "mean_rt" : mean_rt,
+                            "rt_se" : rt_se}
+        return report
@@ -0,0 +1,497 @@
+from psychopy import visual, sound
+from stimcache import StimulusStore, decode_image, decode_sound, DECODE_WORKERS
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import threading
+import time
+import os
+
+# rough cost of a rasterized text stimulus, only used for the memory cap
+TEXT_NBYTES = 64 * 1024
+
+# the number of upcoming trials whose stimuli are decoded in the background,
+# see prefetch.Prefetcher
+PREFETCH_WINDOW = 3
+
+# the estimated decoded size of the stimuli of a trial: the largest photo
+# of the resources (1669x2362) decoded at trial.PHOTO_SCALE (835x1181 RGBA),
+# a recording and two words
+TRIAL_NBYTES = 4 * 1024 * 1024 + 1024 * 1024 + 2 * TEXT_NBYTES
+
+# the stimuli shown between the trials: the scene images and narrations,
+# the feedback and the words and sounds preloaded by exp.Session.setup
+SCENE_NBYTES = 64 * 1024 * 1024
+
+# upper bound of the decoded bytes kept alive by the cache, including the
+# decoded files waiting to be built: the trial being shown, the prefetch
+# window and the scenes. --memory-budget of exp.py overrides it.
+MEMORY_CAP = (PREFETCH_WINDOW + 1) * TRIAL_NBYTES + SCENE_NBYTES
+
+FONT = "Songti SC"
+
+
+class PsychopyFactory(object):
+    """
+    Builds the psychopy stimuli of the asset cache
+
+    The cache asks its factory to build every stimulus, so a different
+    backend, e.g. simulation.NullFactory, can replace psychopy without
+    touching the code that requests the stimuli.
+
+    Attributes
+    ----------
+    headless : Boolean
+        False, the stimuli are built from the decoded files and drawn on a
+        real window
+    """
+
+    headless = False
+
+    def image(self, win, source):
+        return visual.ImageStim(win, source)
+
+    def sound(self, source, sampleRate=None):
+        if sampleRate == None:
+            return sound.Sound(source)
+        return sound.Sound(source, sampleRate=sampleRate)
+
+    def text(self, win, text, color, colorSpace, font):
+        return visual.TextStim(win, text=text, color=color,
+            colorSpace=colorSpace, font=font)
+
+    def fixation(self, win, size):
+        return visual.GratingStim(win, color=[0, 0, 0], colorSpace='rgb',
+            tex=None, mask='cross', size=size)
+
+
+class AssetCache(object):
+    """
+    A process-wide cache of the stimuli used by the experiment
+
+    Every module asks the cache for its ImageStim, Sound and TextStim
+    objects instead of constructing them, so a file is decoded at most once
+    per session no matter how many stages, trial objects or scenes refer to
+    it. Entries are keyed by the window, the normalized path and the
+    stimulus parameters, so two requests that would produce identical
+    stimuli share a single object.
+
+    The cache keeps the least recently used order of its entries. When the
+    estimated decoded size goes over memory_cap, the oldest entries are
+    dropped and will be decoded again on the next request.
+
+    Files can be decoded ahead of time with decode(), which is safe to call
+    from a background thread. The decoded pixels and samples are kept until
+    the stimulus is built on the main thread, so building it only uploads
+    the data instead of reading the file. They count against memory_cap
+    too: a decoded file that doesn't fit is dropped and decoded again when
+    its stimulus is built. The entries are only evicted on the thread that
+    requests the stimuli, never by the decoding threads.
+
+    Images are decoded at the resolution they are shown at. With a disk
+    store, the decoded pixels and samples are read from memory-mapped files
+    written by an earlier launch, see stimcache.StimulusStore.
+
+    Attributes
+    ----------
+    memory_cap : int
+        the maximum number of decoded bytes kept by the cache
+    factory : PsychopyFactory
+        builds the stimuli
+    disk : stimcache.StimulusStore, None
+        keeps the decoded files between launches
+    hits : int
+        the number of requests served from the cache
+    misses : int
+        the number of requests that had to decode a file
+    evictions : int
+        the number of entries dropped because of the memory cap
+    """
+
+    def __init__(self, memory_cap=MEMORY_CAP, factory=None, disk=None):
+        self.memory_cap = memory_cap
+        self.factory = factory if factory != None else PsychopyFactory()
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+        self.__nbytes = 0
+        # the number of entries built from every image and sound file
+        self.__paths = {}
+        self.__decoded = {}
+        self.__decoded_nbytes = 0
+        self.__decoded_lock = threading.Lock()
+        # the sessions of stations.py may share the cache between threads
+        self.__lock = threading.RLock()
+
+    def image(self, win, path, scale=1):
+        """Get an image stimulus of the file
+
+        Parameters
+        ----------
+        win : psychopy.visual.Window
+            the window that the image will be drawn on
+        path : str
+            the path of the image file
+        scale : int, float, optional
+            the factor applied to the default size of the image, e.g. 0.5
+            shows the image at half of its size
+
+        Returns
+        -------
+        psychopy.visual.ImageStim
+        """
+        path = os.path.normpath(path)
+        key = ('image', id(win), path, scale)
+        # the texture of a decoded image has the size it is shown at, an
+        # image read by psychopy has the size of the file
+        nbytes = [None]
+
+        def load():
+            decoded = self.__take_decoded(('image', path, scale))
+            if decoded == None and self.disk != None and not self.factory.headless:
+                decoded = self.disk.image(path, scale)
+            if decoded != None:
+                # already at the resolution it is shown at
+                nbytes[0] = decoded_nbytes(decoded)
+                return self.factory.image(win, decoded)
+            nbytes[0] = image_nbytes(path)
+            img = self.factory.image(win, path)
+            if scale != 1:
+                img.size *= scale
+            return img
+
+        return self.get(key, load, lambda stim: nbytes[0])
+
+    def sound(self, win, path):
+        """Get a sound stimulus of the file
+
+        Parameters
+        ----------
+        win : psychopy.visual.Window
+            the window of the station that plays the sound. A Sound has a
+            single playback state, so the stations that share the cache,
+            see stations.py --threads, get sounds of their own
+        path : str
+            the path of the wav file
+
+        Returns
+        -------
+        psychopy.sound.Sound
+        """
+        path = os.path.normpath(path)
+        key = ('sound', id(win), path)
+
+        def load():
+            decoded = self.__take_decoded(('sound', path))
+            if decoded == None and self.disk != None and not self.factory.headless:
+                decoded = self.disk.sound(path)
+            if decoded == None:
+                return self.factory.sound(path)
+            samples, rate = decoded
+            return self.factory.sound(samples, sampleRate=rate)
+
+        return self.get(key, load, sound_nbytes(path))
+
+    def text(self, win, text, size, color=(0, 0, 0), colorSpace='rgb',
+             font=FONT):
+        """Get a text stimulus
+
+        Parameters
+        ----------
+        win : psychopy.visual.Window
+            the window that the text will be drawn on
+        text : str
+            the content of the text
+        size : int, float
+            the size of the text
+        color, colorSpace, font : optional
+            passed to psychopy.visual.TextStim
+
+        Returns
+        -------
+        psychopy.visual.TextStim
+        """
+        key = ('text', id(win), text, size, tuple(color), colorSpace, font)
+
+        def load():
+            text_stim = self.factory.text(win, text, list(color),
+                colorSpace, font)
+            text_stim.size = size
+            return text_stim
+
+        return self.get(key, load, TEXT_NBYTES)
+
+    def fixation(self, win, size):
+        """Get the fixation cross shown before every trial
+
+        Parameters
+        ----------
+        win : psychopy.visual.Window
+            the window that the cross will be drawn on
+        size : int, float
+            the size of the cross
+
+        Returns
+        -------
+        psychopy.visual.GratingStim
+        """
+        key = ('fixation', id(win), size)
+        return self.get(key, lambda: self.factory.fixation(win, size),
+            TEXT_NBYTES)
+
+    def decode(self, path, scale=1):
+        """Read and decode an image or a wav file without building a stimulus
+
+        This function doesn't touch the window, so it can be called from a
+        background thread. The result is used by the next image() or
+        sound() request of the same path and scale.
+
+        Parameters
+        ----------
+        path : str
+            the path of the image or wav file
+        scale : int, float, optional
+            the scale the image will be requested at
+        """
+        path = os.path.normpath(path)
+        if self.factory.headless or self.is_loaded(path):
+            return
+        if path.lower().endswith('.wav'):
+            key = ('sound', path)
+        else:
+            key = ('image', path, scale)
+        with self.__decoded_lock:
+            if key in self.__decoded:
+                return
+        if key[0] == 'sound':
+            decoded = self.disk.sound(path) if self.disk != None else decode_sound(path)
+        else:
+            decoded = self.disk.image(path, scale) if self.disk != None \
+                else decode_image(path, scale)
+        nbytes = decoded_nbytes(decoded)
+        with self.__decoded_lock:
+            if key in self.__decoded or \
+                    self.__nbytes + self.__decoded_nbytes + nbytes > self.memory_cap:
+                return
+            self.__decoded[key] = decoded
+            self.__decoded_nbytes += nbytes
+
+    def decode_all(self, files, workers=DECODE_WORKERS):
+        """Decode the files on a thread pool, see decode()
+
+        Only reading and decoding the files happens on the pool; the
+        stimuli are still built, and the textures uploaded, by the next
+        image() or sound() request on the main thread.
+
+        Parameters
+        ----------
+        files : iterable
+            paths of image or wav files, or (path, scale) tuples
+        workers : int, optional
+            the number of threads, 1 decodes the files one after the other
+            on the calling thread
+
+        Returns
+        -------
+        DecodeReport
+        """
+        items = list(dict.fromkeys((item, 1) if isinstance(item, str) else tuple(item)
+                                   for item in files))
+        times = [None] * len(items)
+
+        def decode(i):
+            start = time.perf_counter()
+            cpu = time.thread_time()
+            self.decode(*items[i])
+            times[i] = (items[i][0], time.perf_counter() - start,
+                        time.thread_time() - cpu)
+
+        start = time.perf_counter()
+        if workers <= 1:
+            for i in range(len(items)):
+                decode(i)
+        else:
+            with ThreadPoolExecutor(workers, thread_name_prefix="decode") as executor:
+                # list() raises the exception of a failed file
+                list(executor.map(decode, range(len(items))))
+        return DecodeReport(times, time.perf_counter() - start, workers)
+
+    def is_loaded(self, path):
+        """Check if a stimulus of the file has already been built"""
+        return os.path.normpath(path) in self.__paths
+
+    def __take_decoded(self, key):
+        with self.__decoded_lock:
+            decoded = self.__decoded.pop(key, None)
+            self.__decoded_nbytes -= decoded_nbytes(decoded)
+            return decoded
+
+    def get(self, key, load, nbytes):
+        """Get the stimulus stored under the key, load it if it is absent
+
+        Parameters
+        ----------
+        key : hashable
+            identifies the stimulus
+        load : callable
+            builds the stimulus when the key is not in the cache
+        nbytes : int, callable
+            the estimated decoded size of the stimulus, or a function that
+            computes it from the loaded stimulus
+
+        Returns
+        -------
+        the cached stimulus
+        """
+        with self.__lock:
+            if key in self.__entries:
+                self.hits += 1
+                self.__entries.move_to_end(key)
+                return self.__entries[key][0]
+
+            self.misses += 1
+            stim = load()
+            if callable(nbytes):
+                nbytes = nbytes(stim)
+            self.__entries[key] = (stim, nbytes)
+            self.__nbytes += nbytes
+            path = source_path(key)
+            if path != None:
+                self.__paths[path] = self.__paths.get(path, 0) + 1
+            self.__shrink()
+            return stim
+
+    def __shrink(self):
+        # never evict the entry that has just been loaded
+        while self.__nbytes + self.__decoded_nbytes > self.memory_cap and \
+                len(self.__entries) > 1:
+            key, (_, nbytes) = self.__entries.popitem(last=False)
+            self.__nbytes -= nbytes
+            path = source_path(key)
+            if path != None:
+                self.__paths[path] -= 1
+                if self.__paths[path] == 0:
+                    del self.__paths[path]
+            self.evictions += 1
+
+    def nbytes(self):
+        """The estimated decoded size of all cached stimuli and of the
+        decoded files waiting to be built"""
+        return self.__nbytes + self.__decoded_nbytes
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def stats(self):
+        """Get the counters of the cache
+
+        Returns
+        -------
+        A dictionary of the number of entries, hits, misses, evictions, the
+        estimated size of the stimuli and the size of the decoded files in
+        bytes
+        """
+        return {"entries" : len(self.__entries),
+                "hits" : self.hits,
+                "misses" : self.misses,
+                "evictions" : self.evictions,
+                "nbytes" : self.__nbytes,
+                "decoded_nbytes" : self.__decoded_nbytes}
+
+    def clear(self):
+        """Drop every cached stimulus and reset the counters"""
+        with self.__decoded_lock:
+            self.__decoded.clear()
+            self.__decoded_nbytes = 0
+        with self.__lock:
+            self.__entries.clear()
+            self.__paths.clear()
+            self.__nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+
+class DecodeReport(object):
+    """
+    A class used to represent the timing of AssetCache.decode_all
+
+    Attributes
+    ----------
+    times : list
+        a (path, seconds, CPU seconds) tuple for every file, in the order
+        they were given; the seconds include the waits for the GIL and for
+        the other threads, the CPU seconds of the decoding thread don't
+    wall : float
+        the wall-clock seconds of the whole decode
+    workers : int
+        the number of threads
+    """
+
+    def __init__(self, times, wall, workers):
+        self.times = times
+        self.wall = wall
+        self.workers = workers
+
+    def serial(self):
+        """The sum of the CPU times of the files, about what decoding them
+        one after the other takes"""
+        return sum(cpu for _, _, cpu in self.times)
+
+    def speedup(self):
+        """The estimated speedup over the serial path, the time of the
+        file reads is not counted, see benchmarks/bench_decode.py for a
+        measured one"""
+        return self.serial() / self.wall if self.wall > 0 else 1.0
+
+    def report(self, slowest=10):
+        """Lay out the slowest files and the totals
+
+        Returns
+        -------
+        str
+        """
+        lines = ["%-40s %9s %9s" % ("file", "decode ms", "CPU ms")]
+        for path, seconds, cpu in sorted(self.times, key=lambda t: -t[2])[:slowest]:
+            lines.append("%-40s %9.1f %9.1f" % (os.path.basename(path)[-40:],
+                                                seconds * 1000, cpu * 1000))
+        lines.append("%d files on %d threads: %.1f ms wall, %.1f ms serial, %.2fx" % (
+            len(self.times), self.workers, self.wall * 1000, self.serial() * 1000,
+            self.speedup()))
+        return '\n'.join(lines)
+
+
+def source_path(key):
+    """Get the file of an image or sound entry of the cache, None for the
+    other entries"""
+    if key[0] in ('image', 'sound'):
+        return key[2]
+    return None
+
+
+def decoded_nbytes(decoded):
+    """Get the size of the result of decode_image or decode_sound"""
+    if decoded == None:
+        return 0
+    if isinstance(decoded, tuple):
+        return decoded[0].nbytes
+    width, height = decoded.size
+    return width * height * len(decoded.getbands())
+
+
+def image_nbytes(path):
+    """Estimate the decoded RGBA size of an image file from its header"""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+        return width * height * 4
+    except (OSError, ValueError):
+        return os.path.getsize(path)
+
+
+def sound_nbytes(path):
+    """Estimate the decoded float32 size of a 16-bit wav file"""
+    return os.path.getsize(path) * 2
+
+
+ASSETS = AssetCache(disk=StimulusStore())
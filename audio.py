@@ -0,0 +1,177 @@
+from assets import ASSETS, sound_nbytes
+import glob
+import math
+import os
+
+AUDIO_DIRNAME = "./resources/audio"
+
+
+def preload_sounds(win, dirname=AUDIO_DIRNAME, budget=None):
+    """Decode the wave files of the directory into the asset cache
+
+    The sounds are kept as in-memory buffers, so starting one doesn't read
+    or decode the file.
+
+    Parameters
+    ----------
+    win : psychopy.visual.Window
+        the window of the station that plays the sounds
+    dirname : str, optional
+    budget : int, optional
+        the decoded bytes to preload, the remaining sounds are decoded when
+        they are needed. Every sound is preloaded by default.
+
+    Returns
+    -------
+    the number of preloaded sounds
+    """
+    nbytes = 0
+    count = 0
+    for path in sorted(glob.glob(os.path.join(dirname, "*.wav"))):
+        if budget != None and nbytes >= budget:
+            break
+        ASSETS.sound(win, path)
+        nbytes += sound_nbytes(path)
+        count += 1
+    return count
+
+
+def audio_onset(snd):
+    """Get the time a sound has actually started, in the psychtoolbox clock
+
+    The PTB backend reports the start time of the stream of a sound, a
+    simulated sound reports the time it has been scheduled for.
+
+    Returns
+    -------
+    float, None if it is unknown
+    """
+    status = getattr(getattr(snd, 'track', None), 'status', None)
+    if status:
+        return status.get('StartTime') or None
+    return getattr(snd, 'start_time', None)
+
+
+class AudioEngine(object):
+    """
+    A class used to start sounds together with the onset of a phase
+
+    Calling play() after the flip delays the sound by the Python overhead
+    and by the buffer latency of the sound backend. On the PTB backend the
+    engine asks the window for the time of the next flip and schedules the
+    sound for that time with play(when=...) before the flip, so the sound
+    and the image start together. Backends that can't schedule a sound
+    play it right after the flip instead.
+
+    The asynchrony between the visual onset, measured on the flip, and the
+    start time reported by the backend is stored in log.
+
+    Attributes
+    ----------
+    log : list
+        a dictionary for every sound that has been scheduled, with the
+        trial, the scheduled, visual and audio onsets and the asynchrony in
+        milliseconds (positive if the sound started late)
+    """
+
+    def __init__(self, win, kb):
+        """
+        Parameters
+        ----------
+        win : psychopy.visual.Window
+            the window whose flips the sounds are locked to
+        kb : response.ResponseKeyboard
+            the clock of the visual onsets, see ResponseKeyboard.get_time
+        """
+        self.__win = win
+        self.__kb = kb
+        self.__pending = []
+        self.log = []
+
+    def next_flip_time(self):
+        """Predict the time of the next flip in the psychtoolbox clock
+
+        Returns
+        -------
+        float, None if the window can't predict it
+        """
+        try:
+            return self.__win.getFutureFlipTime(clock='ptb')
+        except (AttributeError, TypeError):
+            return None
+
+    def __mark_onset(self, onset):
+        onset.append(self.__kb.get_time())
+
+    def play_on_flip(self, sounds, trial=None):
+        """Start the sounds with the next flip
+
+        Parameters
+        ----------
+        sounds : list
+            sound stimuli or prefetch.LazySound proxies
+        trial : optional
+            stored in the log to identify the trial
+        """
+        if not sounds:
+            return
+        when = self.next_flip_time()
+        onset = []
+        self.__win.callOnFlip(self.__mark_onset, onset)
+        for snd in sounds:
+            stim = snd.load() if hasattr(snd, 'load') else snd
+            if when != None:
+                try:
+                    stim.play(when=when)
+                    self.__pending.append((trial, stim, when, onset))
+                    continue
+                except TypeError:
+                    # the backend can't schedule a sound
+                    pass
+            self.__win.callOnFlip(stim.play)
+            self.__pending.append((trial, stim, None, onset))
+
+    def measure(self):
+        """Log the onsets of the sounds started since the last measure
+
+        The start time of a sound is only known once it has started, so
+        this is called at the end of a trial.
+
+        Returns
+        -------
+        the asynchrony of the last sound in milliseconds, None if it is
+        unknown
+        """
+        asynchrony = None
+        for trial, stim, when, onset in self.__pending:
+            visual_onset = onset[0] if onset else None
+            audio = audio_onset(stim)
+            asynchrony = None
+            if audio != None and visual_onset != None:
+                asynchrony = (audio - visual_onset) * 1000
+            self.log.append({"trial" : trial,
+                             "scheduled" : when,
+                             "visual_onset" : visual_onset,
+                             "audio_onset" : audio,
+                             "asynchrony_ms" : asynchrony})
+        self.__pending = []
+        return asynchrony
+
+    def report(self):
+        """Summarize the audio-visual asynchrony of the logged sounds
+
+        Returns
+        -------
+        A dictionary with the number of sounds, the number whose onset is
+        known and the mean, SD and maximum absolute asynchrony in ms
+        """
+        values = [entry["asynchrony_ms"] for entry in self.log
+                  if entry["asynchrony_ms"] != None]
+        report = {"n" : len(self.log), "measured" : len(values)}
+        if values:
+            mean = sum(values) / len(values)
+            report["mean_ms"] = mean
+            report["sd_ms"] = math.sqrt(sum((x - mean) ** 2 for x in values)
+                                        / len(values))
+            report["max_abs_ms"] = max(abs(x) for x in values)
+        return report
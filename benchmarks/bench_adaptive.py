@@ -0,0 +1,83 @@
+"""Benchmark the adaptive stopping rule against the exhaustive rounds
+
+Run from the repository root:
+
+    python benchmarks/bench_adaptive.py [number of sessions]
+
+Every session (40 by default) is simulated twice with the same seed, once
+running every trial of the main rounds and once with
+adaptive.ConditionStopping. The synthetic participant's true accuracy and
+mean response time of every condition are known, so the estimates of the
+summary (one per stage, order and type) are compared with them. The
+errors of the adaptive rounds are also given relative to the exhaustive
+ones: the trials saved are only free if they stay within the noise of a
+few percent.
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from adaptive import ConditionStopping
+from simulation import Headless, simulate_session, RT_PARAMS, ACCURACY
+from sink import read_log
+from summary import trial_table, summarize, KEYS
+
+SESSION_TYPES = ['1', '2', '3', '4']
+
+
+def true_values(summary):
+    types = summary.index.get_level_values("type")
+    accuracy = np.array([ACCURACY[key] for key in types])
+    # the mean of the log-normal response times
+    mean_rt = np.array([RT_PARAMS[key][0] * np.exp(RT_PARAMS[key][1] ** 2 / 2)
+                        for key in types])
+    return accuracy, mean_rt
+
+
+def run(n_sessions, schedule):
+    trials = []
+    durations = []
+    accuracy_errors = []
+    rt_errors = []
+    start = time.perf_counter()
+    for seed in range(n_sessions):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = simulate_session(SESSION_TYPES[seed % len(SESSION_TYPES)],
+                                      seed=seed, schedule=schedule)
+        _, data, _ = read_log(result["log"])
+        summary = summarize(trial_table(data), KEYS)
+        accuracy, mean_rt = true_values(summary)
+        trials.append(result["trials"])
+        durations.append(result["virtual_time"])
+        accuracy_errors.append(summary["accuracy"].to_numpy() - accuracy)
+        rt_errors.append(summary["mean_rt"].to_numpy() - mean_rt)
+    accuracy_errors = np.concatenate(accuracy_errors)
+    rt_errors = np.concatenate(rt_errors)
+    return {"trials" : np.mean(trials),
+            "minutes" : np.mean(durations) / 60,
+            "accuracy_rmse" : np.sqrt(np.mean(accuracy_errors ** 2)),
+            "rt_rmse_ms" : np.sqrt(np.mean(rt_errors ** 2)) * 1000,
+            "wall" : time.perf_counter() - start}
+
+
+if __name__ == '__main__':
+    n_sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    print("sessions: %d" % n_sessions)
+    print("%-12s %8s %8s %14s %12s" % ("schedule", "trials", "minutes",
+                                       "accuracy rmse", "rt rmse ms"))
+    with Headless():
+        results = {"exhaustive" : run(n_sessions, None),
+                   "adaptive" : run(n_sessions, ConditionStopping)}
+    for name, result in results.items():
+        print("%-12s %8.1f %8.1f %14.4f %12.1f" % (name, result["trials"],
+            result["minutes"], result["accuracy_rmse"], result["rt_rmse_ms"]))
+    print("trials saved: %.1f%%" % ((1 - results["adaptive"]["trials"]
+                                    / results["exhaustive"]["trials"]) * 100))
+    print("accuracy rmse: %+.1f%%, rt rmse: %+.1f%% vs exhaustive" % (
+        (results["adaptive"]["accuracy_rmse"] / results["exhaustive"]["accuracy_rmse"] - 1) * 100,
+        (results["adaptive"]["rt_rmse_ms"] / results["exhaustive"]["rt_rmse_ms"] - 1) * 100))
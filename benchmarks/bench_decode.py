@@ -0,0 +1,45 @@
+"""Benchmark decoding the stimulus files on a thread pool
+
+Run from the repository root:
+
+    python benchmarks/bench_decode.py [max threads]
+
+Every photo (at the scale it is shown at) and every wav file of the
+resources is decoded by AssetCache.decode_all into a fresh cache without a
+disk store, so every file is really read and decoded. The serial path (1
+thread) is measured, and the speedup of every pool size is its wall-clock
+time against the serial one. The best of 3 repeats is reported, followed
+by the slowest files of the largest pool.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assets import AssetCache
+from stimcache import experiment_stimuli
+
+REPEATS = 3
+
+
+def run(files, workers):
+    return min((AssetCache(disk=None).decode_all(files, workers)
+                for _ in range(REPEATS)), key=lambda report: report.wall)
+
+
+if __name__ == '__main__':
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    images, sounds = experiment_stimuli()
+    files = images + sounds
+    print("%d images, %d sounds, %d CPUs" % (len(images), len(sounds), os.cpu_count()))
+    print("%8s %10s %12s %10s %14s" % ("threads", "wall ms", "serial ms", "speedup",
+                                      "estimated"))
+    serial = run(files, 1)
+    workers = 1
+    while workers <= max_workers:
+        report = serial if workers == 1 else run(files, workers)
+        print("%8d %10.1f %12.1f %9.2fx %13.2fx" % (workers, report.wall * 1000,
+            serial.wall * 1000, serial.wall / report.wall, report.speedup()))
+        workers *= 2
+    print()
+    print(report.report())
@@ -0,0 +1,152 @@
+"""Benchmark the memory of the stimuli as the item bank grows
+
+Run from the repository root:
+
+    python benchmarks/bench_item_bank.py [budget in MB]
+
+Item banks of 100 to 5000 targets with the four condition columns are
+built from links to a real photo and recording, and a round of 320 trials
+is run on them with a NullWindow and a synthetic participant. The stimuli
+are built by a factory whose stimuli hold as many bytes as the texture or
+buffer they stand for, so the live stimulus memory is measured, next to
+the memory of the trial objects and the size of every stimulus of the
+bank, which is what building all of them up front would take.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from assets import ASSETS, TEXT_NBYTES, image_nbytes, sound_nbytes
+from manifest import TrialSet, TYPES
+from simulation import NullWindow, SyntheticParticipant
+from trial import AudioTrialObjects, TrialProcess
+
+BANK_SIZES = [100, 1000, 5000]
+ROUND_TRIALS = 320
+PHOTO = "./resources/photos/小丑.jpeg"
+AUDIO = "./resources/audio/小丑.wav"
+
+
+class BufferStim(object):
+    """A stimulus that holds as many bytes as the texture it stands for"""
+
+    live = 0
+    peak = 0
+
+    def __init__(self, nbytes, duration=0.5):
+        self.buffer = bytearray(nbytes)
+        self.size = np.array([1.0, 1.0])
+        self.duration = duration
+        BufferStim.live += nbytes
+        BufferStim.peak = max(BufferStim.peak, BufferStim.live)
+
+    def __del__(self):
+        BufferStim.live -= len(self.buffer)
+
+    def draw(self):
+        pass
+
+    def play(self, when=None, **kwargs):
+        pass
+
+    def pause(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def getDuration(self):
+        return self.duration
+
+
+class BufferFactory(object):
+    """Builds BufferStim stimuli for the asset cache"""
+
+    headless = True
+
+    def image(self, win, source):
+        return BufferStim(image_nbytes(source))
+
+    def sound(self, source, sampleRate=None):
+        return BufferStim(sound_nbytes(source))
+
+    def text(self, win, text, color, colorSpace, font):
+        return BufferStim(TEXT_NBYTES)
+
+    def fixation(self, win, size):
+        return BufferStim(TEXT_NBYTES)
+
+
+def item_bank(dirname, n_targets):
+    """Link a photo and a recording for every target and describe its
+    trial set"""
+    trial_sets = []
+    for i in range(n_targets):
+        target = "t%05d" % i
+        photo = os.path.join(dirname, target + ".jpeg")
+        audio = os.path.join(dirname, target + ".wav")
+        if not os.path.exists(photo):
+            os.link(PHOTO, photo)
+            os.link(AUDIO, audio)
+        tests = [("%s_%d" % (target, column), _type)
+                 for column, _type in enumerate(TYPES)]
+        trial_sets.append(TrialSet(target, photo, audio, tests))
+    return trial_sets
+
+
+def run(dirname, n_targets):
+    trial_sets = item_bank(dirname, n_targets)
+    win = NullWindow()
+    ASSETS.clear()
+    BufferStim.peak = BufferStim.live
+
+    tracemalloc.start()
+    trial_objs_set = [AudioTrialObjects(win, trial_set) for trial_set in trial_sets]
+    descriptors = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    n_objects = sum(len(objs.trial_objects) for objs in trial_objs_set)
+
+    trp = TrialProcess(win, trial_objs_set, kb=SyntheticParticipant(win, seed=n_targets))
+    trial_objs = random.Random(n_targets).sample(
+        [obj for objs in trial_objs_set for obj in objs.trial_objects], ROUND_TRIALS)
+    trp.run(trial_objs)
+
+    # every word, photo and recording of the bank built up front
+    words = len(set(word for trial_set in trial_sets for word, _ in trial_set.tests)) \
+        + n_targets
+    everything = words * TEXT_NBYTES + n_targets * (image_nbytes(PHOTO) + sound_nbytes(AUDIO))
+    return {"targets" : n_targets,
+            "trial_objects" : n_objects,
+            "descriptors_mb" : descriptors / 2 ** 20,
+            "bytes_per_object" : descriptors / n_objects,
+            "peak_stimuli_mb" : BufferStim.peak / 2 ** 20,
+            "cache_mb" : ASSETS.nbytes() / 2 ** 20,
+            "everything_mb" : everything / 2 ** 20}
+
+
+if __name__ == '__main__':
+    budget = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    previous = ASSETS.factory, ASSETS.memory_cap
+    ASSETS.factory = BufferFactory()
+    ASSETS.memory_cap = budget * 2 ** 20
+    dirname = tempfile.mkdtemp(prefix='slp-item-bank-')
+    print("memory budget: %d MB, %d trials per round" % (budget, ROUND_TRIALS))
+    print("%8s %9s %12s %10s %12s %9s %14s" % ("targets", "objects", "objects MB",
+        "B/object", "peak stim MB", "cache MB", "everything MB"))
+    try:
+        for n_targets in BANK_SIZES:
+            result = run(dirname, n_targets)
+            print("%8d %9d %12.1f %10.0f %12.1f %9.1f %14.1f" % (
+                result["targets"], result["trial_objects"], result["descriptors_mb"],
+                result["bytes_per_object"], result["peak_stimuli_mb"],
+                result["cache_mb"], result["everything_mb"]))
+    finally:
+        ASSETS.factory, ASSETS.memory_cap = previous
+        ASSETS.clear()
+        shutil.rmtree(dirname)
@@ -0,0 +1,120 @@
+"""Benchmark the Python overhead of the trial phases per frame and per phase
+
+Run from the repository root:
+
+    python benchmarks/bench_phases.py [number of trials]
+
+The phases of a trial (trial.TRIAL_PHASES) are run by a FrameScheduler on
+a NullWindow with null stimuli and a keyboard that answers 0.7 s after
+word1, so a flip costs no waiting and the wall-clock time is the Python
+work of the scheduler. Two ways of running the trials are compared:
+
+    phases  a list of Phase objects built for every trial, which run()
+            compiles every time, like the trial loop used to do
+    table   TRIAL_PHASES compiled once, and the stimuli of every trial
+            bound to its slots, like TrialProcess.run does
+
+The same number of bare flips and key polls is timed as the floor, and the
+difference is the overhead of the scheduler. The best of 7 repeats is
+reported.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import FrameScheduler, Phase
+from simulation import NullWindow, NullStim
+from trial import TRIAL_PHASES, RESPONSE_KEYS
+
+REPEATS = 7
+RT = 0.7
+
+
+class FixedKeyboard(object):
+    """A keyboard that presses q RT seconds after the response time starts"""
+
+    def __init__(self, win):
+        self.win = win
+        self.__cleared = 0.0
+
+    def get_time(self):
+        return self.win.time
+
+    def clear(self):
+        self.__cleared = self.win.time
+
+    def get_keys(self, keyList=None):
+        if keyList != None and 'q' in keyList and \
+                self.win.time >= self.__cleared + RT:
+            return [('q', self.__cleared + RT)]
+        return []
+
+
+class NullAudio(object):
+
+    def play_on_flip(self, sounds, trial=None):
+        pass
+
+    def measure(self):
+        return None
+
+
+def trial_stims(n_trials):
+    return [(NullStim(), NullStim(), NullStim()) for _ in range(n_trials)]
+
+
+def run_phases(scheduler, fixation, stims):
+    for i, (img, word1, word2) in enumerate(stims):
+        phases = []
+        for phase in TRIAL_PHASES:
+            phases.append(Phase(phase.label, [], phase.duration, phase.keyList,
+                                rt_start=phase.rt_start))
+        phases[0].stims = [fixation]
+        phases[2].stims = [img]
+        phases[4].stims = [word1]
+        phases[6].stims = [word2]
+        scheduler.run(phases, i)
+
+
+def run_table(scheduler, fixation, stims):
+    table = scheduler.compile(TRIAL_PHASES)
+    table.set("cross", [fixation])
+    for i, (img, word1, word2) in enumerate(stims):
+        table.set("photo", [img], sounds=())
+        table.set("word1", [word1])
+        table.set("word2", [word2])
+        scheduler.run(table, i)
+
+
+def floor(n_frames):
+    """The time of n_frames flips and key polls and nothing else"""
+    win = NullWindow()
+    kb = FixedKeyboard(win)
+    start = time.perf_counter()
+    for _ in range(n_frames):
+        win.flip()
+        kb.get_keys(RESPONSE_KEYS)
+    return time.perf_counter() - start
+
+
+def measure(run, n_trials):
+    win = NullWindow()
+    scheduler = FrameScheduler(win, kb=FixedKeyboard(win), audio=NullAudio())
+    stims = trial_stims(n_trials)
+    start = time.perf_counter()
+    run(scheduler, NullStim(), stims)
+    return time.perf_counter() - start, win.frames, len(scheduler.log)
+
+
+if __name__ == '__main__':
+    n_trials = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print("trials: %d" % n_trials)
+    print("%-8s %8s %7s %10s %14s %14s" % ("run", "frames", "phases", "wall ms",
+                                          "us per frame", "us per phase"))
+    for name, run in (("phases", run_phases), ("table", run_table)):
+        wall, frames, phases = min(measure(run, n_trials) for _ in range(REPEATS))
+        overhead = wall - min(floor(frames) for _ in range(REPEATS))
+        print("%-8s %8d %7d %10.1f %14.3f %14.2f" % (name, frames, phases,
+            wall * 1000, overhead / frames * 1e6, overhead / phases * 1e6))
@@ -0,0 +1,87 @@
+"""Benchmark the grouped summary against the per-condition loop
+
+Run from the repository root:
+
+    python benchmarks/bench_summary.py [number of sessions]
+
+Synthetic sessions (10000 by default) with the trial layout of the real
+experiment are summarized by session, stage, order and type in one
+summarize() call. The loop that update_overview used to run is timed on a
+sample of the sessions and extrapolated, because it takes minutes on the
+whole archive.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from summary import summarize, TYPES
+
+# 4 targets x 4 conditions x 2 word orders per stage
+TRIALS_PER_STAGE = 32
+STAGES = ["stage1_former", "stage1_latter", "stage2_former", "stage2_latter"]
+LEGACY_SAMPLE = 200
+
+
+def synthetic_trials(n_sessions, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_sessions * len(STAGES) * TRIALS_PER_STAGE
+    stage_names = np.tile(np.repeat(STAGES, TRIALS_PER_STAGE), n_sessions)
+    stage, order = zip(*(name.split('_') for name in STAGES))
+    stage_index = np.tile(np.repeat(np.arange(len(STAGES)), TRIALS_PER_STAGE),
+        n_sessions)
+    rt = rng.lognormal(-0.4, 0.3, n)
+    correct = np.where(rng.random(n) < 0.85, True, False).astype(object)
+    missing = rng.random(n) < 0.02
+    correct[missing] = 'no response'
+    rt[missing] = np.nan
+    return pd.DataFrame({
+        "session" : np.repeat(np.arange(n_sessions), len(STAGES) * TRIALS_PER_STAGE),
+        "stage" : np.array(stage)[stage_index],
+        "order" : np.array(order)[stage_index],
+        "stage_name" : stage_names,
+        "type" : np.array(TYPES)[rng.integers(0, len(TYPES), n)],
+        "response_time" : rt,
+        "correct" : correct})
+
+
+def legacy_summary(trials):
+    # the loop update_overview ran for every session
+    results = {}
+    for session, session_df in trials.groupby("session"):
+        for name in STAGES:
+            df = pd.DataFrame.from_dict(
+                session_df[session_df.stage_name == name].to_dict('records'))
+            row = {}
+            for key in TYPES:
+                try:
+                    sub_df = df[df.type == key]
+                    row[f"average_response_time_{key}"] = sub_df['response_time'].mean()
+                    row[f"correctness_rate_{key}"] = sub_df['correct'].mean()
+                except:
+                    row[f"average_response_time_{key}"] = 0
+                    row[f"correctness_rate_{key}"] = 0
+            results[(session, name)] = row
+    return results
+
+
+if __name__ == '__main__':
+    n_sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    trials = synthetic_trials(n_sessions)
+    print("sessions: %d, trials: %d" % (n_sessions, len(trials)))
+
+    start = time.perf_counter()
+    summary = summarize(trials, ["session", "stage", "order", "type"])
+    vectorized = time.perf_counter() - start
+    print("summarize       %8.3f s  (%d groups)" % (vectorized, len(summary)))
+
+    sample = trials[trials.session < LEGACY_SAMPLE]
+    start = time.perf_counter()
+    legacy_summary(sample)
+    legacy = (time.perf_counter() - start) * n_sessions / LEGACY_SAMPLE
+    print("legacy loop     %8.3f s  (extrapolated from %d sessions)"
+        % (legacy, LEGACY_SAMPLE))
+    print("speedup         %8.1f x" % (legacy / vectorized))
@@ -0,0 +1,84 @@
+"""Benchmark the queries of the trial warehouse over years of sessions
+
+Run from the repository root:
+
+    python benchmarks/bench_warehouse.py [number of sessions] [years]
+
+Synthetic sessions (2000 over 4 years by default) with the trial layout of
+the real experiment are added to a Warehouse in a temporary directory one
+by one, like exp.Session.write_results does, which compacts the months as
+they fill up. Three queries are timed on the result, the best of 5
+repeats:
+
+    two types   the mean response time of 音同形似 and 音異形似 across every
+                participant, read from the row groups of the two types
+    by stage    every type and stage of the participants of one year
+    one         the trials of one participant, pushed down to the row groups
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from bench_summary import synthetic_trials, STAGES, TRIALS_PER_STAGE
+from warehouse import Warehouse
+
+REPEATS = 5
+
+
+def session_info(i, n_sessions, years):
+    day = int(i * years * 365 / n_sessions)
+    date = np.datetime64("2022-01-01") + np.timedelta64(day, 'D')
+    return {"Participant" : "p%05d" % i, "Number" : str(i), "Gender" : "F",
+            "Age" : "21", "type" : str(i % 4 + 1),
+            "dateStr" : "%s_10h00.00.000" % date, "seed" : i}
+
+
+def queries(warehouse):
+    return [
+        ("two types", lambda: warehouse.summarize(["type"],
+                                                  type=["音同形似", "音異形似"])),
+        ("by stage", lambda: warehouse.summarize(["stage", "type"],
+                                                 since="2023-01", until="2024-01")),
+        ("one", lambda: warehouse.trials(["response_time", "correct"],
+                                         participant="p00042"))]
+
+
+def best(query):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = query()
+        times.append(time.perf_counter() - start)
+    return min(times), len(result)
+
+
+if __name__ == '__main__':
+    n_sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    years = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    trials = synthetic_trials(n_sessions)
+    trials["word1"] = "word1"
+    trials["word2"] = "word2"
+    per_session = len(STAGES) * TRIALS_PER_STAGE
+    dirname = tempfile.mkdtemp(prefix='slp-warehouse-')
+    try:
+        warehouse = Warehouse(dirname)
+        start = time.perf_counter()
+        for i in range(n_sessions):
+            warehouse.add_session(session_info(i, n_sessions, years),
+                trials.iloc[i * per_session:(i + 1) * per_session])
+        ingest = time.perf_counter() - start
+        print("sessions: %d over %d years, trials: %d" % (n_sessions, years, len(trials)))
+        print("ingest          %8.1f ms per session" % (ingest / n_sessions * 1000))
+
+        files = len(warehouse.dataset().files)
+        print("%-12s %10s %10s %12s" % ("query", "files", "rows", "best ms"))
+        for name, query in queries(warehouse):
+            wall, rows = best(query)
+            print("%-12s %10d %10d %12.1f" % (name, files, rows, wall * 1000))
+    finally:
+        shutil.rmtree(dirname)
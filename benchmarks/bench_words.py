@@ -0,0 +1,91 @@
+"""Compare one TextStim per trial object with the pre-rendered word textures
+
+Run from the repository root:
+
+    python benchmarks/bench_words.py
+
+The script opens a window, builds the word stimuli of every trial in
+trials/*.csv the old way (two TextStims for each of the two TrialObjects of
+every target/distractor pair) and with words.prepare_words, and prints the
+construction time and the texture memory of both.
+"""
+import os
+import sys
+import csv
+import glob
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from psychopy import visual, core
+from assets import ASSETS
+from trial import WORD_SIZE
+import words
+
+
+def trial_word_pairs():
+    pairs = []
+    for filename in glob.glob("./trials/*.csv"):
+        with open(filename, encoding='utf-8-sig', newline='') as file:
+            rows = csv.reader(file)
+            next(rows, None)
+            for row in rows:
+                target = row[0]
+                for distractor in row[1:]:
+                    pairs.append((target, distractor))
+                    pairs.append((distractor, target))
+    return pairs
+
+
+def text_stims(win, pairs):
+    stims = []
+    for word1, word2 in pairs:
+        for word in (word1, word2):
+            stim = visual.TextStim(win, text=word, colorSpace='rgb',
+                font=words.FONT, color=[0, 0, 0])
+            stim.size = WORD_SIZE
+            stims.append(stim)
+    return stims
+
+
+def texture_stims(win, pairs, use_disk_cache):
+    ASSETS.clear()
+    stims = []
+    for word1, word2 in pairs:
+        for word in (word1, word2):
+            stims.append(words.word_stim(win, word, WORD_SIZE,
+                use_disk_cache=use_disk_cache))
+    return stims
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    win = visual.Window(allowGUI=False, screen=0, monitor="testMonitor",
+                        units="deg", fullscr=True, color=[255, 255, 255])
+    pairs = trial_word_pairs()
+
+    stims, before = timed(text_stims, win, pairs)
+    before_nbytes = 0
+    for stim in stims:
+        width, height = stim.boundingBox
+        before_nbytes += width * height * 4
+
+    _, cold = timed(texture_stims, win, pairs, False)
+    _, rendered = timed(texture_stims, win, pairs, True)
+    _, warm = timed(texture_stims, win, pairs, True)
+    after_nbytes = ASSETS.nbytes()
+
+    print("trial objects: %d, word stimuli: %d, unique words: %d"
+        % (len(pairs), len(pairs) * 2, len(ASSETS)))
+    print("TextStim per trial object  %8.3f s  %10d bytes" % (before, before_nbytes))
+    print("word textures, rendered    %8.3f s" % cold)
+    print("word textures, disk cache  %8.3f s  (rendered if missing)" % rendered)
+    print("word textures, disk cache  %8.3f s  %10d bytes" % (warm, after_nbytes))
+
+    win.close()
+    core.quit()
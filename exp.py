@@ -1,29 +1,102 @@
-from psychopy import visual, core, event, gui, data, sound
-from psychopy.tools.filetools import fromFile, toFile
-from psychopy.hardware import keyboard
-from trial import TrialObjects, TrialObject, AudioTrialObjects, AudioTrialObject, TrialProcess
-import numpy as np
+# imported first, so the startup profile starts at the launch
+from startup import PROFILE, Background, date_str
+with PROFILE.step("imports: dialog"):
+    from psychopy import gui
+    from psychopy.tools.filetools import fromFile, toFile
+from sink import ResultSink, read_log
+from overview import OverviewStore
+from plan import SessionPlan, compile_plan
+from manifest import get_manifest, AUDIO_STAGES
+from adaptive import ConditionStopping
 import math
-import pandas as pd
 import random
+import argparse
+import glob
 import os
 import json
+import asyncio
 
+# the images shown before the first trial, decoded while the dialog is open
+STARTUP_IMAGES = ["village.jpeg", "monster1.png", "monster2.png", "desert.jpeg",
+                  "instruction1.jpeg", "instruction2.jpeg", "rest.png",
+                  "right.jpeg", "fault.jpeg", "round1.png"]
 
-WIN = None
-STAGE1_PRACTICE_OBJS = None
-STAGE1_FORMER_OBJS = None
-STAGE1_LATTER_OBJS = None
+MODULES_IMPORTED = False
+
+
+def import_modules():
+    """Import the psychopy stimulus stack, pandas and the modules built on
+    them
+
+    They are only needed once the dialog is closed, so the __main__ block
+    imports them in the background while the dialog is open.
+    """
+    global visual, core, event, data, sound, keyboard, np, pd
+    global TrialObjects, TrialObject, AudioTrialObjects, AudioTrialObject
+    global TrialProcess, WORD_SIZE, ASSETS, LazyImage, LazySound, prepare_words
+    global trial_table, summarize, condition_table, STAGE_KEYS
+    global FrameScheduler, Phase, ANY_KEY, FrameTimer, TrialRecords, preload_sounds
+    global get_prefetcher, PREFETCH_WINDOW, Orchestrator, DECODE_WORKERS, Warehouse
+    global SessionInterrupted
+    global MODULES_IMPORTED
+    if MODULES_IMPORTED:
+        return
+    with PROFILE.step("imports: psychopy"):
+        from psychopy import visual, core, event, sound
+        from psychopy.hardware import keyboard
+    with PROFILE.step("imports: pandas"):
+        import numpy as np
+        import pandas as pd
+    with PROFILE.step("imports: experiment"):
+        from trial import TrialObjects, TrialObject, AudioTrialObjects, AudioTrialObject, TrialProcess, SessionInterrupted, WORD_SIZE
+        from assets import ASSETS, DECODE_WORKERS
+        from prefetch import LazyImage, LazySound, get_prefetcher, PREFETCH_WINDOW
+        from words import prepare_words
+        from summary import trial_table, summarize, condition_table, STAGE_KEYS
+        from scheduler import FrameScheduler, Phase, ANY_KEY
+        from timing import FrameTimer
+        from records import TrialRecords
+        from audio import preload_sounds
+        from orchestrator import Orchestrator
+        from warehouse import Warehouse
+    MODULES_IMPORTED = True
+
+# the timing of the startup decode, see assets.DecodeReport
+DECODE_REPORT = None
+
+
+def decode_stimuli(workers=None, memory_cap=None):
+    """Decode the first images and every sound into the asset cache on a
+    thread pool, the stimuli are built from them on the main thread
+
+    Parameters
+    ----------
+    workers : int, optional
+        the threads of the pool, assets.DECODE_WORKERS by default
+    memory_cap : int, optional
+        the memory budget of the asset cache in bytes, set before the
+        decode, assets.MEMORY_CAP by default
+    """
+    global DECODE_REPORT
+    if workers == None:
+        workers = DECODE_WORKERS
+    if memory_cap != None:
+        ASSETS.memory_cap = memory_cap
+    with PROFILE.step("stimulus decode"):
+        files = [os.path.join("./resources/photos", name) for name in STARTUP_IMAGES]
+        files += sorted(glob.glob("./resources/audio/*.wav"))
+        DECODE_REPORT = ASSETS.decode_all(files, workers)
 
-STAGE2_PRACTICE_OBJS = None
-STAGE2_FORMER_OBJS = None
-STAGE2_LATTER_OBJS = None
-REST_IMG = None
 
 NUM_OF_PRACTICES = 10
 NUM_OF_STAGE1_OBJECTS = 10
 
-TYPE = '1'
+# the share of the memory budget of the asset cache filled before the first
+# trial, the rest holds the stimuli loaded while the trials run
+PRELOAD_SHARE = 0.25
+
+PHOTO_DIRNAME = "./resources/photos/"
+AUDIO_DIRNAME = "./resources/audio/"
 
 def get_data_dirname():
     dirname = "experiment_data"
@@ -37,383 +110,527 @@ def get_data_dirname():
     return data_dirname
 
 def dialogue_window():
-    global EXPINFO, TYPE
+    """Ask the operator for the participant info
+
+    Returns
+    -------
+    expinfo : dict
+    """
     try:
-        EXPINFO = fromFile('LastParams.pickle')
+        expinfo = fromFile('LastParams.pickle')
     except:
-        EXPINFO = {'Participant' : '', 'Number': '', 'Gender' : '', 'Age':'', 'type' : '1'}
-    EXPINFO['dateStr'] = data.getDateStr()
+        expinfo = {'Participant' : '', 'Number': '', 'Gender' : '', 'Age':'', 'type' : '1'}
+    expinfo['dateStr'] = date_str()
 
-    dlg = gui.DlgFromDict(EXPINFO, title='Simple SLP Exp', fixed=['dateStr'])
+    dlg = gui.DlgFromDict(expinfo, title='Simple SLP Exp', fixed=['dateStr'])
     if dlg.OK:
-        toFile('LastParams.pickle', EXPINFO) # save params to file for next time
+        toFile('LastParams.pickle', expinfo) # save params to file for next time
     else:
+        from psychopy import core
         core.quit()
-    TYPE = EXPINFO['type']
+    return expinfo
+
+
+class Session(object):
+    """
+    A class used to run the session of one participant station
+
+    A session owns everything that belongs to its station: the window, the
+    keyboard, the result sink and the trial objects built for the window.
+    The decoded images and sounds come from the process-wide ASSETS cache,
+    so several sessions of one process share them, and sessions in
+    different processes share the memory-mapped entries of the stimulus
+    cache, see stations.py.
+
+    Attributes
+    ----------
+    expinfo : dict
+        the participant info, see dialogue_window
+    type : str
+        the session type, '1' to '4'
+    win : psychopy.visual.Window
+    kb : response.ResponseKeyboard, None
+        the keyboard of the station, the process-wide keyboard if it is None
+    scheduler : scheduler.FrameScheduler
+        shows the scenes between the trials
+    timer : timing.FrameTimer, None
+        records every flip of the trials when the timing is on
+    plan : plan.SessionPlan
+    sink : sink.ResultSink
+    listener : callable, None
+        called by the sink with every record it writes, see ResultSink
+    schedule : callable, None
+        builds the schedule of the main rounds, e.g.
+        adaptive.ConditionStopping, every trial is run if it is None
+    trial_objs : dict
+        the TrialObjects of every stage of the manifest
+    resumed : Boolean
+        the session continues an earlier log
+    resumed_data : dict
+        the result rows of the stages of the resumed log, an unfinished
+        stage continues after its rows, see perform_experiment
+    completed_stages : list
+        the stages that have been finished before the session was resumed
+    orchestrator : orchestrator.Orchestrator, None
+        sequences the stages of the running session, see run
+    """
+
+    def __init__(self, expinfo, kb=None, listener=None):
+        self.expinfo = expinfo
+        self.type = expinfo['type']
+        self.kb = kb
+        self.listener = listener
+        self.schedule = None
+        self.win = None
+        self.scheduler = None
+        self.timer = None
+        self.plan = None
+        self.sink = None
+        self.trial_objs = {}
+        self.rest_img = None
+        self.rest_sound_effect = None
+        self.resumed = False
+        self.resumed_data = {}
+        self.completed_stages = []
+        self.orchestrator = None
+
+    @classmethod
+    def resume(cls, filename, kb=None, listener=None):
+        """Continue the session recorded in a result log
 
-def __init__():
-    global WIN, STAGE1_FORMER_OBJS, STAGE1_LATTER_OBJS, STAGE1_PRACTICE_OBJS
-    global STAGE2_FORMER_OBJS, STAGE2_LATTER_OBJS, STAGE2_PRACTICE_OBJS
-    global REST_IMG, REST_SOUND_EFFECT
+        The finished stages are taken from the log, and a stage that was
+        interrupted, by escape or a crash, continues with its first trial
+        that has no row in the log. The trial order is compiled again from
+        the seed of the session plan.
+
+        Raises
+        ------
+        ValueError
+            if the log has no session record, e.g. it is empty
+        """
+        expinfo, resumed_data, completed_stages = read_log(filename)
+        if expinfo == None:
+            raise ValueError("the result log %s has no session record, it "
+                             "cannot be resumed" % filename)
+        session = cls(expinfo, kb, listener)
+        session.resumed = True
+        session.resumed_data = resumed_data
+        session.completed_stages = completed_stages
+        # keep appending to the same log
+        session.sink = ResultSink(filename, listener=listener)
+        return session
+
+    def filename(self, suffix):
+        """Get the path of an output file of the session in the data
+        directory"""
+        return os.path.join(get_data_dirname(),
+            self.expinfo['Participant'] + self.expinfo['dateStr'] + suffix)
+
+    def setup(self, win=None, timing=False, screen=0):
+        """Open the window and build the stimuli of the session
+
+        Parameters
+        ----------
+        win : psychopy.visual.Window, optional
+            a full screen window on the screen is opened by default
+        timing : Boolean, optional
+            record every flip of the trials, see write_timing_report
+        screen : int, optional
+            the screen of the window
+        """
+        # a no-op when the modules have been imported in the background
+        import_modules()
+        if win == None:
+            with PROFILE.step("window"):
+                win = visual.Window(allowGUI=False, screen=screen,
+                                    monitor="testMonitor", units="deg", fullscr=True,
+                                    color=[255, 255, 255])
+        self.win = win
+        self.win.mouseVisible = False
+        with PROFILE.step("frame rate"):
+            self.scheduler = FrameScheduler(self.win, kb=self.kb)
+        if timing:
+            # record every flip of the trials, see write_timing_report
+            self.win.recordFrameIntervals = True
+            self.timer = FrameTimer(self.scheduler.frame_rate)
         
-    WIN = visual.Window(allowGUI=False, screen=0,
-                        monitor="testMonitor", units="deg", fullscr=True,
-                        color=[255, 255, 255])
-    WIN.mouseVisible = False
-    
-    def prepare_trial_objs(config_file_name, photo_dir_name):
-        objs = []
-        df = pd.read_csv(config_file_name)
-        for index, row in df.iterrows():
-            objs.append(TrialObjects(WIN, photo_dir_name, row))
-        assert isinstance(objs, list)
-        return objs
-    
-    def prepare_audio_trial_objs(config_file_name, photo_dir_name, audio_dir_name):
-        objs = []
-        df = pd.read_csv(config_file_name)
-        for index, row in df.iterrows():
-            objs.append(AudioTrialObjects(WIN, photo_dir_name, audio_dir_name, row))
-        assert isinstance(objs, list)
-        return objs
-    
-    STAGE1_FORMER_OBJS = prepare_trial_objs('./trials/stage1_former.csv', './resources/photos/')
-    STAGE1_LATTER_OBJS = prepare_trial_objs('./trials/stage1_latter.csv', './resources/photos/')
-    STAGE1_PRACTICE_OBJS = prepare_trial_objs('./trials/stage1_practice.csv', './resources/photos/')
-    
-    STAGE2_FORMER_OBJS = prepare_audio_trial_objs("./trials/stage2_former.csv", "./resources/photos/", "./resources/audio/")
-    STAGE2_LATTER_OBJS = prepare_audio_trial_objs("./trials/stage2_latter.csv", "./resources/photos/", "./resources/audio/")
-    STAGE2_PRACTICE_OBJS = prepare_audio_trial_objs("./trials/stage2_practice.csv", "./resources/photos/", "./resources/audio/")
-    
-    REST_IMG = visual.ImageStim(WIN, "./resources/photos/rest.png")
-    REST_SOUND_EFFECT = sound.Sound("./resources/audio/rest.wav")
+        with PROFILE.step("manifest"):
+            manifest = get_manifest()
+        with PROFILE.step("trial objects"):
+            for stage, trial_sets in manifest.stages.items():
+                if stage in AUDIO_STAGES:
+                    objs = [AudioTrialObjects(self.win, trial_set)
+                            for trial_set in trial_sets]
+                else:
+                    objs = [TrialObjects(self.win, trial_set)
+                            for trial_set in trial_sets]
+                self.trial_objs[stage] = objs
+        
+        # render the words in the order they are shown and keep the sounds
+        # in memory, as many as fit in the preload budget; the trial
+        # objects load the others from the asset cache when they are shown
+        budget = int(ASSETS.memory_cap * PRELOAD_SHARE)
+        with PROFILE.step("words"):
+            prepare_words(self.win, WORD_SIZE, self.planned_words(), budget=budget)
+        with PROFILE.step("sounds"):
+            preload_sounds(self.win, budget=budget)
+        
+        self.rest_img = LazyImage(self.win, PHOTO_DIRNAME + "rest.png")
+        self.rest_sound_effect = LazySound(self.win, AUDIO_DIRNAME + "rest.wav")
 
-def __del__():
-    global WIN
-    if WIN != None:
-        WIN.close()
-    core.quit()
-    
-def instructions():
-    global WIN
-    scenes = [
-        {
-            "img" : visual.ImageStim(WIN, "./resources/photos/village.jpeg"),
-            "audio" : sound.Sound("./resources/audio/village.wav"),
-            "skip_key" : 'escape'
-        },
-        {
-            "img" : visual.ImageStim(WIN, "./resources/photos/monster1.png"),
-            "audio" : sound.Sound("./resources/audio/monster1-1.wav")
-        },
-        {
-            "img" : visual.ImageStim(WIN, "./resources/photos/monster1.png"),
-            "audio" : sound.Sound("./resources/audio/monster1-2.wav")
-        },
-        {
-            "img" : visual.ImageStim(WIN, "./resources/photos/monster2.png"),
-            "audio" : sound.Sound("./resources/audio/monster2.wav")
-        },
-        {
-            "img" : visual.ImageStim(WIN, "./resources/photos/desert.jpeg"),
-            "audio" : sound.Sound("./resources/audio/desert.wav"),
-        },
-        {
-            "img" : visual.ImageStim(WIN, "./resources/photos/instruction1.jpeg"),
-            "audio" : sound.Sound("./resources/audio/instruction1.wav"),
-        },
-        {
-            "img" : visual.ImageStim(WIN, "./resources/photos/instruction2.jpeg"),
-            "audio" : sound.Sound("./resources/audio/instruction2.wav"),
-        }
-    ]
-    
-    for i in range(len(scenes)):
-        sound_duration = scenes[i]['audio'].getDuration()
-        if scenes[i]["audio"] != None:
-            scenes[i]["audio"].play()
-        scenes[i]["img"].draw()
-        WIN.flip()
-        if 'skip_key' in scenes[i].keys():
-            keys = event.waitKeys(sound_duration, keyList=[scenes[i]["skip_key"]])
-            if keys != None:
-                scenes[i]['audio'].pause()
-                break
+    def planned_words(self):
+        """Get the words of the session in the order they are first shown,
+        None without a plan"""
+        if self.plan == None:
+            return None
+        words = []
+        for stage in self.plan.order:
+            for obj in self.plan.resolve(stage, self.trial_objs[stage]):
+                words += obj.words()
+        return list(dict.fromkeys(words))
+
+    def prepare_plan(self, filename=None):
+        """Load the session plan or compile a new one
+
+        A session that has a seed, e.g. a resumed one, gets the same plan again.
+        The plan is saved next to the data so the session can be replayed.
+        """
+        layout = get_manifest().layout()
+        if filename != None:
+            self.plan = SessionPlan.load(filename)
+            self.type = self.expinfo['type'] = self.plan.type
         else:
-            core.wait(sound_duration)
-    
-    halt_and_show_msg("準備好了嗎? press any key to continue", sec=math.inf, size=1)
-    
-def ending_scene():
-    
-    fleeting_sound = sound.Sound("./resources/audio/fleeting.wav")
-    fleeting_img = visual.ImageStim(WIN, "./resources/photos/fleeting.png")
-    fleeting_img.size *= 0.5
-    fleeting_img.draw()
-    WIN.flip()
-    fleeting_sound.play()
-    event.waitKeys(fleeting_sound.getDuration())
+            self.plan = compile_plan(self.type, layout, seed=self.expinfo.get('seed'),
+                                     num_practices=NUM_OF_PRACTICES)
+        self.plan.validate(layout)
+        self.expinfo['seed'] = self.plan.seed
+        self.plan.save(self.filename('plan.json'))
 
+    def open_sink(self, filename=None):
+        """Start the result log of the session, in the data directory by
+        default"""
+        if filename == None:
+            filename = self.filename('trials.jsonl')
+        self.sink = ResultSink(filename, listener=self.listener)
+        self.sink.write_session(self.expinfo)
 
-    
+    def resume_stages(self, data, stages):
+        """Copy the results of the stages from the resumed log
 
-def output_data(data):
-    global EXPINFO
-    
-    data_dirname = get_data_dirname()
-    
-    filename = os.path.join(data_dirname,
-        EXPINFO['Participant'] + EXPINFO['dateStr'] + 'raw_data.xlsx')
-    
-    df = pd.DataFrame.from_dict(data)
-    df.to_excel(filename)
-    
-    return df
-    
-def update_overview(data):
-    
-    
-    expinfo = EXPINFO
-    
-    
-    stages = ["stage1", "stage2"]
-    types = ["former", "latter"]
-    keys = ["音同形似","音異形似","音同形異","音異形異"]
-    rows = {}
-    for stage in stages:
-        for tp in types:
-            print(stages)
-            data_name = f"{stage}_{tp}"
-            data_list = data[data_name]
-
-            df = pd.DataFrame.from_dict(data_list)
-            try:
-                expinfo[data_name + '_average_response_time'] = df['response_time'].mean()
-                expinfo[data_name + '_correctness_rate'] = df['correct'].mean()
-            except:
-                expinfo[data_name + '_average_response_time'] = 0
-                expinfo[data_name + '_correctness_rate'] = 0
-            
-            row = {}
-            
-            for key in keys:
-                try:
-                    sub_df = df[df.type == key]
-                    row[f"average_response_time_{key}"] = sub_df['response_time'].mean()
-                    row[f"correctness_rate_{key}"] = sub_df['correct'].mean()
-                except:
-                    row[f"average_response_time_{key}"] = 0
-                    row[f"correctness_rate_{key}"] = 0
-            
-            rows[data_name] = row
-    
-    response_time_header = []
-    correctness_rate_header = []
-    for key in keys:
-        correctness_rate_header.append(f"correctness_rate_{key}")
-        response_time_header.append(f"average_response_time_{key}")
-    
-    df = pd.DataFrame.from_dict(rows, orient='index', columns=response_time_header + correctness_rate_header)
-    data_dirname = get_data_dirname()
-    filename = os.path.join(data_dirname,
-        EXPINFO['Participant'] + EXPINFO['dateStr'] + 'statistic_data.xlsx')
-    print(json.dumps(data, indent=4, ensure_ascii=False))
-    print(df)
-    df.to_excel(filename)
-    
-    info = [expinfo]
-    info_df = pd.DataFrame(info)
-    
-    dirname = "experiment_data"
-    filename = os.path.join(dirname, "overview.xlsx")
-    overview_df.to_excel(filename, index=False)
-    if os.path.exists(filename):
-        overview_df = pd.read_excel(filename)
-        overview_df = pd.concat([overview_df, info_df])
-    else:
-        overview_df = info_df
-    
-def the_end_of_stage_scene(text):
-    REST_SOUND_EFFECT.play()
-    halt_and_show_msg(text, sec=max(REST_SOUND_EFFECT.getDuration(), 5))
-    
-    
-def stage1_former_latter(data, start_no_round, final=False):
-    halt_and_show_msg("Stage1 練習開始")
-    practice(STAGE1_PRACTICE_OBJS)
-    halt_and_show_msg("Stage1 練習結束")
-    data['stage1_former'] = perform_experiment(STAGE1_FORMER_OBJS, start_no_round)
-    the_end_of_stage_scene("The end of stage1 former")
-    rest()
-    
-    data['stage1_latter'] = perform_experiment(STAGE1_LATTER_OBJS, start_no_round + 1)
-    the_end_of_stage_scene("The end of stage1 latter")
-    if not final:
-        rest()
-    
-def stage1_latter_former(data, start_no_round, final=False):
-    halt_and_show_msg("Stage1 練習開始")
-    practice(STAGE1_PRACTICE_OBJS)
-    halt_and_show_msg("Stage1 練習結束")
-    data['stage1_latter'] = perform_experiment(STAGE1_LATTER_OBJS, start_no_round)
-    the_end_of_stage_scene("The end of stage1 latter")
-    rest()
-    
-    data['stage1_former'] =  perform_experiment(STAGE1_FORMER_OBJS, start_no_round + 1)
-    the_end_of_stage_scene("The end of stage1 former")
-    if not final:
-        rest()
-    
-def stage2_former_latter(data, start_no_round, final=False):
-    halt_and_show_msg("Stage2 練習開始")
-    practice(STAGE2_PRACTICE_OBJS)
-    halt_and_show_msg("Stage2 練習結束")
-    data['stage2_former'] = perform_experiment(STAGE2_FORMER_OBJS, start_no_round)
-    the_end_of_stage_scene("The end of stage2 former")
-    rest()
-    
-    data['stage2_latter'] = perform_experiment(STAGE2_LATTER_OBJS, start_no_round + 1)
-    the_end_of_stage_scene("The end of stage2 latter")
-    if not final:
-        rest()
-    
+        Returns
+        -------
+        True if every stage has been finished before the session was resumed
+        """
+        if not all(stage in self.completed_stages for stage in stages):
+            return False
+        for stage in stages:
+            data[stage] = TrialRecords.from_rows(self.resumed_data[stage])
+        return True
 
-def stage2_latter_former(data, start_no_round, final=False):
-    halt_and_show_msg("Stage2 練習開始")
-    practice(STAGE2_PRACTICE_OBJS)
-    halt_and_show_msg("Stage2 練習結束")
-    data['stage2_latter'] = perform_experiment(STAGE2_LATTER_OBJS, start_no_round)
-    the_end_of_stage_scene("The end of stage2 latter")
-    rest()
-    
-    data['stage2_former'] = perform_experiment(STAGE2_FORMER_OBJS, start_no_round + 1)
-    the_end_of_stage_scene("The end of stage2 former")
-    if not final:
-        rest()
-   
-   
-    
-def type1():
-    data = {}
-    
-    # stage1 : practice -> former -> latter
-    stage1_former_latter(data, 1)
-    
-    # rest
-    rest()
+    def run(self, json_filename=None):
+        """Run the whole session, the instructions are skipped when it is
+        resumed
 
-    # stage2 : practice -> former -> latter
-    stage2_former_latter(data, 3, True)
-    
-    return data
+        The stages are sequenced by an orchestrator.Orchestrator, which
+        runs the background jobs of the session during the idle scenes.
 
-def type2():
-    data = {}
-    
-    # stage1 : practice -> latter -> former
-    stage1_latter_former(data, 1)
+        Parameters
+        ----------
+        json_filename : str, optional
+            write the results while the ending scene is shown, see
+            write_results
 
-    # rest
-    rest()
-    
-    # stage2 : practice -> latter -> former
-    stage2_latter_former(data, 3, True)
-    
-    return data
-    
-def type3():
-    data = {}
+        Returns
+        -------
+        A dictionary of the TrialRecords of every main stage
+        """
+        self.orchestrator = Orchestrator(self)
+        return asyncio.run(self.orchestrator.run(json_filename))
 
-    # stage2 : practice -> former -> latter
-    stage2_former_latter(data, 1)
-    
-    # rest
-    rest()
-    
-    # stage1 : practice -> latter -> former
-    stage1_latter_former(data, 3, True)
-    
-    return data
-    
-def type4():
-    
-    data = {}
-    # stage2 : practice -> latter -> former
-    stage2_latter_former(data, 1)
-    
-    # rest
-    rest()
-    
-    # stage1 : practice -> former -> latter
-    stage1_former_latter(data, 3, True)
-    
-    
-    return data
-    
+    def prefetch_stage(self, stage):
+        """Decode the round scene and the first trials of a stage, called
+        in the background before the stage starts"""
+        rounds = self.plan.rounds()
+        if stage in rounds:
+            ASSETS.decode(PHOTO_DIRNAME + "round%d.png" % rounds[stage])
+            ASSETS.decode(AUDIO_DIRNAME + "round%d.wav" % rounds[stage])
+            ASSETS.decode(AUDIO_DIRNAME + "round%d_shot.wav" % rounds[stage])
+        objs = self.plan.resolve(stage, self.trial_objs[stage])[:PREFETCH_WINDOW]
+        get_prefetcher().prefetch([stim for obj in objs for stim in obj.stimuli()])
 
-def practice(practice_objs):
-    global WIN, PRACTICE_OBJS, NUM_OF_PRACTICES
-    if NUM_OF_PRACTICES > len(practice_objs):
-        NUM_OF_PRACTICES = len(practice_objs)
+    def summarize_round(self, stage, records):
+        """Build the trial table and the summaries of a finished round
+
+        Returns
+        -------
+        A dictionary of the trial table, the summary by stage and order,
+        and the summary by condition, see summary.py
+        """
+        trials = trial_table({stage : records})
+        return {"trials" : trials,
+                "stages" : summarize(trials, STAGE_KEYS),
+                "conditions" : summarize(trials)}
+
+    def close(self):
+        if self.win != None:
+            self.win.close()
+            self.win = None
         
-    objs = random.sample(practice_objs, NUM_OF_PRACTICES)
-    practice_trial_set = []
-    for i in range(NUM_OF_PRACTICES):
-        trial_objs = objs[i].get_trial_objects()
-        practice_trial_set.append(trial_objs[0])
+    def instructions(self):
+        win = self.win
+        scenes = [
+            {
+                "img" : ASSETS.image(win, "./resources/photos/village.jpeg"),
+                "audio" : ASSETS.sound(win, "./resources/audio/village.wav"),
+                "skip_key" : 'escape'
+            },
+            {
+                "img" : ASSETS.image(win, "./resources/photos/monster1.png"),
+                "audio" : ASSETS.sound(win, "./resources/audio/monster1-1.wav")
+            },
+            {
+                "img" : ASSETS.image(win, "./resources/photos/monster1.png"),
+                "audio" : ASSETS.sound(win, "./resources/audio/monster1-2.wav")
+            },
+            {
+                "img" : ASSETS.image(win, "./resources/photos/monster2.png"),
+                "audio" : ASSETS.sound(win, "./resources/audio/monster2.wav")
+            },
+            {
+                "img" : ASSETS.image(win, "./resources/photos/desert.jpeg"),
+                "audio" : ASSETS.sound(win, "./resources/audio/desert.wav"),
+            },
+            {
+                "img" : ASSETS.image(win, "./resources/photos/instruction1.jpeg"),
+                "audio" : ASSETS.sound(win, "./resources/audio/instruction1.wav"),
+            },
+            {
+                "img" : ASSETS.image(win, "./resources/photos/instruction2.jpeg"),
+                "audio" : ASSETS.sound(win, "./resources/audio/instruction2.wav"),
+            }
+        ]
         
-    trp = TrialProcess(WIN, objs)
-    trp.run(practice_trial_set, True, 3)
-    
+        for i in range(len(scenes)):
+            sound_duration = scenes[i]['audio'].getDuration()
+            if 'skip_key' in scenes[i].keys():
+                keys = self.show([scenes[i]["img"]], sound_duration,
+                    [scenes[i]["skip_key"]], sounds=[scenes[i]["audio"]])
+                if keys != None:
+                    scenes[i]['audio'].pause()
+                    break
+            else:
+                self.show([scenes[i]["img"]], sound_duration, None,
+                    sounds=[scenes[i]["audio"]])
+        
+        self.halt_and_show_msg("準備好了嗎? press any key to continue", sec=math.inf, size=1)
+        
+    def ending_scene(self):
+        
+        fleeting_sound = ASSETS.sound(self.win, "./resources/audio/fleeting.wav")
+        fleeting_img = ASSETS.image(self.win, "./resources/photos/fleeting.png", 0.5)
+        self.show([fleeting_img], fleeting_sound.getDuration(), ANY_KEY,
+            sounds=[fleeting_sound])
 
-def perform_experiment(stage_objs, no_round):
-    global WIN
-    
-    trp = TrialProcess(WIN, stage_objs, no_round)
-    dt = trp.run()
-    
-    return dt
-    
+    def write_results(self, data, json_filename="data.json", rounds=None):
+        """Write the data of a finished session: the json dump, the raw data
+        workbook, the timing report, the summaries in the overview and the
+        trials in the warehouse
 
-def halt_and_show_msg(text, sec=5, keyList=None, size=2):
-    global WIN
-    
-    text_stim = visual.TextStim(WIN, text=text, 
-        color=[0, 0, 0], font="Songti SC")
-    text_stim.size = size
-    text_stim.draw()
-    WIN.flip()
-    event.waitKeys(sec, keyList=keyList)
-    WIN.flip()
-
-def rest():
-#    text_stim = visual.TextStim(WIN, text="Rest", 
-#        color=[0, 0, 0], font="Songti SC")
-#    text_stim.size = 2
-#    text_stim.draw()
-    REST_IMG.draw()
-    WIN.flip()
-    keys1 = event.waitKeys(keyList=['lctrl'])
-    keys2 = event.waitKeys(keyList=['w'])
-    WIN.flip()
+        Parameters
+        ----------
+        data : dict
+            the TrialRecords of every main stage
+        json_filename : str, optional
+        rounds : dict, optional
+            the summaries of the rounds computed while the session ran, see
+            summarize_round, the missing ones are computed here
+        """
+        with open(json_filename, "w") as file:
+            json.dump({name : records.rows() for name, records in data.items()},
+                file, indent=4, ensure_ascii=False)
+        
+        rounds = dict(rounds or {})
+        for name, records in data.items():
+            if name not in rounds:
+                rounds[name] = self.summarize_round(name, records)
+        # the stage and order columns let the raw data be re-analysed offline
+        if data:
+            trials = pd.concat([rounds[name]["trials"] for name in data],
+                               ignore_index=True)
+        else:
+            trials = trial_table(data)
+        self.output_data(trials)
+        
+        if self.timer != None:
+            self.write_timing_report()
+        self.update_overview(trials, [rounds[name] for name in data])
+        # every trial of the session, for the queries across sessions
+        Warehouse().add_session(self.expinfo, trials)
+
+    def output_data(self, data):
+        df = pd.DataFrame(data)
+        df.to_excel(self.filename('raw_data.xlsx'))
+        
+        return df
+        
+    def update_overview(self, trials, rounds=None):
+        """Add the summaries to expinfo and the overview, the summaries of
+        the rounds are concatenated if they are given"""
+        expinfo = self.expinfo
+        if rounds:
+            stages = pd.concat([r["stages"] for r in rounds]).sort_index()
+            summary = pd.concat([r["conditions"] for r in rounds]).sort_index()
+        else:
+            stages = summarize(trials, STAGE_KEYS)
+            summary = summarize(trials)
+        
+        for (stage, order), row in stages.iterrows():
+            data_name = f"{stage}_{order}"
+            expinfo[data_name + '_average_response_time'] = row['mean_rt']
+            expinfo[data_name + '_correctness_rate'] = row['accuracy']
+        
+        df = condition_table(summary)
+        print(df)
+        with pd.ExcelWriter(self.filename('statistic_data.xlsx')) as writer:
+            df.to_excel(writer, sheet_name='conditions')
+            summary.to_excel(writer, sheet_name='summary')
+        
+        # one atomic insert, overview.xlsx is exported with python overview.py
+        store = OverviewStore()
+        store.add_session(expinfo)
+        store.close()
+        
+    def the_end_of_stage_scene(self, text):
+        self.halt_and_show_msg(text, sec=max(self.rest_sound_effect.getDuration(), 5),
+            sounds=[self.rest_sound_effect])
+        
+    def practice(self, practice_objs, stage):
+        # the practice trials have been drawn by the session plan
+        trp = TrialProcess(self.win, practice_objs, kb=self.kb, timer=self.timer,
+                           plan=self.plan, stage=stage)
+        return trp.run(None, True, 3, stage=stage)
+
+    def perform_experiment(self, stage_objs, no_round, stage=None):
+        
+        if stage in self.completed_stages:
+            return TrialRecords.from_rows(self.resumed_data[stage])
+        
+        trp = TrialProcess(self.win, stage_objs, no_round, kb=self.kb,
+                           timer=self.timer, plan=self.plan, stage=stage)
+        resumed = self.resumed_data.get(stage)
+        if resumed:
+            # continue with the trial after the last row in the log
+            self.sink.resume_stage(stage, len(resumed))
+        else:
+            self.sink.start_stage(stage)
+        dt = trp.run(sink=self.sink, stage=stage, schedule=self.schedule,
+                     resumed=resumed)
+        # the planned and actual onsets of the round are kept with its results
+        self.sink.write_report(stage, {"onsets" : trp.precision_report(),
+                                       "audio" : trp.audio_report(),
+                                       "schedule" : trp.schedule.report()})
+        self.sink.end_stage(stage)
+        
+        return dt
+
+    def write_timing_report(self):
+        """Write the frame timing report of the session and add its verdict
+        to expinfo, so a session with too many dropped frames is flagged in
+        the overview. The counters of the asset cache follow the report."""
+        filename = self.filename('timing.txt')
+        report = self.timer.write_report(filename)
+        # the evictions tell whether --memory-budget was too small
+        with open(filename, 'a') as file:
+            file.write("\nasset cache     %s\n" % " ".join(
+                "%s=%d" % item for item in ASSETS.stats().items()))
+        self.expinfo['dropped_frames'] = report["dropped_frames"]
+        self.expinfo['dropped_ratio'] = report["dropped_ratio"]
+        self.expinfo['timing_flagged'] = report["flagged"]
+        if report["flagged"]:
+            print("timing: %d frames dropped, see %s" % (report["dropped_frames"],
+                                                         filename))
+        return report
+
+    def show(self, stims, sec, keyList, on_onset=None, sounds=()):
+        """Show the stimuli for sec seconds or until a key in keyList is
+        pressed, and return the pressed keys or None. The sounds start with
+        the first flip."""
+        keys, _, _ = self.scheduler.run([Phase("scene", stims, sec, keyList,
+                                               on_onset, sounds=sounds)])
+        return keys
+
+    def halt_and_show_msg(self, text, sec=5, keyList=None, size=2, sounds=()):
+        text_stim = ASSETS.text(self.win, text, size)
+        self.show([text_stim], sec, keyList if keyList != None else ANY_KEY,
+            sounds=sounds)
+        self.win.flip()
+
+    def rest(self):
+    #    text_stim = visual.TextStim(WIN, text="Rest", 
+    #        color=[0, 0, 0], font="Songti SC")
+    #    text_stim.size = 2
+    #    text_stim.draw()
+        keys1 = self.show([self.rest_img], math.inf, ['lctrl'])
+        keys2 = self.show([self.rest_img], math.inf, ['w'])
+        self.win.flip()
 
 if __name__ == '__main__':
-    dialogue_window()
-    __init__()
-    instructions()
-    data = eval("type"+TYPE)()
-    ending_scene()
-    
-    combined_data = []
-    for key in data:
-        combined_data += data[key]
-    
-    with open("data.json", "w") as file:
-        json.dump(data, file, indent=4, ensure_ascii=False)
-    
-    df = output_data(combined_data)
-    
-    update_overview(data)
+    parser = argparse.ArgumentParser()
+    # a resumed session compiles its plan again from the seed in its log
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument('--resume', metavar='LOG',
+        help='continue the session recorded in a trials.jsonl log at its first '
+             'trial without a result')
+    start.add_argument('--plan', metavar='PLAN',
+        help='run the session plan compiled by plan.py')
+    parser.add_argument('--timing', action='store_true',
+        help='record every flip and write a frame timing report')
+    parser.add_argument('--profile-startup', action='store_true',
+        help='print how long every step of the startup takes and quit')
+    parser.add_argument('--adaptive', action='store_true',
+        help='stop every condition of a round once its estimates converge')
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+        help='the memory of the decoded stimuli kept by the asset cache')
+    parser.add_argument('--decode-workers', type=int, metavar='N',
+        help='the threads that decode the stimuli at startup')
+    args = parser.parse_args()
+    memory_cap = None
+    if args.memory_budget != None:
+        memory_cap = args.memory_budget * 1024 * 1024
+    
+    # the heavy imports and the first stimuli are loaded while the operator
+    # fills in the dialog, under the memory budget of the asset cache
+    background = Background(import_modules,
+                            lambda: decode_stimuli(args.decode_workers, memory_cap))
+    if args.resume:
+        session = Session.resume(args.resume)
+    else:
+        with PROFILE.step("dialog"):
+            session = Session(dialogue_window())
+    background.finish()
+    if args.profile_startup:
+        session.setup(timing=args.timing)
+        print(PROFILE.report())
+        print(DECODE_REPORT.report())
+        session.close()
+        core.quit()
+    if args.adaptive or session.expinfo.get('adaptive'):
+        # recorded in the session info, so a resumed session stays adaptive
+        session.schedule = ConditionStopping
+        session.expinfo['adaptive'] = True
+    if args.resume:
+        session.prepare_plan()
+    else:
+        session.prepare_plan(args.plan)
+        session.open_sink()
+    session.setup(timing=args.timing)
+    try:
+        session.run(session.filename('data.json'))
+    except SessionInterrupted as e:
+        # the log ends with the last recorded trial of the stage
+        session.sink.close()
+        print(e)
+        print("continue with: python exp.py --resume " + session.sink.filename)
     
 #    halt_and_show_msg("""
 #    Thank you for your participation
@@ -430,4 +647,5 @@ if __name__ == '__main__':
 #    程式設計：林友鈞
 #    """)
 
-    __del__()
+    session.close()
+    core.quit()
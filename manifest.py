@@ -0,0 +1,248 @@
+"""Compile the trial files into a stimulus manifest
+
+    python manifest.py [--output FILE]
+
+The six trial files of plan.STAGES are validated and compiled into one
+JSON manifest. Every row of a trial file becomes a trial set: the target
+word, the resolved paths of its photo (and of its recording in the audio
+stages), and its test words with their condition types. The words are
+interned in one list, and the condition columns of the practice files
+(音似形似, 音似形異) are normalized to the names of the main files, see
+TYPE_ALIASES. Compiling checks that every row is complete, every condition
+is known and every photo and recording exists, and reports all problems
+at once.
+
+exp.py loads the manifest with get_manifest(), which only reads the JSON
+file and compares the size and modification time of the trial files, so
+the launch doesn't parse any CSV or import pandas for it. A manifest
+whose trial files have changed is compiled again.
+"""
+from plan import STAGES, TRIALS_DIRNAME
+import argparse
+import hashlib
+import json
+import csv
+import os
+import threading
+
+VERSION = 1
+
+PHOTOS_DIRNAME = "./resources/photos"
+AUDIO_DIRNAME = "./resources/audio"
+MANIFEST_FILENAME = os.path.join("cache", "manifest.json")
+
+# the stages whose trials play the recording of the target word
+AUDIO_STAGES = ["stage2_former", "stage2_latter", "stage2_practice"]
+
+TARGET_COLUMN = "目標詞彙"
+
+TYPES = ["音同形似", "音異形似", "音同形異", "音異形異"]
+
+# the practice files name the conditions with 似 instead of 同
+TYPE_ALIASES = {"音似形似" : "音同形似", "音似形異" : "音同形異"}
+
+
+class TrialSet(object):
+    """
+    A class used to represent a row of a trial file
+
+    Attributes
+    ----------
+    target : str
+        the target word, the name of the photo
+    photo : str
+        the path of the photo
+    audio : str, None
+        the path of the recording of the target, None outside the audio
+        stages
+    tests : list
+        a (word, type) tuple for every test word, in the order of the
+        columns
+    """
+
+    __slots__ = ("target", "photo", "audio", "tests")
+
+    def __init__(self, target, photo, audio, tests):
+        self.target = target
+        self.photo = photo
+        self.audio = audio
+        self.tests = tests
+
+
+class Manifest(object):
+    """
+    A class used to represent the compiled trial files
+
+    Attributes
+    ----------
+    stages : dict
+        the TrialSet list of every stage, in the order of the rows
+    sources : dict
+        the filename, size, modification time and SHA-1 of the trial file
+        of every stage
+    """
+
+    def __init__(self, stages, sources):
+        self.stages = stages
+        self.sources = sources
+
+    def layout(self):
+        """Count the trials of every trial set, see plan.read_layout"""
+        return {stage : [2 * len(trial_set.tests) for trial_set in trial_sets]
+                for stage, trial_sets in self.stages.items()}
+
+    def is_stale(self):
+        """Check if a trial file has changed since the manifest was compiled"""
+        for source in self.sources.values():
+            try:
+                stat = os.stat(source["filename"])
+            except OSError:
+                return True
+            if stat.st_size == source["size"] and stat.st_mtime_ns == source["mtime_ns"]:
+                continue
+            # touched, e.g. by a checkout, but maybe not changed
+            if file_sha1(source["filename"]) != source["sha1"]:
+                return True
+        return False
+
+    def to_dict(self):
+        words = {}
+
+        def intern(word):
+            return words.setdefault(word, len(words))
+
+        stages = {}
+        for stage, trial_sets in self.stages.items():
+            stages[stage] = [[intern(trial_set.target), trial_set.photo, trial_set.audio,
+                              [[intern(word), TYPES.index(_type)]
+                               for word, _type in trial_set.tests]]
+                             for trial_set in trial_sets]
+        return {"version" : VERSION,
+                "sources" : self.sources,
+                "words" : list(words),
+                "types" : TYPES,
+                "stages" : stages}
+
+    @classmethod
+    def from_dict(cls, manifest):
+        if manifest.get("version") != VERSION:
+            raise ValueError("unsupported manifest version %s" % manifest.get("version"))
+        words = manifest["words"]
+        types = manifest["types"]
+        stages = {}
+        for stage, trial_sets in manifest["stages"].items():
+            stages[stage] = [TrialSet(words[target], photo, audio,
+                                      [(words[word], types[_type]) for word, _type in tests])
+                             for target, photo, audio, tests in trial_sets]
+        return cls(stages, manifest["sources"])
+
+    def save(self, filename=MANIFEST_FILENAME):
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # written under a temporary name, so a reader never sees half a file,
+        # of its own thread, as the stations of stations.py --threads
+        # compile the manifest at the same time
+        temporary = "%s.%d.%d.tmp" % (filename, os.getpid(), threading.get_ident())
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, filename=MANIFEST_FILENAME):
+        with open(filename, encoding='utf-8') as file:
+            return cls.from_dict(json.load(file))
+
+
+def file_sha1(filename):
+    with open(filename, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def compile_manifest(trials_dirname=TRIALS_DIRNAME, photos_dirname=PHOTOS_DIRNAME,
+                     audio_dirname=AUDIO_DIRNAME):
+    """Validate and compile the trial files
+
+    Returns
+    -------
+    Manifest
+
+    Raises
+    ------
+    ValueError
+        lists every problem of the trial files: a missing file, an unknown
+        or repeated condition, an incomplete row or a missing photo or
+        recording
+    """
+    errors = []
+    stages = {}
+    sources = {}
+    for stage in STAGES:
+        filename = os.path.join(trials_dirname, stage + ".csv")
+        try:
+            with open(filename, encoding='utf-8-sig', newline='') as file:
+                rows = [[cell.strip() for cell in row] for row in csv.reader(file)]
+        except OSError as e:
+            errors.append("%s: %s" % (filename, e.strerror))
+            continue
+        stat = os.stat(filename)
+        sources[stage] = {"filename" : filename, "size" : stat.st_size,
+                          "mtime_ns" : stat.st_mtime_ns, "sha1" : file_sha1(filename)}
+        if not rows or rows[0][:1] != [TARGET_COLUMN]:
+            errors.append("%s: the first column must be %s" % (filename, TARGET_COLUMN))
+            continue
+
+        types = [TYPE_ALIASES.get(name, name) for name in rows[0][1:]]
+        for name in types:
+            if name not in TYPES:
+                errors.append("%s: unknown condition %s" % (filename, name))
+            elif types.count(name) > 1:
+                errors.append("%s: repeated condition %s" % (filename, name))
+
+        trial_sets = []
+        for line, row in enumerate(rows[1:], 2):
+            if not any(row):
+                continue
+            if len(row) != len(rows[0]) or not all(row):
+                errors.append("%s:%d: expected %d words" % (filename, line, len(rows[0])))
+                continue
+            target = row[0]
+            photo = os.path.join(photos_dirname, target + ".jpeg")
+            if not os.path.isfile(photo):
+                errors.append("%s:%d: missing photo %s" % (filename, line, photo))
+            audio = None
+            if stage in AUDIO_STAGES:
+                audio = os.path.join(audio_dirname, target + ".wav")
+                if not os.path.isfile(audio):
+                    errors.append("%s:%d: missing recording %s" % (filename, line, audio))
+            trial_sets.append(TrialSet(target, photo, audio, list(zip(row[1:], types))))
+        stages[stage] = trial_sets
+
+    if errors:
+        raise ValueError("invalid trial files:\n" + "\n".join(errors))
+    return Manifest(stages, sources)
+
+
+def get_manifest(filename=MANIFEST_FILENAME):
+    """Load the manifest, compile and save it again if it is missing or
+    its trial files have changed"""
+    try:
+        manifest = Manifest.load(filename)
+        if not manifest.is_stale():
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    manifest = compile_manifest()
+    manifest.save(filename)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', default=MANIFEST_FILENAME)
+    args = parser.parse_args()
+
+    manifest = compile_manifest()
+    manifest.save(args.output)
+    print("%s: %d trial sets" % (args.output, sum(len(trial_sets)
+                                               for trial_sets in manifest.stages.values())))
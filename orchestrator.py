@@ -0,0 +1,299 @@
+"""Run the stages of a session as coroutines
+
+The stages of a session (the instructions, the practice and the two
+rounds of every stage, the scenes between them and the ending) are
+coroutines of an Orchestrator, run in the order of the session plan. They
+don't touch the window themselves: every scene or round is a request to
+the display driver, a single task that runs the requests one after the
+other with the blocking flip loop of the FrameScheduler.
+
+A request is either timed (the practice and the rounds) or idle (the
+narration, the messages, the rest screen and the ending scene), which only
+wait for the participant or the experimenter. Background jobs are queued
+with background() and started on a thread pool when the next idle scene
+begins, so they run while the participant rests or listens instead of
+piling up at the end of the session:
+
+    prefetch    decode the round scene and the first trials of the next
+                stage, see exp.Session.prefetch_stage. A failed prefetch
+                is printed and ignored, the stimuli are then loaded when
+                the trials need them
+    summary     build the trial table and the summaries of a finished
+                round, see exp.Session.summarize_round
+    results     close the result log and write the data files while the
+                ending scene is shown, see exp.Session.write_results
+
+Before a timed request the driver waits for the running jobs, so no job
+shares the interpreter with the trials.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+# the threads of the background jobs
+WORKERS = 2
+
+
+class Job(object):
+    """
+    A class used to represent a background job
+
+    Attributes
+    ----------
+    name : str
+    future : asyncio.Future
+        the result of the job
+    queued, started, finished : float, None
+        perf_counter() times, None until the job gets there
+    scene : str, None
+        the idle scene the job has been started with
+    """
+
+    def __init__(self, name, function, args, future):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.future = future
+        self.queued = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self.scene = None
+
+    def __call__(self):
+        self.started = time.perf_counter()
+        try:
+            return self.function(*self.args)
+        finally:
+            self.finished = time.perf_counter()
+
+
+class Orchestrator(object):
+    """
+    A class used to sequence the stages of an exp.Session
+
+    Attributes
+    ----------
+    session : exp.Session
+        a session whose plan, sink and stimuli are ready, see Session.setup
+    jobs : list
+        every Job queued so far
+    """
+
+    def __init__(self, session, workers=WORKERS):
+        self.session = session
+        self.jobs = []
+        self.__workers = workers
+        self.__executor = None
+        self.__requests = None
+        self.__queued = []
+        self.__running = []
+
+    def background(self, name, function, *args):
+        """Queue a job for the next idle scene
+
+        Returns
+        -------
+        An asyncio.Future of the result of function(*args)
+        """
+        job = Job(name, function, args, asyncio.get_running_loop().create_future())
+        self.jobs.append(job)
+        self.__queued.append(job)
+        return job.future
+
+    def prefetch(self, stage):
+        """Queue the prefetch of a stage for the next idle scene, see
+        exp.Session.prefetch_stage"""
+        return self.background("prefetch " + stage, self.__prefetch, stage)
+
+    def __prefetch(self, stage):
+        try:
+            self.session.prefetch_stage(stage)
+        except Exception as e:
+            # the trials load the stimuli that haven't been decoded, so it
+            # only costs time, the session goes on
+            print("prefetch failed:", stage, e)
+
+    async def display(self, function, *args, idle=True):
+        """Ask the display driver to run a blocking call on the window and
+        wait for its result
+
+        Parameters
+        ----------
+        function : callable
+            a scene or a round of the session, e.g. Session.rest
+        idle : Boolean, optional
+            False for the trials, which don't run with any background job
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.__requests.put((function, args, idle, future))
+        return await future
+
+    def __start(self, scene=None):
+        loop = asyncio.get_running_loop()
+        for job in self.__queued:
+            job.scene = scene
+            task = loop.run_in_executor(self.__executor, job)
+            task.add_done_callback(lambda task, job=job: self.__done(job, task))
+            self.__running.append(task)
+        self.__queued = []
+
+    def __done(self, job, task):
+        self.__running.remove(task)
+        if task.exception() != None:
+            job.future.set_exception(task.exception())
+        else:
+            job.future.set_result(task.result())
+
+    async def __drive(self):
+        while True:
+            request = await self.__requests.get()
+            if request == None:
+                return
+            function, args, idle, future = request
+            if idle:
+                self.__start(function.__name__)
+            elif self.__running:
+                # the trials don't share the interpreter with the jobs
+                await asyncio.wait(list(self.__running))
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                # e.g. the SystemExit of core.quit(), raised in the stage
+                future.set_exception(e)
+
+    async def join(self):
+        """Start the queued jobs and wait for every job
+
+        Raises
+        ------
+        the exception of the first job that failed, which is the results
+        job: the prefetch jobs don't fail and the summaries are awaited
+        before the ending scene
+        """
+        self.__start()
+        for job in self.jobs:
+            await job.future
+
+    async def run(self, json_filename=None):
+        """Run the whole session, the instructions are skipped when it is
+        resumed, and so is the practice of a stage whose rounds have started
+
+        Parameters
+        ----------
+        json_filename : str, optional
+            the results are written with Session.write_results while the
+            ending scene is shown, they are not written by default
+
+        Returns
+        -------
+        A dictionary of the TrialRecords of every main stage
+
+        Raises
+        ------
+        trial.SessionInterrupted
+            if the participant pressed escape, the jobs that have started
+            are finished first
+        """
+        self.__requests = asyncio.Queue()
+        self.__executor = ThreadPoolExecutor(self.__workers,
+                                             thread_name_prefix="background")
+        driver = asyncio.ensure_future(self.__drive())
+        try:
+            data = await self.__session(json_filename)
+            await self.__requests.put(None)
+            await driver
+            return data
+        finally:
+            driver.cancel()
+            self.__executor.shutdown(wait=True)
+
+    async def __session(self, json_filename):
+        session = self.session
+        order = session.plan.order
+        if not session.resumed:
+            self.prefetch(order[0])
+            await self.display(session.instructions)
+
+        data = {}
+        summaries = {}
+        # a practice and two rounds for every stage
+        for i in range(0, len(order), 3):
+            await self.run_stage(data, summaries, order[i:i + 3], order[i + 3:i + 4],
+                                 final=i + 3 >= len(order))
+            if i + 3 < len(order):
+                await self.display(session.rest)
+
+        # the summaries have been computed during the last scenes
+        rounds = {name : await future for name, future in summaries.items()}
+        if json_filename != None:
+            self.background("results", self.__write_results, data, json_filename,
+                            rounds)
+        else:
+            self.background("results", session.sink.close)
+        await self.display(session.ending_scene)
+        await self.join()
+        return data
+
+    def __write_results(self, data, json_filename, rounds):
+        self.session.sink.close()
+        self.session.write_results(data, json_filename, rounds)
+
+    async def run_stage(self, data, summaries, stages, next_stages, final=False):
+        """Run the practice and the two rounds of a stage
+
+        Parameters
+        ----------
+        data : dict
+            the results of the session, the results of the rounds are added
+        summaries : dict
+            the futures of the round summaries, the rounds are added
+        stages : list
+            the practice and the two rounds, in the order they are run
+        next_stages : list
+            the stage run after these ones, if any
+        final : Boolean, optional
+            there is no rest after the last stage of the session
+        """
+        session = self.session
+        practice, first, second = stages
+        if session.resume_stages(data, [first, second]):
+            return
+        rounds = session.plan.rounds()
+        stage = practice.partition("_")[0]
+        title = stage[0].upper() + stage[1:]
+        if session.resumed_data.get(first):
+            # the stage was interrupted after its practice
+            self.prefetch(first)
+        else:
+            await self.display(session.halt_and_show_msg, title + " 練習開始")
+            await self.display(session.practice, session.trial_objs[practice],
+                               practice, idle=False)
+            self.prefetch(first)
+            await self.display(session.halt_and_show_msg, title + " 練習結束")
+
+        for name, upcoming in [(first, [second]), (second, next_stages)]:
+            data[name] = await self.display(session.perform_experiment,
+                                            session.trial_objs[name], rounds[name],
+                                            name, idle=False)
+            summaries[name] = self.background("summary " + name,
+                                              session.summarize_round, name, data[name])
+            for stage in upcoming:
+                self.prefetch(stage)
+            await self.display(session.the_end_of_stage_scene,
+                               "The end of " + name.replace("_", " "))
+            if name == first or not final:
+                await self.display(session.rest)
+
+    def report(self):
+        """Get the timing of every background job
+
+        Returns
+        -------
+        A list of dictionaries with the name of every job, the idle scene
+        it has been started with, and how long it waited and ran in seconds
+        """
+        return [{"job" : job.name,
+                 "scene" : job.scene,
+                 "waited" : job.started - job.queued if job.started != None else None,
+                 "ran" : job.finished - job.started if job.finished != None else None}
+                for job in self.jobs]
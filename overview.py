@@ -0,0 +1,150 @@
+import sqlite3
+import json
+import time
+import sys
+import os
+
+DB_FILENAME = os.path.join("experiment_data", "overview.sqlite")
+EXCEL_FILENAME = os.path.join("experiment_data", "overview.xlsx")
+
+# seconds a writer waits for another station to finish its insert
+BUSY_TIMEOUT = 30
+
+
+class OverviewStore(object):
+    """
+    A class used to store the overview row of every session
+
+    The rows live in a SQLite database in WAL mode, so recording a session
+    is a single atomic insert whose cost doesn't grow with the number of
+    sessions already recorded, and several stations can write to the same
+    database file concurrently. The overview.xlsx workbook is exported from
+    the database on demand.
+
+    The participant info and the summary statistics of a session are
+    stored as a JSON object, with the participant and the date copied to
+    indexed columns for lookups.
+    """
+
+    def __init__(self, filename=DB_FILENAME):
+        """
+        Parameters
+        ----------
+        filename : str, optional
+            the path of the database, created if it doesn't exist
+        """
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.filename = filename
+        self.__conn = sqlite3.connect(filename, timeout=BUSY_TIMEOUT)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        with self.__conn:
+            self.__conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY,
+                    participant TEXT,
+                    date TEXT,
+                    recorded REAL,
+                    info TEXT)""")
+            self.__conn.execute("""
+                CREATE INDEX IF NOT EXISTS sessions_participant
+                ON sessions (participant)""")
+            self.__conn.execute("""
+                CREATE INDEX IF NOT EXISTS sessions_date
+                ON sessions (date)""")
+
+    def add_session(self, info):
+        """Record the overview row of a session
+
+        Parameters
+        ----------
+        info : dict
+            the participant info and the statistics of the session, the
+            'Participant' and 'dateStr' keys are indexed
+
+        Returns
+        -------
+        the id of the new row
+        """
+        with self.__conn:
+            cursor = self.__conn.execute(
+                "INSERT INTO sessions (participant, date, recorded, info) "
+                "VALUES (?, ?, ?, ?)",
+                (info.get('Participant'), info.get('dateStr'), time.time(),
+                 json.dumps(info, ensure_ascii=False, default=float)))
+        return cursor.lastrowid
+
+    def sessions(self, participant=None, since=None):
+        """Get the overview rows in the order they were recorded
+
+        Parameters
+        ----------
+        participant : str, optional
+            only return the sessions of this participant
+        since : str, optional
+            only return the sessions whose dateStr is not earlier than this
+
+        Returns
+        -------
+        A list of dictionaries
+        """
+        query = "SELECT info FROM sessions"
+        conditions = []
+        params = []
+        if participant != None:
+            conditions.append("participant = ?")
+            params.append(participant)
+        if since != None:
+            conditions.append("date >= ?")
+            params.append(since)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id"
+        return [json.loads(info) for info, in self.__conn.execute(query, params)]
+
+    def __len__(self):
+        return self.__conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def import_excel(self, filename=EXCEL_FILENAME):
+        """Copy the rows of an old overview workbook into the database
+
+        Returns
+        -------
+        the number of imported rows
+        """
+        import pandas as pd
+
+        df = pd.read_excel(filename)
+        rows = df.astype(object).where(df.notna(), None).to_dict('records')
+        for row in rows:
+            self.add_session(row)
+        return len(rows)
+
+    def export_excel(self, filename=EXCEL_FILENAME):
+        """Write every overview row to a workbook
+
+        Returns
+        -------
+        pandas.DataFrame
+            the exported rows
+        """
+        import pandas as pd
+
+        df = pd.DataFrame(self.sessions())
+        df.to_excel(filename, index=False)
+        return df
+
+    def close(self):
+        self.__conn.close()
+
+
+if __name__ == '__main__':
+    # python overview.py [--import old_overview.xlsx]
+    store = OverviewStore()
+    if len(sys.argv) > 2 and sys.argv[1] == '--import':
+        print("imported", store.import_excel(sys.argv[2]), "sessions")
+    store.export_excel()
+    print("exported", len(store), "sessions to", EXCEL_FILENAME)
+    store.close()
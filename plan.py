@@ -0,0 +1,239 @@
+"""Compile the randomization of a session into a plan
+
+    python plan.py --type 1 [--count N] [--seed S] [--output DIR]
+
+A plan resolves every random choice of a session once: the order of the
+stages given by the session type, the practice trials and the order of the
+trials of every round. A trial is identified by the index of its trial set
+(the row of the trial file) and its index in TrialObjects.trial_objects,
+so a plan is a small JSON file that can be generated in bulk for a cohort,
+loaded at startup and replayed exactly, e.g. headlessly with simulation.py.
+"""
+import argparse
+import random
+import json
+import csv
+import os
+
+VERSION = 1
+
+TRIALS_DIRNAME = "./trials"
+
+NUM_OF_PRACTICES = 10
+
+STAGES = ["stage1_former", "stage1_latter", "stage1_practice",
+          "stage2_former", "stage2_latter", "stage2_practice"]
+
+# the rounds of every session type in the order they are run, a practice
+# and two rounds for every stage, see orchestrator.Orchestrator
+SESSION_ORDERS = {
+    '1' : ["stage1_practice", "stage1_former", "stage1_latter",
+           "stage2_practice", "stage2_former", "stage2_latter"],
+    '2' : ["stage1_practice", "stage1_latter", "stage1_former",
+           "stage2_practice", "stage2_latter", "stage2_former"],
+    '3' : ["stage2_practice", "stage2_former", "stage2_latter",
+           "stage1_practice", "stage1_latter", "stage1_former"],
+    '4' : ["stage2_practice", "stage2_latter", "stage2_former",
+           "stage1_practice", "stage1_former", "stage1_latter"],
+}
+
+
+def read_layout(trials_dirname=TRIALS_DIRNAME):
+    """Count the trials of every trial set without building the stimuli
+
+    Returns
+    -------
+    A dictionary from every stage in STAGES to a list with the number of
+    trials of each of its trial sets, a target word and every test word in
+    both orders
+    """
+    layout = {}
+    for name in STAGES:
+        filename = os.path.join(trials_dirname, name + ".csv")
+        with open(filename, encoding='utf-8-sig', newline='') as file:
+            rows = csv.reader(file)
+            header = next(rows)
+            layout[name] = [2 * (len(header) - 1) for row in rows if row]
+    return layout
+
+
+def stage_layout(trial_objs_set):
+    """Count the trials of the trial sets of a stage, see read_layout"""
+    return [len(objs.trial_objects) for objs in trial_objs_set]
+
+
+class SessionPlan(object):
+    """
+    A class used to represent the randomization of a whole session
+
+    Attributes
+    ----------
+    seed : int
+        the seed the plan has been compiled with
+    type : str
+        the session type, '1' to '4'
+    order : list
+        the stages in the order they are run
+    trials : dict
+        the (trial set, trial) index pairs of every stage in the order
+        they are shown
+    layout : dict
+        the number of trials of every trial set, see read_layout
+    """
+
+    def __init__(self, seed, session_type, order, trials, layout):
+        self.seed = seed
+        self.type = session_type
+        self.order = order
+        self.trials = trials
+        self.layout = layout
+
+    def rounds(self):
+        """Get the round number of every main stage"""
+        stages = [name for name in self.order if not name.endswith("_practice")]
+        return {name : i + 1 for i, name in enumerate(stages)}
+
+    def trial_sets(self, stage):
+        """Get the indices of the trial sets a stage uses, in order"""
+        return sorted(set(index for index, _ in self.trials[stage]))
+
+    def resolve(self, stage, trial_objs_set):
+        """Get the trial objects of a stage in the planned order
+
+        Parameters
+        ----------
+        stage : str
+            the name of the stage, e.g. stage1_former
+        trial_objs_set : list
+            the TrialObjects of the stage, in the order of the trial file
+
+        Returns
+        -------
+        A list of TrialObject
+        """
+        return [trial_objs_set[index].trial_objects[trial]
+                for index, trial in self.trials[stage]]
+
+    def validate(self, layout):
+        """Check that the plan has been compiled for these trial files
+
+        Raises
+        ------
+        ValueError
+            the number of trial sets or trials of a stage has changed
+        """
+        for name in self.trials:
+            if self.layout.get(name) != layout.get(name):
+                raise ValueError("the plan doesn't match the trials of " + name)
+
+    def to_dict(self):
+        return {"version" : VERSION,
+                "seed" : self.seed,
+                "type" : self.type,
+                "order" : self.order,
+                "layout" : self.layout,
+                "trials" : self.trials}
+
+    @classmethod
+    def from_dict(cls, plan):
+        if plan.get("version") != VERSION:
+            raise ValueError("unsupported plan version %s" % plan.get("version"))
+        trials = {name : [tuple(pair) for pair in pairs]
+                  for name, pairs in plan["trials"].items()}
+        return cls(plan["seed"], plan["type"], plan["order"], trials,
+                   plan["layout"])
+
+    def save(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.to_dict(), file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as file:
+            return cls.from_dict(json.load(file))
+
+
+def compile_plan(session_type, layout=None, seed=None,
+                 num_practices=NUM_OF_PRACTICES):
+    """Make every random choice of a session
+
+    The main stages show all of their trials in a random order. A practice
+    shows one random trial of each of num_practices random trial sets, like
+    exp.Session.practice used to.
+
+    Parameters
+    ----------
+    session_type : str
+        the session type, '1' to '4'
+    layout : dict, optional
+        the number of trials of every trial set, read from the trial files
+        by default
+    seed : int, optional
+        a new random seed by default, the seed is stored in the plan
+    num_practices : int, optional
+        the number of practice trials
+
+    Returns
+    -------
+    SessionPlan
+    """
+    if layout == None:
+        layout = read_layout()
+    if seed == None:
+        seed = random.SystemRandom().randrange(2 ** 32)
+    rng = random.Random(seed)
+
+    order = SESSION_ORDERS[session_type]
+    trials = {}
+    for name in order:
+        sizes = layout[name]
+        if name.endswith("_practice"):
+            picked = rng.sample(range(len(sizes)), min(num_practices, len(sizes)))
+            trials[name] = [(index, rng.randrange(sizes[index])) for index in picked]
+        else:
+            pairs = [(index, trial) for index, size in enumerate(sizes)
+                     for trial in range(size)]
+            trials[name] = rng.sample(pairs, len(pairs))
+    return SessionPlan(seed, session_type, list(order), trials,
+                       {name : layout[name] for name in order})
+
+
+def compile_cohort(dirname, count, session_types=None, seed=None, layout=None):
+    """Write the plans of a cohort to a directory
+
+    The participants cycle through the session types, and the seed of the
+    i-th plan is seed + i so the whole cohort can be compiled again.
+
+    Returns
+    -------
+    A list of the filenames of the plans
+    """
+    if session_types == None:
+        session_types = sorted(SESSION_ORDERS)
+    if layout == None:
+        layout = read_layout()
+    if seed == None:
+        seed = random.SystemRandom().randrange(2 ** 32)
+    os.makedirs(dirname, exist_ok=True)
+
+    filenames = []
+    for i in range(count):
+        session_type = session_types[i % len(session_types)]
+        plan = compile_plan(session_type, layout, seed + i)
+        filename = os.path.join(dirname, "plan%04d_type%s.json" % (i, session_type))
+        plan.save(filename)
+        filenames.append(filename)
+    return filenames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--type', action='append', choices=sorted(SESSION_ORDERS),
+        help='the session types of the cohort, all of them by default')
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default='plans')
+    args = parser.parse_args()
+
+    for filename in compile_cohort(args.output, args.count, args.type, args.seed):
+        print(filename)
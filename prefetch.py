@@ -0,0 +1,183 @@
+from assets import ASSETS, PREFETCH_WINDOW
+from words import word_stim
+import threading
+import queue
+
+
+class LazyImage(object):
+    """
+    An image stimulus that is decoded the first time it is needed
+
+    The proxy only remembers the path, so creating it doesn't read the
+    file. The ImageStim is requested from the asset cache by load() or by
+    the first draw(), and dropped again by release().
+    """
+
+    __slots__ = ("win", "path", "scale", "__stim")
+
+    def __init__(self, win, path, scale=1):
+        self.win = win
+        self.path = path
+        self.scale = scale
+        self.__stim = None
+
+    def load(self):
+        """Build the stimulus if it hasn't been built yet"""
+        if self.__stim == None:
+            self.__stim = ASSETS.image(self.win, self.path, self.scale)
+        return self.__stim
+
+    def release(self):
+        """Drop the reference to the stimulus, the cache may still keep it"""
+        self.__stim = None
+
+    def draw(self):
+        self.load().draw()
+
+
+class LazySound(object):
+    """
+    A sound stimulus that is decoded the first time it is needed
+    """
+
+    __slots__ = ("win", "path", "__stim")
+
+    def __init__(self, win, path):
+        self.win = win
+        self.path = path
+        self.__stim = None
+
+    def load(self):
+        """Build the stimulus if it hasn't been built yet"""
+        if self.__stim == None:
+            self.__stim = ASSETS.sound(self.win, self.path)
+        return self.__stim
+
+    def release(self):
+        """Drop the reference to the stimulus, the cache may still keep it"""
+        self.__stim = None
+
+    def play(self, **kwargs):
+        self.load().play(**kwargs)
+
+    def pause(self):
+        self.load().pause()
+
+    def stop(self):
+        self.load().stop()
+
+    def getDuration(self):
+        return self.load().getDuration()
+
+
+class LazyWord(object):
+    """
+    A pre-rendered word that is loaded the first time it is needed
+
+    Holding the proxy doesn't keep the texture alive, so the asset cache
+    can evict the words of trials that are not being shown, see
+    words.word_stim.
+    """
+
+    __slots__ = ("win", "text", "size", "__stim")
+
+    def __init__(self, win, text, size):
+        self.win = win
+        self.text = text
+        self.size = size
+        self.__stim = None
+
+    def load(self):
+        """Get the texture of the word if it hasn't been loaded yet"""
+        if self.__stim == None:
+            self.__stim = word_stim(self.win, self.text, self.size)
+        return self.__stim
+
+    def release(self):
+        """Drop the reference to the stimulus, the cache may still keep it"""
+        self.__stim = None
+
+    def draw(self):
+        self.load().draw()
+
+
+class Prefetcher(object):
+    """
+    A background thread that decodes the stimuli of upcoming trials
+
+    prefetch() puts the files of lazy stimuli in a queue, and a daemon
+    thread reads and decodes them with ASSETS.decode(). prefetch_trials()
+    queues trial objects instead, and the thread looks up their stimuli
+    itself. Building the stimulus from the decoded data still happens on
+    the main thread, when the stimulus is loaded.
+    """
+
+    def __init__(self):
+        self.__queue = queue.Queue()
+        self.__pending = set()
+        self.__lock = threading.Lock()
+        self.__thread = threading.Thread(target=self.__work, daemon=True)
+        self.__thread.start()
+
+    def prefetch(self, stims):
+        """Decode the files of the lazy stimuli in the background
+
+        Parameters
+        ----------
+        stims : iterable
+            LazyImage and LazySound objects, other objects are ignored
+        """
+        for stim in stims:
+            path = getattr(stim, 'path', None)
+            if path == None or ASSETS.is_loaded(path):
+                continue
+            item = (path, getattr(stim, 'scale', 1))
+            with self.__lock:
+                if item in self.__pending:
+                    continue
+                self.__pending.add(item)
+            self.__queue.put(item)
+
+    def prefetch_trials(self, trial_objs):
+        """Decode the stimuli of the trial objects in the background
+
+        Parameters
+        ----------
+        trial_objs : list
+            trial.TrialObject objects, the list must not change afterwards
+        """
+        self.__queue.put(list(trial_objs))
+
+    def __work(self):
+        while True:
+            item = self.__queue.get()
+            if isinstance(item, list):
+                # the trial objects of prefetch_trials
+                for obj in item:
+                    self.prefetch(obj.stimuli())
+                self.__queue.task_done()
+                continue
+            try:
+                ASSETS.decode(*item)
+            except OSError as e:
+                # the main thread will report the error when it loads the file
+                print("prefetch failed:", item[0], e)
+            finally:
+                with self.__lock:
+                    self.__pending.discard(item)
+                self.__queue.task_done()
+
+    def wait(self):
+        """Block until every queued file has been decoded"""
+        self.__queue.join()
+
+
+PREFETCHER = None
+
+
+def get_prefetcher():
+    """Get the process-wide prefetcher, the thread is started on first use"""
+    global PREFETCHER
+    if PREFETCHER == None:
+        PREFETCHER = Prefetcher()
+    return PREFETCHER
@@ -0,0 +1,182 @@
+"""Re-analyse every archived session
+
+    python reanalyze.py [--data-dir DIR] [--jobs N] [--output FILE]
+
+The raw data workbooks of experiment_data/data are parsed in a process
+pool and the trials are cached in a Parquet file together with the
+modification time of their workbook, so a rerun only parses the sessions
+that are new or have changed since the last run. The per-condition
+summary of every session is then computed with summary.summarize and
+written to the output workbook.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from summary import summarize, KEYS
+import pandas as pd
+import argparse
+import glob
+import csv
+import os
+
+DATA_DIRNAME = os.path.join("experiment_data", "data")
+CACHE_FILENAME = os.path.join("experiment_data", "cache", "trials.parquet")
+OUTPUT_FILENAME = os.path.join("experiment_data", "reanalysis.xlsx")
+
+RAW_DATA_SUFFIX = "raw_data.xlsx"
+STAGE_FILES = ["stage1_former", "stage1_latter", "stage2_former", "stage2_latter"]
+
+TRIAL_COLUMNS = ["stage", "order", "type", "word1", "word2",
+                 "response_time", "correct"]
+
+
+def discover(data_dirname=DATA_DIRNAME):
+    """Find the raw data workbooks
+
+    Returns
+    -------
+    A dictionary from the path of every workbook to its modification time
+    """
+    pattern = os.path.join(data_dirname, "*" + RAW_DATA_SUFFIX)
+    return {path : os.path.getmtime(path) for path in glob.glob(pattern)}
+
+
+def target_stages(trials_dirname="./trials"):
+    """Map every target word to the stage and order it is tested in
+
+    Workbooks written before the stage and order columns existed are
+    assigned to a stage through the target word of every trial.
+    """
+    stages = {}
+    for name in STAGE_FILES:
+        stage, order = name.split('_')
+        filename = os.path.join(trials_dirname, name + ".csv")
+        with open(filename, encoding='utf-8-sig', newline='') as file:
+            rows = csv.reader(file)
+            next(rows, None)
+            for row in rows:
+                stages[row[0].strip()] = (stage, order)
+    return stages
+
+
+def parse(path, stages=None):
+    """Read the trials of a raw data workbook
+
+    Parameters
+    ----------
+    path : str
+        the path of the workbook
+    stages : dict, optional
+        the result of target_stages, used when the workbook has no stage
+        column
+
+    Returns
+    -------
+    pandas.DataFrame
+        the TRIAL_COLUMNS of every trial and a session column. correct is a
+        boolean and a missing response has a NaN response_time.
+    """
+    df = pd.read_excel(path, index_col=0)
+    if "stage" not in df.columns:
+        if stages == None:
+            stages = target_stages()
+        found = [stages.get(word1, stages.get(word2, (None, None)))
+                 for word1, word2 in zip(df["word1"], df["word2"])]
+        df["stage"] = [stage for stage, _ in found]
+        df["order"] = [order for _, order in found]
+
+    no_response = df["correct"].astype(str) == 'no response'
+    df["response_time"] = pd.to_numeric(df["response_time"], errors='coerce')
+    df.loc[no_response, "response_time"] = float('nan')
+    df["correct"] = df["correct"].astype(str) == 'True'
+    for column in ["stage", "order", "type", "word1", "word2"]:
+        df[column] = df[column].astype(str)
+
+    df = df[TRIAL_COLUMNS]
+    df.insert(0, "session", os.path.basename(path)[:-len(RAW_DATA_SUFFIX)])
+    return df
+
+
+def _parse_file(args):
+    path, mtime, stages = args
+    df = parse(path, stages)
+    df.insert(0, "mtime", mtime)
+    df.insert(0, "path", path)
+    return df
+
+
+def load_trials(data_dirname=DATA_DIRNAME, cache_filename=CACHE_FILENAME,
+                jobs=None):
+    """Get the trials of every session, parsing only the changed workbooks
+
+    Parameters
+    ----------
+    data_dirname : str, optional
+        the directory of the raw data workbooks
+    cache_filename : str, optional
+        the Parquet file of the parsed trials, None disables the cache
+    jobs : int, optional
+        the number of worker processes, the number of CPUs by default
+
+    Returns
+    -------
+    trials : pandas.DataFrame
+        the trials of every session
+    parsed : int
+        the number of workbooks that had to be parsed
+    """
+    files = discover(data_dirname)
+
+    cached = None
+    stale = False
+    if cache_filename and os.path.exists(cache_filename):
+        cached = pd.read_parquet(cache_filename)
+        # drop the sessions whose workbook has changed or been removed
+        current = cached["path"].map(files)
+        fresh = current == cached["mtime"]
+        stale = not fresh.all()
+        cached = cached[fresh]
+        done = set(cached["path"])
+    else:
+        done = set()
+
+    todo = [(path, mtime) for path, mtime in sorted(files.items())
+            if path not in done]
+    frames = [] if cached is None else [cached]
+    if todo:
+        stages = target_stages()
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            frames += pool.map(_parse_file,
+                [(path, mtime, stages) for path, mtime in todo])
+
+    if frames:
+        trials = pd.concat(frames, ignore_index=True)
+    else:
+        trials = pd.DataFrame(columns=["path", "mtime", "session"] + TRIAL_COLUMNS)
+
+    if cache_filename and (todo or stale or cached is None):
+        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+        trials.to_parquet(cache_filename, index=False)
+    return trials, len(todo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--data-dir', default=DATA_DIRNAME)
+    parser.add_argument('--cache', default=CACHE_FILENAME,
+        help='the Parquet cache of the parsed trials')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--output', default=OUTPUT_FILENAME)
+    args = parser.parse_args()
+
+    trials, parsed = load_trials(args.data_dir,
+        None if args.no_cache else args.cache, args.jobs)
+    print("%d sessions, %d parsed, %d trials"
+        % (trials["session"].nunique(), parsed, len(trials)))
+
+    summary = summarize(trials, ["session"] + KEYS)
+    summary.to_excel(args.output)
+    print("summary written to", args.output)
+
+
+if __name__ == '__main__':
+    main()
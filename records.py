@@ -0,0 +1,271 @@
+"""A columnar buffer of trial results
+
+TrialProcess.run used to build a dictionary for every trial. A TrialRecords
+buffer preallocates one typed numpy column per field instead, so recording
+a trial only writes a few numbers: the words and the condition type are
+stored as codes of the process-wide WORDS and TYPES categories, and
+correctness as one of CORRECTNESS. The dictionaries of the old format are
+only built off the trial loop, by the result sink's thread or when the data
+is written at the end of the session.
+"""
+import numpy as np
+import threading
+import math
+
+# the correctness codes, indexes into CORRECTNESS
+WRONG = 0
+RIGHT = 1
+NO_RESPONSE = 2
+CORRECTNESS = [False, True, 'no response']
+
+TIMING_COLUMNS = ["dropped_frames", "max_frame_interval_ms",
+                  "photo_duration_ms", "word1_duration_ms", "word2_duration_ms"]
+
+# the optional float columns, NaN until a trial is measured
+MEASURE_COLUMNS = TIMING_COLUMNS + ["av_asynchrony_ms"]
+
+
+class Categories(object):
+    """
+    A class used to map the names of a categorical column to codes
+
+    A name gets the next code the first time it is seen, which happens when
+    the trial objects are built, not while the trials run.
+    """
+
+    __slots__ = ("names", "__codes", "__lock")
+
+    def __init__(self):
+        self.names = []
+        self.__codes = {}
+        # the sessions of stations.py may add names from several threads
+        self.__lock = threading.Lock()
+
+    def code(self, name):
+        """Get the code of a name, adding it if it is new"""
+        code = self.__codes.get(name)
+        if code == None:
+            with self.__lock:
+                code = self.__codes.get(name)
+                if code == None:
+                    code = self.__codes[name] = len(self.names)
+                    self.names.append(name)
+        return code
+
+    def __len__(self):
+        return len(self.names)
+
+
+WORDS = Categories()
+TYPES = Categories()
+
+
+def correctness_code(correct):
+    """Get the code of a True, False or 'no response' correctness"""
+    return CORRECTNESS.index(correct) if correct in (True, False) else NO_RESPONSE
+
+
+class TrialRecords(object):
+    """
+    A class used to record the results of the trials of a stage
+
+    Every field is a preallocated numpy column. The buffer doubles its
+    capacity when it is full, so only a wrong capacity estimate allocates
+    while the trials run.
+
+    Attributes
+    ----------
+    response_time : numpy.ndarray
+        float64, seconds from the onset of word1, NaN without a response
+    key_time : numpy.ndarray
+        float64, the hardware timestamp of the key press, NaN without one
+    word1, word2 : numpy.ndarray
+        int32 codes of WORDS
+    type : numpy.ndarray
+        int16 codes of TYPES
+    correct : numpy.ndarray
+        int8 codes of CORRECTNESS
+    measures : dict
+        a float64 column for every name of MEASURE_COLUMNS, see measure.
+        They are all allocated up front, so the dictionary never changes
+        while the result sink's thread reads the rows and every row has the
+        same keys
+    """
+
+    __slots__ = ("response_time", "key_time", "word1", "word2", "type",
+                 "correct", "measures", "__size")
+
+    def __init__(self, capacity=64):
+        """
+        Parameters
+        ----------
+        capacity : int, optional
+            the number of trials the columns are allocated for
+        """
+        capacity = max(capacity, 1)
+        self.response_time = np.full(capacity, np.nan)
+        self.key_time = np.full(capacity, np.nan)
+        self.word1 = np.zeros(capacity, dtype=np.int32)
+        self.word2 = np.zeros(capacity, dtype=np.int32)
+        self.type = np.zeros(capacity, dtype=np.int16)
+        self.correct = np.zeros(capacity, dtype=np.int8)
+        self.measures = {name : np.full(capacity, np.nan) for name in MEASURE_COLUMNS}
+        self.__size = 0
+
+    def __len__(self):
+        return self.__size
+
+    def __grow(self):
+        for name in ["response_time", "key_time", "word1", "word2", "type",
+                     "correct"]:
+            column = getattr(self, name)
+            grown = np.full(len(column) * 2, np.nan, dtype=column.dtype) \
+                if column.dtype.kind == 'f' else np.zeros(len(column) * 2, column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+        for name, column in self.measures.items():
+            grown = np.full(len(column) * 2, np.nan)
+            grown[:len(column)] = column
+            self.measures[name] = grown
+
+    def append(self, word1, word2, type, correct, response_time=None,
+               key_time=None):
+        """Record a trial
+
+        Parameters
+        ----------
+        word1, word2 : int
+            codes of WORDS
+        type : int
+            a code of TYPES
+        correct : int
+            a code of CORRECTNESS
+        response_time : float, optional
+            None without a response
+        key_time : float, optional
+            None without a response
+
+        Returns
+        -------
+        the index of the trial
+        """
+        i = self.__size
+        if i == len(self.correct):
+            self.__grow()
+        self.word1[i] = word1
+        self.word2[i] = word2
+        self.type[i] = type
+        self.correct[i] = correct
+        self.response_time[i] = math.nan if response_time == None else response_time
+        self.key_time[i] = math.nan if key_time == None else key_time
+        self.__size = i + 1
+        return i
+
+    def measure(self, values, i=-1):
+        """Record measurements of a trial, e.g. its timing quality
+
+        Parameters
+        ----------
+        values : dict
+            values of MEASURE_COLUMNS, None is stored as NaN
+        i : int, optional
+            the index of the trial, the last trial by default
+        """
+        if i < 0:
+            i += self.__size
+        for name, value in values.items():
+            self.measures[name][i] = math.nan if value == None else value
+
+    def is_correct(self, i=-1):
+        """Check if the response of a trial was correct"""
+        if i < 0:
+            i += self.__size
+        return self.correct[i] == RIGHT
+
+    def row(self, i):
+        """Get a trial as a result row, a dictionary of response_time,
+        word1, word2, correct, type, key_time and the measured columns"""
+        def value(x):
+            return None if math.isnan(x) else float(x)
+
+        row = {"response_time" : value(self.response_time[i]),
+               "word1" : WORDS.names[self.word1[i]],
+               "word2" : WORDS.names[self.word2[i]],
+               "correct" : CORRECTNESS[self.correct[i]],
+               "type" : TYPES.names[self.type[i]],
+               "key_time" : value(self.key_time[i])}
+        for name, column in self.measures.items():
+            row[name] = value(column[i])
+        if row.get("dropped_frames") != None:
+            row["dropped_frames"] = int(row["dropped_frames"])
+        return row
+
+    def rows(self):
+        """Get every trial as a list of dictionaries"""
+        return [self.row(i) for i in range(self.__size)]
+
+    def to_frame(self):
+        """Get the trials as a pandas.DataFrame
+
+        The numeric columns are views of the buffer and the categorical
+        ones are built from the codes, so the conversion doesn't copy the
+        data. correct is a categorical of CORRECTNESS, compatible with the
+        trial table of summary.py.
+        """
+        import pandas as pd
+
+        n = self.__size
+        columns = {
+            "response_time" : self.response_time[:n],
+            "word1" : pd.Categorical.from_codes(self.word1[:n], WORDS.names),
+            "word2" : pd.Categorical.from_codes(self.word2[:n], WORDS.names),
+            "correct" : pd.Categorical.from_codes(self.correct[:n], CORRECTNESS),
+            "type" : pd.Categorical.from_codes(self.type[:n], TYPES.names),
+            "key_time" : self.key_time[:n]}
+        for name, column in self.measures.items():
+            columns[name] = column[:n]
+        return pd.DataFrame(columns, copy=False)
+
+    def to_arrow(self):
+        """Get the trials as a pyarrow.Table with dictionary encoded
+        categorical columns, without copying the numeric columns"""
+        import pyarrow as pa
+
+        n = self.__size
+
+        def dictionary(codes, names):
+            return pa.DictionaryArray.from_arrays(pa.array(codes[:n]),
+                pa.array([str(name) for name in names]))
+
+        columns = {
+            "response_time" : pa.array(self.response_time[:n]),
+            "word1" : dictionary(self.word1, WORDS.names),
+            "word2" : dictionary(self.word2, WORDS.names),
+            "correct" : dictionary(self.correct, CORRECTNESS),
+            "type" : dictionary(self.type, TYPES.names),
+            "key_time" : pa.array(self.key_time[:n])}
+        for name, column in self.measures.items():
+            columns[name] = pa.array(column[:n])
+        return pa.table(columns)
+
+    @classmethod
+    def from_rows(cls, rows, capacity=None):
+        """Build a buffer from result rows, e.g. the rows of a resumed log
+
+        Parameters
+        ----------
+        rows : list
+            the result rows, see row()
+        capacity : int, optional
+            the capacity of the buffer if more trials will be recorded, the
+            number of rows by default
+        """
+        records = cls(max(len(rows), capacity or 0))
+        for row in rows:
+            records.append(WORDS.code(row["word1"]), WORDS.code(row["word2"]),
+                TYPES.code(row["type"]), correctness_code(row["correct"]),
+                row.get("response_time"), row.get("key_time"))
+            values = {name : row[name] for name in MEASURE_COLUMNS if name in row}
+            if values:
+                records.measure(values)
+        return records
@@ -0,0 +1,203 @@
+from psychopy import visual, core
+from psychopy.hardware import keyboard
+import psychtoolbox as ptb
+import numpy as np
+import argparse
+
+# the number of flips measured by the self test
+SELF_TEST_FLIPS = 300
+
+# the key pressed by the operator in the key timestamp test of the self test
+SELF_TEST_KEY = 'space'
+
+
+class ResponseKeyboard(object):
+    """
+    A class used to read the participants' keys with hardware timestamps
+
+    The keyboard is a psychopy.hardware.keyboard.Keyboard, which uses the
+    psychtoolbox event queue when it is available. Every key press carries
+    the time the key went down (tDown), so the response time doesn't depend
+    on how often the keyboard is polled, and it is measured from the flip
+    timestamp of the stimulus instead of a clock started before the draw.
+    """
+
+    def __init__(self, kb=None):
+        """
+        Parameters
+        ----------
+        kb : psychopy.hardware.keyboard.Keyboard, optional
+            the keyboard to read, a new one is created if it is not given
+        """
+        if kb == None:
+            kb = keyboard.Keyboard()
+        self.__kb = kb
+
+    def clear(self):
+        """Drop every key that has been pressed so far"""
+        self.__kb.clearEvents()
+
+    def get_time(self):
+        """Get the current time in the clock of the key timestamps"""
+        return ptb.GetSecs()
+
+    def start_trial(self, obj):
+        """Called with the trial object before its phases are shown
+
+        A real keyboard doesn't need to know the trial, a simulated
+        participant uses it to choose the answer, see simulation.py.
+        """
+        pass
+
+    def get_keys(self, keyList=None):
+        """Get the keys pressed since the last call without waiting
+
+        Parameters
+        ----------
+        keyList : list, optional
+            the accepted keys, every key is accepted if it is None
+
+        Returns
+        -------
+        A list of (name, tDown) tuples, tDown is the hardware time the key
+        went down in the psychtoolbox clock
+        """
+        keys = self.__kb.getKeys(keyList=keyList, waitRelease=False)
+        return [(key.name, key.tDown) for key in keys]
+
+
+KEYBOARD = None
+
+
+def get_keyboard():
+    """Get the process-wide keyboard, it is opened on first use"""
+    global KEYBOARD
+    if KEYBOARD == None:
+        KEYBOARD = ResponseKeyboard()
+    return KEYBOARD
+
+
+def set_keyboard(kb):
+    """Replace the process-wide keyboard, e.g. with a simulated participant"""
+    global KEYBOARD
+    KEYBOARD = kb
+
+
+def describe(values):
+    """Get the mean, SD, minimum, maximum and largest absolute value of
+    times in seconds, in milliseconds"""
+    values = np.asarray(values) * 1000
+    return {"mean" : values.mean(),
+            "sd" : values.std(),
+            "min" : values.min(),
+            "max" : values.max(),
+            "max_abs" : np.abs(values).max()}
+
+
+def self_test(win, n_flips=SELF_TEST_FLIPS, kb=None, n_keys=0):
+    """Measure the timestamp jitter of the window and the keyboard
+
+    The window is flipped n_flips times. Every flip is timestamped twice,
+    by the value win.flip() returns and by the psychtoolbox clock in a
+    callOnFlip callback, which is the clock the key presses are stamped
+    with. The keyboard is polled once after every flip to measure the cost
+    of a non-blocking poll.
+
+    The key timestamps are only tested when n_keys > 0: the window keeps
+    flipping while the operator presses SELF_TEST_KEY n_keys times, and
+    the tDown of every press is compared with the flip before it and the
+    poll that read it. Hardware timestamps fall anywhere within the frame
+    and before the poll; timestamps taken by the poll itself show up as a
+    poll delay of about 0 and a phase that follows the poll time, i.e. the
+    response times are only resolved to the frame.
+
+    Parameters
+    ----------
+    win : psychopy.visual.Window
+        the window to test
+    n_flips : int, optional
+        the number of flips to measure
+    kb : ResponseKeyboard, optional
+        the keyboard to test
+    n_keys : int, optional
+        the key presses to measure, none by default as they need an
+        operator at the keyboard
+
+    Returns
+    -------
+    A dictionary that contains the statistics of describe() of the flip
+    intervals, of their deviation from the nominal frame duration, of the
+    difference between the two timestamps of every interval and of the
+    keyboard poll time, in milliseconds. With n_keys, also of the time from
+    the flip before every key press to its tDown (key_phase_ms), of the
+    time from tDown to the poll that read it (key_poll_delay_ms), and the
+    number of tDown outside of the frame it was read in (keys_outside_frame)
+    """
+    if kb == None:
+        kb = ResponseKeyboard()
+    frame_rate = win.getActualFrameRate() or 60
+    callbacks = []
+    flips = []
+    polls = []
+    for i in range(n_flips):
+        win.callOnFlip(lambda: callbacks.append(ptb.GetSecs()))
+        t = win.flip()
+        flips.append(t if t != None else core.getTime())
+        before = ptb.GetSecs()
+        kb.get_keys()
+        polls.append(ptb.GetSecs() - before)
+
+    intervals = np.diff(flips)
+    callback_intervals = np.diff(callbacks)
+
+    report = {"frame_rate" : frame_rate,
+              "flip_interval_ms" : describe(intervals),
+              "flip_jitter_ms" : describe(intervals - 1.0 / frame_rate),
+              "ptb_jitter_ms" : describe(callback_intervals - 1.0 / frame_rate),
+              "timestamp_mismatch_ms" : describe(callback_intervals - intervals),
+              "poll_time_ms" : describe(polls)}
+    if n_keys > 0:
+        report.update(key_test(win, kb, n_keys))
+    return report
+
+
+def key_test(win, kb, n_keys):
+    """Compare the tDown of n_keys presses of SELF_TEST_KEY with the
+    timestamps of the flips, see self_test"""
+    kb.clear()
+    phases = []
+    delays = []
+    outside = 0
+    flip = None
+    while len(phases) < n_keys:
+        t = win.flip()
+        # the flip timestamp, which the response times are measured from
+        previous, flip = flip, t if t != None else core.getTime()
+        if previous == None:
+            continue
+        # the keys read after this flip went down during the last frame
+        keys = kb.get_keys([SELF_TEST_KEY])
+        polled = kb.get_time()
+        for _, t_down in keys:
+            phases.append(t_down - previous)
+            delays.append(polled - t_down)
+            outside += not previous <= t_down <= polled
+
+    return {"key_phase_ms" : describe(phases),
+            "key_poll_delay_ms" : describe(delays),
+            "keys_outside_frame" : outside}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=0, metavar='N',
+        help='also test the timestamps of N presses of the %s key' % SELF_TEST_KEY)
+    args = parser.parse_args()
+    win = visual.Window(allowGUI=False, screen=0, monitor="testMonitor",
+                        units="deg", fullscr=True, color=[255, 255, 255])
+    if args.keys > 0:
+        print("press %s %d times" % (SELF_TEST_KEY, args.keys))
+    for name, value in self_test(win, n_keys=args.keys).items():
+        print(name, value)
+    win.close()
+    core.quit()
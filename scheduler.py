@@ -0,0 +1,352 @@
+from psychopy import core
+from response import get_keyboard
+from audio import AudioEngine
+import numpy as np
+import math
+
+# used when the window cannot measure its own refresh rate
+DEFAULT_FRAME_RATE = 60
+
+# a keyList that accepts every key
+ANY_KEY = 'any'
+
+# measuring the refresh rate takes about a second, so it is done once for
+# every window
+_FRAME_RATES = {}
+
+
+def get_frame_rate(win):
+    """Get the measured refresh rate of the window in Hz"""
+    if id(win) not in _FRAME_RATES:
+        _FRAME_RATES[id(win)] = win.getActualFrameRate() or DEFAULT_FRAME_RATE
+    return _FRAME_RATES[id(win)]
+
+
+class Phase(object):
+    """
+    A class used to represent one step of a trial
+
+    A phase is a set of stimuli that stay on the screen for a fixed
+    duration, e.g. the fixation cross, the blank interval between the cross
+    and the photo, or the first word.
+
+    Attributes
+    ----------
+    label : str
+        the name of the phase used in the timing log
+    stims : list
+        the stimuli drawn on every frame of the phase, an empty list shows a
+        blank screen
+    duration : int, float
+        the duration of the phase in seconds, math.inf lasts until a key in
+        keyList is pressed
+    keyList : list, str, None
+        the keys that end the trial during the phase, ANY_KEY accepts every
+        key and None doesn't listen to the keyboard
+    on_onset : callable, None
+        called right after the flip that shows the phase
+    rt_start : Boolean
+        if it is True, the response time is measured from this phase
+    sounds : list
+        the sounds that start together with the phase, see
+        audio.AudioEngine
+    """
+
+    def __init__(self, label, stims=(), duration=0, keyList=None,
+                 on_onset=None, rt_start=False, sounds=()):
+        self.label = label
+        self.stims = list(stims)
+        self.duration = duration
+        self.keyList = keyList
+        self.on_onset = on_onset
+        self.rt_start = rt_start
+        self.sounds = list(sounds)
+
+
+class PhaseTable(object):
+    """
+    A class used to represent phases compiled for a refresh rate
+
+    The fields of the phases are held in flat lists with one slot for every
+    phase, so the flip loop of the scheduler only indexes them. The number
+    of frames and the planned onset of every phase are computed once, and
+    the key lists are resolved to the arguments of the keyboard poll, so
+    nothing is allocated or compared between the flips.
+
+    A table is compiled once for a layout of phases that repeats, e.g. the
+    phases of every trial, and the stimuli of every run are written into
+    its slots with set(). Phases shorter than half a frame keep their slot
+    with 0 frames and are skipped.
+
+    Attributes
+    ----------
+    labels : list
+    stims : list
+        a tuple of the stimuli of every phase
+    frames : list
+        the number of frames of every phase, math.inf until a key is
+        accepted
+    onsets : list
+        the planned onset of every phase in seconds from the first phase
+    polls : list
+        the arguments of kb.get_keys of every phase, None doesn't poll the
+        keyboard
+    rt_start : list
+    on_onset : list
+    sounds : list
+    index : dict
+        the slot of every label
+    """
+
+    def __init__(self, phases, scheduler):
+        n = len(phases)
+        self.labels = [None] * n
+        self.stims = [()] * n
+        self.frames = [0] * n
+        self.onsets = [0] * n
+        self.polls = [None] * n
+        self.rt_start = [False] * n
+        self.on_onset = [None] * n
+        self.sounds = [()] * n
+        self.index = {}
+        onset = 0
+        for i, phase in enumerate(phases):
+            self.labels[i] = phase.label
+            self.index[phase.label] = i
+            self.frames[i] = scheduler.n_frames(phase.duration)
+            self.onsets[i] = onset
+            onset += self.frames[i] * scheduler.frame_duration
+            self.set(i, phase.stims, phase.keyList, phase.on_onset,
+                     phase.rt_start, phase.sounds)
+
+    def set(self, slot, stims=None, keyList=False, on_onset=False,
+            rt_start=None, sounds=None):
+        """Fill the slot of a phase, the fields that aren't given are kept
+
+        Parameters
+        ----------
+        slot : int, str
+            the index or the label of the phase
+        stims : list, optional
+        keyList : list, str, None, optional
+            see Phase.keyList
+        on_onset : callable, None, optional
+        rt_start : Boolean, optional
+        sounds : list, optional
+        """
+        if isinstance(slot, str):
+            slot = self.index[slot]
+        if stims != None:
+            self.stims[slot] = tuple(stims)
+        if keyList != False:
+            if keyList == None:
+                self.polls[slot] = None
+            elif keyList == ANY_KEY:
+                self.polls[slot] = ()
+            else:
+                self.polls[slot] = (list(keyList),)
+        if on_onset != False:
+            self.on_onset[slot] = on_onset
+        if rt_start != None:
+            self.rt_start[slot] = rt_start
+        if sounds != None:
+            self.sounds[slot] = tuple(sounds)
+
+
+class FrameScheduler(object):
+    """
+    A class used to run phases locked to the refresh of the window
+
+    Instead of waiting for a timeout after each flip, the scheduler turns
+    the duration of every phase into a number of frames and runs a single
+    flip loop. The keyboard is polled without blocking after every flip, so
+    a phase always lasts a whole number of refreshes and the onset of the
+    next phase doesn't depend on the Python overhead between the flips.
+
+    The planned and the actual onset of every phase are stored in log.
+
+    The response time is measured from the flip that shows the rt_start
+    phase, the timestamp win.flip() returns, to the hardware timestamp of
+    the key press, both in the psychtoolbox clock, see
+    response.ResponseKeyboard.
+
+    Attributes
+    ----------
+    frame_rate : float
+        the refresh rate of the window in Hz
+    frame_duration : float
+        the duration of a single frame in seconds
+    kb : response.ResponseKeyboard
+        the keyboard polled after every flip
+    log : list
+        a dictionary for every phase that has been shown
+    timer : timing.FrameTimer, None
+        records the timestamp of every flip when it is set
+    audio : audio.AudioEngine
+        starts the sounds of the phases with their first flip
+    asynchrony : float, None
+        the audio-visual asynchrony in milliseconds of the last sound of
+        the last run, None if it had no sound or it is unknown
+    """
+
+    def __init__(self, win, frame_rate=None, kb=None, timer=None, audio=None):
+        """
+        Parameters
+        ----------
+        win : psychopy.visual.Window
+            the window the phases are drawn on
+        frame_rate : int, float, optional
+            the refresh rate of the window, measured from the window if it
+            is not given
+        kb : response.ResponseKeyboard, optional
+            the keyboard that is polled after every flip, the process-wide
+            keyboard by default
+        timer : timing.FrameTimer, optional
+            records every flip, nothing is recorded by default
+        audio : audio.AudioEngine, optional
+            the engine that starts the sounds, a new one by default
+        """
+        self.__win = win
+        if kb == None:
+            kb = get_keyboard()
+        self.kb = kb
+        self.__rt_onset = None
+        if frame_rate == None:
+            frame_rate = get_frame_rate(win)
+        self.frame_rate = frame_rate
+        self.frame_duration = 1.0 / frame_rate
+        self.log = []
+        self.timer = timer
+        if audio == None:
+            audio = AudioEngine(win, kb)
+        self.audio = audio
+        self.asynchrony = None
+
+    def n_frames(self, duration):
+        """Convert a duration in seconds to a number of frames"""
+        if duration == math.inf:
+            return math.inf
+        return int(round(duration * self.frame_rate))
+
+    def compile(self, phases):
+        """Compile the phases into a PhaseTable for the refresh rate
+
+        Parameters
+        ----------
+        phases : list
+            a list of Phase
+
+        Returns
+        -------
+        PhaseTable
+        """
+        return PhaseTable(phases, self)
+
+    def run(self, phases, trial=None):
+        """Show the phases one by one until a key is accepted
+
+        Parameters
+        ----------
+        phases : list, PhaseTable
+            a list of Phase, or phases compiled by compile()
+        trial : optional
+            stored in the timing log to identify the trial
+
+        Returns
+        -------
+        keys : list, None
+            the names of the keys that ended the phases, None if every
+            phase timed out
+        rt : float, None
+            the time between the onset of the rt_start phase and the key
+            press, None if there is no rt_start phase before the key press
+        key_time : float, None
+            the hardware timestamp of the key press
+        """
+        if not isinstance(phases, PhaseTable):
+            phases = self.compile(phases)
+        result = self.__run(phases, trial)
+        # the sounds have started by now, so their onset can be measured
+        self.asynchrony = self.audio.measure()
+        return result
+
+    def __run(self, table, trial):
+        win = self.__win
+        flip = win.flip
+        get_keys = self.kb.get_keys
+        timer = self.timer
+        log = self.log
+        start = None
+        self.__rt_onset = None
+        self.kb.clear()
+        for i in range(len(table.labels)):
+            n = table.frames[i]
+            if n <= 0:
+                continue
+            stims = table.stims[i]
+            poll = table.polls[i]
+            label = table.labels[i]
+            rt_start = table.rt_start[i]
+            if rt_start:
+                # keys pressed before the stimulus appears are not
+                # responses to it
+                win.callOnFlip(self.kb.clear)
+            if table.on_onset[i] != None:
+                win.callOnFlip(table.on_onset[i])
+            self.audio.play_on_flip(table.sounds[i], trial)
+            frame = 0
+            while frame < n:
+                for stim in stims:
+                    stim.draw()
+                t = flip()
+                if t == None:
+                    t = core.getTime()
+                if frame == 0:
+                    if start == None:
+                        start = t
+                    if rt_start:
+                        self.__rt_onset = t
+                    log.append({"trial" : trial,
+                                "phase" : label,
+                                "frames" : n,
+                                "planned_onset" : table.onsets[i],
+                                "actual_onset" : t - start})
+                if timer != None:
+                    timer.record(trial, label, t, n if frame == 0 else None)
+                frame += 1
+
+                if poll == None:
+                    continue
+                keys = get_keys(*poll)
+                if keys:
+                    key_time = keys[0][1]
+                    rt = None
+                    if self.__rt_onset != None:
+                        rt = key_time - self.__rt_onset
+                    return [name for name, _ in keys], rt, key_time
+        return None, None, None
+
+    def precision_report(self):
+        """Summarize the difference between the planned and actual onsets
+
+        Returns
+        -------
+        A dictionary for every phase label that contains the number of
+        onsets, the mean and maximum absolute error in milliseconds and the
+        maximum absolute error in frames
+        """
+        report = {}
+        labels = {}
+        for entry in self.log:
+            if entry["planned_onset"] == math.inf:
+                continue
+            error = abs(entry["actual_onset"] - entry["planned_onset"])
+            labels.setdefault(entry["phase"], []).append(error)
+
+        for label, errors in labels.items():
+            errors = np.array(errors)
+            report[label] = {"n" : len(errors),
+                             "mean_error_ms" : errors.mean() * 1000,
+                             "max_error_ms" : errors.max() * 1000,
+                             "max_error_frames" : errors.max() / self.frame_duration}
+        return report
@@ -0,0 +1,401 @@
+"""Run the experiment without a display or a participant
+
+    python simulation.py [--type 1] [--sessions N] [--frame-rate 60] [--seed S]
+    python simulation.py --plan PLAN
+
+The simulation replaces the window with NullWindow, every stimulus with a
+null object that draws nothing, and the keyboard with a synthetic
+participant whose response times and accuracy depend on the condition
+type. Time is virtual: a flip advances the clock of the window by one
+frame without waiting for the screen, so a session runs much faster than
+real time and only costs the Python work of the experiment itself.
+
+For every session the report contains the wall-clock time, the virtual
+duration of the session, the Python overhead per frame and per trial, the
+time spent on the summaries and a check that every practice run stopped
+after max_correctness correct answers.
+
+A session plan saved by exp.py or plan.py replays the exact trial order of
+that session.
+"""
+from assets import ASSETS
+from plan import SessionPlan, compile_plan
+from adaptive import ConditionStopping
+from summary import trial_table, summarize
+import numpy as np
+import tempfile
+import argparse
+import random
+import time
+import wave
+import os
+
+# the median response time and the log-normal sigma of every condition
+RT_PARAMS = {"音同形似" : (0.85, 0.25),
+             "音異形似" : (0.80, 0.25),
+             "音同形異" : (0.75, 0.25),
+             "音異形異" : (0.70, 0.25)}
+ACCURACY = {"音同形似" : 0.75,
+            "音異形似" : 0.85,
+            "音同形異" : 0.85,
+            "音異形異" : 0.95}
+
+# the seconds an experimenter takes to press a key the experiment waits for,
+# longer than the feedback so the simulation doesn't cut it short
+OPERATOR_DELAY = 2.5
+
+RESPONSE_KEYS = ('q', 'p')
+
+PRACTICE_MAX_CORRECTNESS = 3
+
+
+class NullStim(object):
+    """A visual stimulus that draws nothing"""
+
+    def __init__(self):
+        self.size = np.array([1.0, 1.0])
+        self.draws = 0
+
+    def draw(self):
+        self.draws += 1
+
+
+class NullSound(object):
+    """A sound that plays nothing but has the duration of its file"""
+
+    def __init__(self, source, sampleRate=None):
+        if isinstance(source, str):
+            with wave.open(source, 'rb') as wav:
+                self.duration = wav.getnframes() / wav.getframerate()
+        else:
+            self.duration = len(source) / sampleRate
+        self.plays = 0
+        self.start_time = None
+
+    def play(self, when=None, **kwargs):
+        self.plays += 1
+        self.start_time = when
+
+    def pause(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def getDuration(self):
+        return self.duration
+
+
+class NullFactory(object):
+    """Builds null stimuli for the asset cache, see assets.PsychopyFactory"""
+
+    headless = True
+
+    def image(self, win, source):
+        return NullStim()
+
+    def sound(self, source, sampleRate=None):
+        return NullSound(source, sampleRate)
+
+    def text(self, win, text, color, colorSpace, font):
+        return NullStim()
+
+    def fixation(self, win, size):
+        return NullStim()
+
+
+class NullWindow(object):
+    """
+    A window that shows nothing and keeps a virtual clock
+
+    Every flip advances the clock by one frame and returns the new time,
+    like a window whose flips are always on time.
+    """
+
+    def __init__(self, frame_rate=60, size=(1920, 1080)):
+        self.frame_rate = frame_rate
+        self.size = np.array(size)
+        self.units = 'deg'
+        self.mouseVisible = True
+        self.time = 0.0
+        self.frames = 0
+        self.__callbacks = []
+
+    def getActualFrameRate(self, **kwargs):
+        return self.frame_rate
+
+    def getFutureFlipTime(self, targetTime=0, clock=None):
+        return self.time + 1.0 / self.frame_rate
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self.__callbacks.append((function, args, kwargs))
+
+    def flip(self, clearBuffer=True):
+        self.frames += 1
+        self.time += 1.0 / self.frame_rate
+        callbacks, self.__callbacks = self.__callbacks, []
+        for function, args, kwargs in callbacks:
+            function(*args, **kwargs)
+        return self.time
+
+    def clearBuffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SyntheticParticipant(object):
+    """
+    A simulated participant that replaces response.ResponseKeyboard
+
+    For every trial, the participant draws a log-normal response time and
+    answers correctly with the accuracy of the condition type of the trial.
+    The key is pressed when the virtual time passes the onset of word1 plus
+    the response time, with that exact timestamp.
+
+    Waits that don't accept the response keys are answered as an
+    experimenter would: the first accepted key (or space when any key is
+    accepted) is pressed OPERATOR_DELAY seconds after the wait started.
+    escape is never pressed.
+    """
+
+    def __init__(self, win, rt_params=RT_PARAMS, accuracy=ACCURACY,
+                 operator_delay=OPERATOR_DELAY, seed=None):
+        self.win = win
+        self.rt_params = rt_params
+        self.accuracy = accuracy
+        self.operator_delay = operator_delay
+        self.random = random.Random(seed)
+        self.__cleared = 0.0
+        self.__response = None
+
+    def get_time(self):
+        return self.win.time
+
+    def clear(self):
+        # the scheduler clears the keyboard when a wait starts and on the
+        # flip that shows word1, so this is where the response time starts
+        self.__cleared = self.win.time
+
+    def start_trial(self, obj):
+        self.__response = self.respond(obj)
+
+    def respond(self, obj):
+        """Choose the key and the response time of a trial
+
+        Returns
+        -------
+        key : str
+        rt : float
+        """
+        # the manifest names the practice conditions like the main ones
+        _type = obj.type()
+        median, sigma = self.rt_params[_type]
+        rt = self.random.lognormvariate(np.log(median), sigma)
+        correct = 'q' if obj.is_correct('q') else 'p'
+        wrong = 'p' if correct == 'q' else 'q'
+        if self.random.random() < self.accuracy[_type]:
+            return correct, rt
+        return wrong, rt
+
+    def get_keys(self, keyList=None):
+        now = self.win.time
+        if keyList != None and any(key in keyList for key in RESPONSE_KEYS):
+            if self.__response == None:
+                return []
+            key, rt = self.__response
+            if now < self.__cleared + rt:
+                return []
+            self.__response = None
+            return [(key, self.__cleared + rt)]
+
+        if keyList != None and 'escape' in keyList:
+            return []
+        if now < self.__cleared + self.operator_delay:
+            return []
+        key = keyList[0] if keyList else 'space'
+        return [(key, self.__cleared + self.operator_delay)]
+
+
+class ScriptedParticipant(SyntheticParticipant):
+    """
+    A simulated participant that gives a fixed list of responses
+
+    The responses are (key, rt) tuples used in order, one per trial, e.g.
+    to replay a recorded session.
+    """
+
+    def __init__(self, win, responses, **kwargs):
+        super().__init__(win, **kwargs)
+        self.responses = list(responses)
+        self.__next = 0
+
+    def respond(self, obj):
+        response = self.responses[self.__next % len(self.responses)]
+        self.__next += 1
+        return response
+
+
+class Headless(object):
+    """
+    Replace the stimuli of the asset cache with null stimuli in a with
+    block
+
+    The cache is process-wide, so the simulated sessions of one process,
+    e.g. the stations of stations.py --simulate --threads, run in one block.
+    """
+
+    def __enter__(self):
+        self.__factory = ASSETS.factory
+        ASSETS.factory = NullFactory()
+        ASSETS.clear()
+        return self
+
+    def __exit__(self, *exc_info):
+        ASSETS.factory = self.__factory
+        ASSETS.clear()
+
+
+def simulate(session_type='1', frame_rate=60, seed=None, participant=None,
+             plan=None, schedule=None):
+    """Run a whole session of exp.py headlessly
+
+    Parameters
+    ----------
+    session_type : str, optional
+        the type of the session, '1' to '4'
+    frame_rate : int, float, optional
+        the refresh rate of the simulated window
+    seed : int, optional
+        seeds the trial order and the synthetic participant
+    participant : SyntheticParticipant, optional
+        the key source, a SyntheticParticipant with the default
+        parameters by default
+    plan : plan.SessionPlan, optional
+        the trial order of the session, compiled with seed by default.
+        The plan overrides session_type.
+    schedule : callable, optional
+        the schedule of the main rounds, e.g. adaptive.ConditionStopping,
+        every trial is run by default
+
+    Returns
+    -------
+    A dictionary of the measurements of the session
+    """
+    random.seed(seed)
+    with Headless():
+        return simulate_session(session_type, frame_rate, seed, participant,
+                                plan, schedule=schedule)
+
+
+def simulate_session(session_type='1', frame_rate=60, seed=None,
+                     participant=None, plan=None, participant_id='simulation',
+                     listener=None, schedule=None):
+    """Run a session on a NullWindow of its own, inside a Headless block
+
+    The session only uses its own window, participant and sink, so several
+    of them can run at the same time on different threads. See simulate
+    for the parameters.
+
+    Parameters
+    ----------
+    participant_id : str, optional
+        the Participant of the session info
+    listener : callable, optional
+        called with every record of the result log, see sink.ResultSink
+    schedule : callable, optional
+        the schedule of the main rounds, e.g. adaptive.ConditionStopping
+    """
+    import exp
+
+    win = NullWindow(frame_rate)
+    if participant == None:
+        participant = SyntheticParticipant(win, seed=seed)
+    else:
+        participant.win = win
+
+    if plan == None:
+        plan = compile_plan(session_type, seed=seed,
+                            num_practices=exp.NUM_OF_PRACTICES)
+    session_type = plan.type
+    session = exp.Session({'Participant' : participant_id, 'Number' : '',
+                           'Gender' : '', 'Age' : '', 'type' : session_type,
+                           'dateStr' : '', 'seed' : plan.seed},
+                          kb=participant, listener=listener)
+    session.plan = plan
+    session.schedule = schedule
+
+    practice_runs = []
+
+    def recorded_practice(practice_objs, stage):
+        practice_runs.append(exp.Session.practice(session, practice_objs, stage))
+        return practice_runs[-1]
+
+    session.practice = recorded_practice
+    dirname = tempfile.mkdtemp(prefix='slp-simulation-')
+    session.open_sink(os.path.join(dirname, 'trials.jsonl'))
+
+    start = time.perf_counter()
+    session.setup(win)
+    data = session.run()
+    run_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summary = summarize(trial_table(data))
+    data_time = time.perf_counter() - start
+
+    n_trials = sum(len(rows) for rows in data.values())
+    return {"type" : session_type,
+            "seed" : plan.seed,
+            "trials" : n_trials,
+            "practice_trials" : sum(len(rows) for rows in practice_runs),
+            "practice_stops_ok" : all(check_max_correctness(records.rows())
+                                      for records in practice_runs),
+            "frames" : win.frames,
+            "virtual_time" : win.time,
+            "wall_time" : run_time,
+            "speedup" : win.time / run_time,
+            "overhead_per_frame_ms" : run_time / win.frames * 1000,
+            "overhead_per_trial_ms" : run_time / max(n_trials, 1) * 1000,
+            "data_path_time" : data_time,
+            "summary_groups" : len(summary),
+            "log" : os.path.join(dirname, 'trials.jsonl')}
+
+
+def check_max_correctness(rows, max_correctness=PRACTICE_MAX_CORRECTNESS,
+                          n_available=None):
+    """Check that a practice run stopped exactly at max_correctness
+
+    A run must end on its max_correctness-th correct answer, or run out of
+    trials before reaching it.
+    """
+    n_correct = sum(1 for row in rows if row["correct"] == True)
+    if n_correct == max_correctness:
+        return rows[-1]["correct"] == True
+    return n_correct < max_correctness and (n_available == None or
+                                            len(rows) == n_available)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--type', default='1', choices=['1', '2', '3', '4'])
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--frame-rate', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--plan', default=None,
+        help='replay the trial order of a saved session plan')
+    parser.add_argument('--adaptive', action='store_true',
+        help='stop every condition of a round once its estimates converge')
+    args = parser.parse_args()
+
+    plan = None if args.plan == None else SessionPlan.load(args.plan)
+    schedule = ConditionStopping if args.adaptive else None
+    for i in range(args.sessions):
+        seed = None if args.seed == None else args.seed + i
+        if plan != None:
+            seed = plan.seed
+        for name, value in simulate(args.type, args.frame_rate, seed,
+                                    plan=plan, schedule=schedule).items():
+            print("%-24s %s" % (name, value))
+        print()
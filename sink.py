@@ -0,0 +1,303 @@
+import threading
+import queue
+import json
+import time
+import sys
+import os
+
+# the log is fsynced after this many records or this many seconds,
+# whichever comes first
+FSYNC_EVERY = 20
+FSYNC_INTERVAL = 1.0
+
+_CLOSE = object()
+
+
+class ResultSink(object):
+    """
+    A crash-safe, append-only log of the trial results
+
+    TrialProcess.run writes every response to the sink as soon as it is
+    recorded. The records are put in a queue and a background thread
+    appends them to a JSON lines file, so writing never blocks the trial
+    loop. The file is flushed after every record and fsynced in batches,
+    so a crash loses at most the last FSYNC_INTERVAL seconds of results.
+
+    Every line is a JSON object with an "event" field:
+
+    session
+        the participant info of the session, "expinfo"
+    stage_start
+        the stage named "stage" has started, the rows of an earlier,
+        unfinished run of the stage are dropped
+    trial
+        a result row of the trial process, "stage" and "row"
+    stage_resume
+        the stage named "stage" continues after its "trials" rows, e.g.
+        after the participant pressed escape or the computer crashed
+    stage_report
+        the timing of the stage named "stage": the onset error of every
+        phase ("onsets", see scheduler.FrameScheduler.precision_report),
+        the audio-visual asynchrony ("audio") and the state of its
+        schedule ("schedule")
+    stage_end
+        the stage named "stage" has finished
+
+    An existing log is appended to, which is how a session is resumed, see
+    read_log(). A last line cut short by a crash is ended first.
+
+    A listener, e.g. the monitor of stations.py, is called on the
+    background thread with every record once it has been written.
+
+    If writing a record fails, the background thread stops and keeps the
+    exception. It is raised again by the next call that records something
+    and by close, so the session stops instead of running trials that are
+    no longer recorded.
+
+    Attributes
+    ----------
+    filename : str
+    error : BaseException, None
+        the exception that stopped the background thread
+    """
+
+    def __init__(self, filename, fsync_every=FSYNC_EVERY,
+                 fsync_interval=FSYNC_INTERVAL, listener=None):
+        """
+        Parameters
+        ----------
+        filename : str
+            the path of the log file
+        fsync_every : int, optional
+            the number of records between two fsyncs
+        fsync_interval : float, optional
+            the maximum number of seconds between two fsyncs
+        listener : callable, optional
+            called with every written record
+        """
+        self.filename = filename
+        self.listener = listener
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.error = None
+        self.__file = open(filename, 'a', encoding='utf-8')
+        if not ends_line(filename):
+            # a line cut short by a crash, the next record starts a new line
+            self.__file.write('\n')
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__work, daemon=True)
+        self.__thread.start()
+
+    def __check(self):
+        if self.error != None:
+            raise RuntimeError("the result log %s is no longer written"
+                               % self.filename) from self.error
+
+    def write_session(self, expinfo):
+        """Record the participant info of the session"""
+        self.__check()
+        self.__queue.put({"event" : "session", "expinfo" : dict(expinfo)})
+
+    def write(self, stage, row):
+        """Record a result row of a stage
+
+        Parameters
+        ----------
+        stage : str
+            the name of the stage, e.g. stage1_former
+        row : dict
+            a result row, see records.TrialRecords.row
+        """
+        self.__check()
+        self.__queue.put({"event" : "trial", "stage" : stage, "row" : row})
+
+    def write_record(self, stage, records, index):
+        """Record a trial of a records.TrialRecords buffer
+
+        The row is read from the buffer by the background thread, so the
+        trial loop doesn't build it. The trial must not change afterwards.
+        """
+        self.__check()
+        self.__queue.put((stage, records, index))
+
+    def start_stage(self, stage):
+        """Record that the trials of the stage are about to run"""
+        self.__check()
+        self.__queue.put({"event" : "stage_start", "stage" : stage})
+
+    def resume_stage(self, stage, trials):
+        """Record that the trials of an unfinished stage continue after the
+        rows already in the log"""
+        self.__check()
+        self.__queue.put({"event" : "stage_resume", "stage" : stage,
+                          "trials" : trials})
+
+    def write_report(self, stage, reports):
+        """Record the timing reports of a stage, see stage_report
+
+        Parameters
+        ----------
+        stage : str
+        reports : dict
+            the reports by name, numpy numbers are written as floats
+        """
+        self.__check()
+        self.__queue.put(dict({"event" : "stage_report", "stage" : stage}, **reports))
+
+    def end_stage(self, stage):
+        """Record that every trial of the stage has been run"""
+        self.__check()
+        self.__queue.put({"event" : "stage_end", "stage" : stage})
+
+    def close(self):
+        """Write every queued record, fsync the file and close it
+
+        Raises
+        ------
+        RuntimeError
+            if a record couldn't be written, see error
+        """
+        self.__queue.put(_CLOSE)
+        self.__thread.join()
+        self.__file.close()
+        self.__check()
+
+    def __work(self):
+        try:
+            self.__write_records()
+        except BaseException as e:
+            # raised on the session's thread by the next call
+            self.error = e
+
+    def __write_records(self):
+        unsynced = 0
+        last_sync = time.monotonic()
+        while True:
+            try:
+                record = self.__queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                record = None
+
+            if record is _CLOSE:
+                self.__sync()
+                return
+            if isinstance(record, tuple):
+                stage, records, index = record
+                record = {"event" : "trial", "stage" : stage,
+                          "row" : records.row(index)}
+            if record != None:
+                self.__file.write(json.dumps(record, ensure_ascii=False,
+                                             default=float) + '\n')
+                self.__file.flush()
+                unsynced += 1
+                if self.listener != None:
+                    try:
+                        self.listener(record)
+                    except Exception:
+                        # a broken monitor must not stop the log
+                        pass
+
+            if unsynced and (unsynced >= self.fsync_every or
+                    record == None or record["event"] != "trial" or
+                    time.monotonic() - last_sync >= self.fsync_interval):
+                self.__sync()
+                unsynced = 0
+                last_sync = time.monotonic()
+
+    def __sync(self):
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+
+def ends_line(filename):
+    """Check if a file is empty or its last line is complete"""
+    with open(filename, 'rb') as file:
+        if file.seek(0, os.SEEK_END) == 0:
+            return True
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b'\n'
+
+
+def read_log(filename):
+    """Read a result log
+
+    A line cut short by a crash is ignored.
+
+    Parameters
+    ----------
+    filename : str
+        the path of the log file
+
+    Returns
+    -------
+    expinfo : dict, None
+        the participant info of the last session record
+    data : dict
+        the result rows of every stage, in the format returned by
+        exp.Session.run
+    completed : list
+        the stages that have a stage_end record
+    """
+    expinfo = None
+    data = {}
+    completed = []
+    with open(filename, encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record["event"] == "session":
+                expinfo = record["expinfo"]
+            elif record["event"] == "stage_start":
+                data[record["stage"]] = []
+                if record["stage"] in completed:
+                    completed.remove(record["stage"])
+            elif record["event"] == "stage_resume":
+                # the rows of the stage are kept
+                data.setdefault(record["stage"], [])
+            elif record["event"] == "trial":
+                data.setdefault(record["stage"], []).append(record["row"])
+            elif record["event"] == "stage_end":
+                completed.append(record["stage"])
+    return expinfo, data, completed
+
+
+def export_reports(filename, dirname=None):
+    """Write the data.json and the raw data workbook of a log
+
+    Parameters
+    ----------
+    filename : str
+        the path of the log file
+    dirname : str, optional
+        the directory of the reports, the directory of the log by default
+
+    Returns
+    -------
+    the paths of the json file and the workbook
+    """
+    import pandas as pd
+
+    expinfo, data, completed = read_log(filename)
+    if dirname == None:
+        dirname = os.path.dirname(filename)
+    prefix = expinfo['Participant'] + expinfo['dateStr'] if expinfo else ''
+
+    json_filename = os.path.join(dirname, prefix + 'data.json')
+    with open(json_filename, "w") as file:
+        json.dump(data, file, indent=4, ensure_ascii=False)
+
+    combined_data = []
+    for key in data:
+        combined_data += data[key]
+    xlsx_filename = os.path.join(dirname, prefix + 'raw_data.xlsx')
+    pd.DataFrame.from_dict(combined_data).to_excel(xlsx_filename)
+
+    return json_filename, xlsx_filename
+
+
+if __name__ == '__main__':
+    # generate the reports of a session offline: python sink.py <log>
+    for filename in sys.argv[1:]:
+        print(*export_reports(filename))
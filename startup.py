@@ -0,0 +1,111 @@
+"""Measure and overlap the startup of exp.py
+
+exp.py imports this module first, so PROFILE measures every step from the
+launch of the process. Steps that run in the background while the operator
+fills in the dialog are recorded with the name of their thread.
+"""
+import threading
+import time
+
+_LAUNCH = time.perf_counter()
+
+
+def date_str():
+    """Get the current date like psychopy.data.getDateStr() does, without
+    importing psychopy.data and pandas"""
+    now = time.time()
+    return time.strftime("%Y-%m-%d_%Hh%M.%S.", time.localtime(now)) \
+        + "%03d" % (now % 1 * 1000)
+
+
+class StartupProfile(object):
+    """
+    A class used to record how long every step of the startup takes
+
+    Attributes
+    ----------
+    steps : list
+        a (name, thread, start, end) tuple for every step, in seconds since
+        the launch
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.__lock = threading.Lock()
+
+    def step(self, name):
+        """Measure the step of a with block"""
+        return _Step(self, name)
+
+    def add(self, name, start, end):
+        with self.__lock:
+            self.steps.append((name, threading.current_thread().name,
+                               start - _LAUNCH, end - _LAUNCH))
+
+    def total(self, name):
+        """Get the total duration of the steps with the name"""
+        return sum(end - start for step, _, start, end in self.steps
+                   if step == name)
+
+    def report(self):
+        """Lay out the steps in the order they started
+
+        Returns
+        -------
+        str
+        """
+        lines = ["%-28s %-12s %9s %9s %9s" % ("step", "thread", "start s",
+                                               "end s", "took s")]
+        for name, thread, start, end in sorted(self.steps, key=lambda s: s[2]):
+            lines.append("%-28s %-12s %9.3f %9.3f %9.3f" % (name, thread[:12],
+                                                          start, end, end - start))
+        lines.append("%-28s %-12s %9s %9.3f" % ("since launch", "", "",
+                                                time.perf_counter() - _LAUNCH))
+        return '\n'.join(lines)
+
+
+class _Step(object):
+
+    def __init__(self, profile, name):
+        self.__profile = profile
+        self.__name = name
+
+    def __enter__(self):
+        self.__start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__profile.add(self.__name, self.__start, time.perf_counter())
+
+
+PROFILE = StartupProfile()
+
+
+class Background(object):
+    """
+    A thread that runs startup tasks one after the other
+
+    An exception of a task stops the thread and is raised again by
+    finish(), on the main thread.
+    """
+
+    def __init__(self, *tasks):
+        self.tasks = tasks
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__run, name="background",
+                                         daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        try:
+            for task in self.tasks:
+                task()
+        except BaseException as error:
+            self.__error = error
+
+    def finish(self):
+        """Wait for every task and raise the exception of a failed one"""
+        with PROFILE.step("wait for background"):
+            self.__thread.join()
+        if self.__error != None:
+            raise self.__error
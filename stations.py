@@ -0,0 +1,448 @@
+"""Run the sessions of several participant stations from one console
+
+    python stations.py STATIONS.json [--refresh 2]
+    python stations.py --simulate N [--type 1] [--seed S] [--threads]
+
+STATIONS.json is a list with one object per station, only name and expinfo
+are required:
+
+    [{"name" : "A",
+      "expinfo" : {"Participant" : "p01", "Number" : "", "Gender" : "",
+                   "Age" : "", "type" : "1"},
+      "screen" : 1,
+      "keyboard" : 3,
+      "audio_device" : "Speakers (A)",
+      "plan" : "plans/plan0000_type1.json",
+      "timing" : false}]
+
+Every station runs an exp.Session with its own window, keyboard (the
+psychtoolbox device index) and result sink. By default the stations are the
+processes of a supervised pool. The supervisor builds the stimulus cache of
+stimcache.py before it starts them, so every station memory-maps the same
+read-only entries and the operating system keeps one copy of the decoded
+stimuli for all of them. A station whose process fails is started again on
+its result log, like exp.py --resume, up to MAX_RESTARTS times.
+
+With --threads the stations are sessions of the supervisor's process and
+share the asset cache itself. A psychopy window has to be driven from the
+thread that created it and the flip loop of every station waits for the
+refresh of its own screen, so this mode runs simulated stations, see
+simulation.py; real screens use the process pool.
+
+The console shows the progress, accuracy, mean response time and memory of
+every station every REFRESH seconds, the output of the sessions is written
+to OUTPUT_DIRNAME.
+"""
+from startup import date_str
+import multiprocessing
+import contextlib
+import traceback
+import threading
+import argparse
+import queue
+import json
+import time
+import sys
+import os
+
+# the seconds between two updates of the console
+REFRESH = 2.0
+
+# the number of times a failed station process is started again
+MAX_RESTARTS = 1
+
+# the output of the sessions, the console only shows the status table
+OUTPUT_DIRNAME = os.path.join("experiment_data", "stations")
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def memory_usage():
+    """Get the resident and the shared memory of the process
+
+    The shared memory contains the mapped entries of the stimulus cache,
+    which are only stored once for every station.
+
+    Returns
+    -------
+    resident : int
+        bytes
+    shared : int
+        bytes
+    None :
+        if /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            fields = file.read().split()
+    except OSError:
+        return None
+    return int(fields[1]) * PAGE_SIZE, int(fields[2]) * PAGE_SIZE
+
+
+def run_session(config, emit, listener):
+    """Run the session of a real station, see the module docstring for the
+    keys of config
+
+    Returns
+    -------
+    the number of recorded trials, None if the session was interrupted
+    """
+    if config.get("audio_device") != None:
+        # read by psychopy.sound when it is imported
+        from psychopy import prefs
+        prefs.hardware['audioDevice'] = config["audio_device"]
+    import exp
+    exp.import_modules()
+
+    kb = None
+    if config.get("keyboard") != None:
+        from psychopy.hardware import keyboard
+        from response import ResponseKeyboard
+        kb = ResponseKeyboard(keyboard.Keyboard(config["keyboard"]))
+
+    if config.get("resume") != None:
+        session = exp.Session.resume(config["resume"], kb, listener)
+        session.prepare_plan()
+    else:
+        expinfo = dict(config["expinfo"])
+        expinfo.setdefault('dateStr', date_str())
+        session = exp.Session(expinfo, kb, listener)
+        session.prepare_plan(config.get("plan"))
+        session.open_sink()
+    emit("start", pid=os.getpid(), log=session.sink.filename,
+         participant=session.expinfo['Participant'], type=session.type)
+
+    session.setup(timing=config.get("timing", False),
+                  screen=config.get("screen", 0))
+    try:
+        data = session.run(session.filename('data.json'))
+    except exp.SessionInterrupted as e:
+        # stopped with escape, the log is resumed by hand, not by a restart
+        session.sink.close()
+        session.close()
+        emit("interrupted", stage=e.stage, trials=e.trials)
+        return None
+    session.close()
+    return sum(len(records) for records in data.values())
+
+
+def run_station(config, events):
+    """Run the session of a station and report it to the supervisor
+
+    Parameters
+    ----------
+    config : dict
+        the station, see the module docstring. A simulated station has
+        "simulate" set and an optional "seed".
+    events : queue.Queue, multiprocessing.Queue
+        receives (kind, station name, values) tuples
+
+    Returns
+    -------
+    True if the session has finished or has been interrupted
+    """
+    name = config["name"]
+
+    def emit(kind, **values):
+        events.put((kind, name, values))
+
+    def listener(record):
+        values = {"event" : record["event"], "stage" : record.get("stage"),
+                  "memory" : memory_usage()}
+        if record["event"] == "trial":
+            values["correct"] = record["row"]["correct"]
+            values["response_time"] = record["row"]["response_time"]
+        emit("record", **values)
+
+    try:
+        if config.get("simulate"):
+            from simulation import simulate_session
+            emit("start", pid=os.getpid(), log=None,
+                 participant=config["expinfo"]["Participant"],
+                 type=config["expinfo"]["type"])
+            result = simulate_session(config["expinfo"]["type"],
+                seed=config.get("seed"),
+                participant_id=config["expinfo"]["Participant"],
+                listener=listener)
+            trials = result["trials"]
+        else:
+            trials = run_session(config, emit, listener)
+    except BaseException:
+        emit("error", error=traceback.format_exc())
+        return False
+    if trials == None:
+        return True
+    emit("done", trials=trials, memory=memory_usage())
+    return True
+
+
+def output_file(name):
+    """Open the file the output of a station is appended to"""
+    os.makedirs(OUTPUT_DIRNAME, exist_ok=True)
+    return open(os.path.join(OUTPUT_DIRNAME, name + ".log"), 'a',
+                encoding='utf-8', buffering=1)
+
+
+def station_process(config, events):
+    """The target of a station process"""
+    sys.stdout = sys.stderr = output_file(config["name"])
+    if config.get("simulate"):
+        from simulation import Headless
+        with Headless():
+            finished = run_station(config, events)
+    else:
+        finished = run_station(config, events)
+    sys.exit(0 if finished else 1)
+
+
+class StationStatus(object):
+    """
+    A class used to collect the progress of a station on the console
+
+    Attributes
+    ----------
+    config : dict
+        the station
+    state : str
+        starting, running, done, interrupted or failed
+    log : str, None
+        the result log of the session, a restarted station resumes it
+    restarts : int
+        the number of times the station has been started again
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.name = config["name"]
+        self.participant = config.get("expinfo", {}).get("Participant", "")
+        self.type = config.get("expinfo", {}).get("type", "")
+        self.state = "starting"
+        self.stage = ""
+        self.log = None
+        self.pid = None
+        self.trials = 0
+        self.correct = 0
+        self.rt_sum = 0.0
+        self.rt_count = 0
+        self.memory = None
+        self.restarts = 0
+        self.error = None
+
+    def update(self, kind, values):
+        if values.get("memory") != None:
+            self.memory = values["memory"]
+        if kind == "start":
+            self.state = "running"
+            self.pid = values["pid"]
+            self.participant = values["participant"]
+            self.type = values["type"]
+            if values["log"] != None:
+                self.log = values["log"]
+        elif kind == "record":
+            if values["event"] in ("stage_start", "stage_resume"):
+                self.stage = values["stage"]
+            elif values["event"] == "trial":
+                self.trials += 1
+                self.correct += values["correct"] == True
+                if values["response_time"] != None:
+                    self.rt_sum += values["response_time"]
+                    self.rt_count += 1
+        elif kind == "done":
+            self.state = "done"
+            self.stage = ""
+        elif kind == "interrupted":
+            self.state = "interrupted"
+        elif kind == "error":
+            self.state = "failed"
+            self.error = values["error"]
+
+    def line(self):
+        accuracy = "%7.1f%%" % (self.correct / self.trials * 100) \
+            if self.trials else "%8s" % "-"
+        mean_rt = "%8.3f" % (self.rt_sum / self.rt_count) \
+            if self.rt_count else "%8s" % "-"
+        if self.memory != None:
+            resident, shared = self.memory
+            memory = "%8.0f %8.0f" % (resident / 2 ** 20,
+                                      (resident - shared) / 2 ** 20)
+        else:
+            memory = "%8s %8s" % ("-", "-")
+        return "%-8s %-12s %-4s %-16s %6d %s %s %-8s %s" % (
+            self.name[:8], self.participant[:12], self.type, self.stage,
+            self.trials, accuracy, mean_rt, self.state, memory)
+
+
+class Supervisor(object):
+    """
+    A class used to start the stations, restart the failed ones and show
+    their progress on one console
+
+    Attributes
+    ----------
+    statuses : list
+        a StationStatus for every station
+    threads : Boolean
+        run the stations as threads of this process instead of processes
+    """
+
+    def __init__(self, configs, threads=False, refresh=REFRESH,
+                 max_restarts=MAX_RESTARTS, out=sys.stdout):
+        self.statuses = [StationStatus(config) for config in configs]
+        self.threads = threads
+        self.refresh = refresh
+        self.max_restarts = max_restarts
+        self.out = out
+        if threads:
+            self.__events = queue.Queue()
+        else:
+            # a station process imports psychopy and opens its window from
+            # scratch instead of inheriting the supervisor
+            self.__context = multiprocessing.get_context('spawn')
+            self.__events = self.__context.Queue()
+        self.__workers = {}
+
+    def __start(self, status):
+        config = status.config
+        if status.log != None and not config.get("simulate"):
+            config = dict(config, resume=status.log)
+        if self.threads:
+            worker = threading.Thread(target=run_station, name=status.name,
+                                      args=(config, self.__events), daemon=True)
+        else:
+            worker = self.__context.Process(target=station_process,
+                name=status.name, args=(config, self.__events))
+        worker.start()
+        self.__workers[status.name] = worker
+
+    def __exited(self, status, worker):
+        worker.join()
+        if self.threads:
+            finished = status.state in ("done", "interrupted")
+        else:
+            finished = worker.exitcode == 0
+        del self.__workers[status.name]
+        if finished:
+            if status.state != "interrupted":
+                status.state = "done"
+        elif not self.threads and status.restarts < self.max_restarts:
+            status.restarts += 1
+            status.state = "restarting"
+            self.__start(status)
+        else:
+            status.state = "failed"
+
+    def __drain(self, timeout):
+        statuses = {status.name : status for status in self.statuses}
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                kind, name, values = self.__events.get(
+                    timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return
+            statuses[name].update(kind, values)
+
+    def run(self):
+        """Run every station to the end
+
+        Returns
+        -------
+        True if every station has finished its session
+        """
+        if self.threads:
+            # the simulated sessions share the null stimuli of the process
+            from simulation import Headless
+            with output_file("threads") as file:
+                with Headless(), contextlib.redirect_stdout(file):
+                    return self.__supervise()
+        if not all(status.config.get("simulate") for status in self.statuses):
+            from stimcache import StimulusStore, experiment_stimuli
+            created = StimulusStore().build(*experiment_stimuli())
+            print("stimulus cache: %d entries created" % created, file=self.out)
+        return self.__supervise()
+
+    def __supervise(self):
+        for status in self.statuses:
+            self.__start(status)
+        while self.__workers:
+            self.__drain(self.refresh)
+            for status in self.statuses:
+                worker = self.__workers.get(status.name)
+                if worker != None and not worker.is_alive():
+                    # the last events of the worker come before its exit
+                    self.__drain(0.1)
+                    self.__exited(status, worker)
+            self.show()
+        for status in self.statuses:
+            if status.state == "failed" and status.error != None:
+                print("%s failed:\n%s" % (status.name, status.error),
+                      file=self.out)
+        return all(status.state == "done" for status in self.statuses)
+
+    def memory_per_station(self):
+        """Estimate the memory a station needs on its own, in bytes
+
+        A station process needs its private memory, a station thread an
+        equal share of the resident memory of the process.
+        """
+        memory = [status.memory for status in self.statuses
+                  if status.memory != None]
+        if not memory:
+            return None
+        if self.threads:
+            return max(resident for resident, _ in memory) / len(self.statuses)
+        return sum(resident - shared for resident, shared in memory) / len(memory)
+
+    def show(self):
+        lines = ["%-8s %-12s %-4s %-16s %6s %8s %8s %-8s %8s %8s" % (
+            "station", "participant", "type", "stage", "trials", "correct",
+            "mean rt", "state", "RSS MB", "priv MB")]
+        lines += [status.line() for status in self.statuses]
+        per_station = self.memory_per_station()
+        if per_station != None:
+            lines.append("%.0f MB per station" % (per_station / 2 ** 20))
+        print('\n'.join(lines) + '\n', file=self.out, flush=True)
+
+
+def simulated_stations(count, session_types=None, seed=None):
+    """Configure count simulated stations, cycling through the session
+    types"""
+    if session_types == None:
+        session_types = ['1', '2', '3', '4']
+    configs = []
+    for i in range(count):
+        name = "sim%d" % (i + 1)
+        configs.append({"name" : name, "simulate" : True,
+                        "seed" : None if seed == None else seed + i,
+                        "expinfo" : {"Participant" : name,
+                                     "type" : session_types[i % len(session_types)]}})
+    return configs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('stations', nargs='?',
+        help='a JSON file with the configuration of every station')
+    parser.add_argument('--simulate', type=int, metavar='N',
+        help='run N simulated stations instead')
+    parser.add_argument('--type', action='append', choices=['1', '2', '3', '4'],
+        help='the session types of the simulated stations, all of them by default')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--threads', action='store_true',
+        help='run the simulated stations in this process')
+    parser.add_argument('--refresh', type=float, default=REFRESH)
+    args = parser.parse_args()
+
+    if args.simulate:
+        configs = simulated_stations(args.simulate, args.type, args.seed)
+    elif args.stations:
+        if args.threads:
+            parser.error('--threads only runs simulated stations')
+        with open(args.stations) as file:
+            configs = json.load(file)
+    else:
+        parser.error('give a stations file or --simulate N')
+
+    supervisor = Supervisor(configs, args.threads, args.refresh)
+    sys.exit(0 if supervisor.run() else 1)
@@ -0,0 +1,302 @@
+"""Decode the stimulus files and keep the results on disk
+
+    python stimcache.py [--sample-rate RATE] [--dirname DIR]
+
+An image is decoded to RGBA pixels at the resolution it is shown at, and a
+wav file to float32 samples at the sample rate of the audio device. The
+results are saved as .npy files named after the SHA-1 of the file content
+and the decoding parameters, so an edited file gets a new entry and a warm
+launch memory-maps the entries instead of decoding the files again.
+
+Running the module builds the entries of every stimulus of the experiment
+ahead of time; otherwise they are built the first time they are requested.
+"""
+from manifest import compile_manifest
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import numpy as np
+import threading
+import argparse
+import hashlib
+import wave
+import glob
+import os
+
+CACHE_DIRNAME = os.path.join("cache", "stimuli")
+
+# the scale of the photos of the trials, see trial.TrialObjects
+PHOTO_SCALE = 0.5
+
+# the sample rate of the audio device, None keeps the rate of every file
+SAMPLE_RATE = None
+
+# the threads that decode the stimulus files, PIL and the wave reader
+# release the GIL while they decode
+DECODE_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def decode_image(path, scale=1):
+    """Read the pixels of an image file at the resolution it is shown at
+
+    Parameters
+    ----------
+    path : str
+        the path of the image file
+    scale : int, float, optional
+        the factor applied to the size of the image
+
+    Returns
+    -------
+    PIL.Image.Image
+        an RGBA image, scaled
+    """
+    img = Image.open(path)
+    img = img.convert('RGBA')
+    if scale != 1:
+        size = (max(int(round(img.width * scale)), 1),
+                max(int(round(img.height * scale)), 1))
+        img = img.resize(size, Image.LANCZOS)
+    return img
+
+
+def decode_sound(path):
+    """Read the samples of a 16-bit PCM wav file
+
+    Returns
+    -------
+    samples : numpy.ndarray
+        float32 samples in [-1, 1] with one column per channel
+    rate : int
+        the sample rate of the file
+    None :
+        if the file is not a 16-bit PCM wav file, psychopy will read it
+    """
+    try:
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                return None
+            channels = wav.getnchannels()
+            rate = wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768
+    return samples.reshape(-1, channels), rate
+
+
+def resample(samples, rate, target_rate):
+    """Resample the columns of samples by linear interpolation
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 samples at target_rate
+    """
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    n = int(round(len(samples) * target_rate / rate))
+    t = np.arange(n) * (rate / target_rate)
+    source = np.arange(len(samples))
+    return np.stack([np.interp(t, source, samples[:, channel])
+                     for channel in range(samples.shape[1])],
+                    axis=1).astype(np.float32)
+
+
+class StimulusStore(object):
+    """
+    A class used to keep decoded stimuli in memory-mappable files
+
+    Attributes
+    ----------
+    dirname : str
+        the directory of the entries
+    sample_rate : int, None
+        the rate the sounds are resampled to, None keeps the rate of the
+        file
+    hits : int
+        the number of entries read from the disk
+    misses : int
+        the number of entries that had to be decoded
+    """
+
+    def __init__(self, dirname=CACHE_DIRNAME, sample_rate=SAMPLE_RATE):
+        self.dirname = dirname
+        self.sample_rate = sample_rate
+        self.hits = 0
+        self.misses = 0
+        self.__hashes = {}
+        # the counters are updated by the threads of build() and of the
+        # asset cache
+        self.__lock = threading.Lock()
+
+    def content_hash(self, path):
+        """Get the SHA-1 of the file, remembered until the file changes"""
+        stat = os.stat(path)
+        key = (os.path.normpath(path), stat.st_mtime_ns, stat.st_size)
+        digest = self.__hashes.get(key)
+        if digest == None:
+            with open(path, 'rb') as file:
+                digest = self.__hashes[key] = hashlib.sha1(file.read()).hexdigest()
+        return digest
+
+    def filename(self, path, variant):
+        return os.path.join(self.dirname,
+            "%s_%s.npy" % (self.content_hash(path), variant))
+
+    def __load(self, filename):
+        try:
+            array = np.load(filename, mmap_mode='r')
+        except (OSError, ValueError):
+            # missing, or cut short by a crash while it was written
+            return None
+        with self.__lock:
+            self.hits += 1
+        return array
+
+    def __save(self, filename, array):
+        with self.__lock:
+            self.misses += 1
+        os.makedirs(self.dirname, exist_ok=True)
+        # written under a temporary name, so a reader never sees half a file,
+        # one for every thread of the decoding pool
+        temporary = "%s.%d.%d.tmp" % (filename, os.getpid(), threading.get_ident())
+        with open(temporary, 'wb') as file:
+            np.save(file, array)
+        os.replace(temporary, filename)
+
+    def image(self, path, scale=1):
+        """Get the pixels of an image file, see decode_image
+
+        Returns
+        -------
+        PIL.Image.Image
+            an RGBA image sharing the memory of the mapped entry
+        """
+        filename = self.filename(path, "rgba%g" % scale)
+        pixels = self.__load(filename)
+        if pixels is None:
+            img = decode_image(path, scale)
+            self.__save(filename, np.asarray(img))
+            return img
+        height, width = pixels.shape[:2]
+        return Image.frombuffer('RGBA', (width, height), pixels, 'raw', 'RGBA', 0, 1)
+
+    def sound(self, path):
+        """Get the samples of a wav file, see decode_sound
+
+        Returns
+        -------
+        samples : numpy.ndarray
+            float32 samples mapped from the entry
+        rate : int
+        None :
+            if the file is not a 16-bit PCM wav file
+        """
+        rate = self.sample_rate
+        if rate == None:
+            try:
+                with wave.open(path, 'rb') as wav:
+                    rate = wav.getframerate()
+            except (wave.Error, EOFError):
+                return None
+        filename = self.filename(path, "pcm%d" % rate)
+        samples = self.__load(filename)
+        if samples is None:
+            decoded = decode_sound(path)
+            if decoded == None:
+                return None
+            samples = resample(decoded[0], decoded[1], rate)
+            self.__save(filename, samples)
+        return samples, rate
+
+    def build(self, images=(), sounds=(), workers=DECODE_WORKERS):
+        """Create the missing entries of the files
+
+        Parameters
+        ----------
+        images : iterable
+            (path, scale) tuples
+        sounds : iterable
+            paths of wav files
+        workers : int, optional
+            the threads that decode the files
+
+        Returns
+        -------
+        the number of entries that have been created
+        """
+        misses = self.misses
+        tasks = [(self.image, path, scale) for path, scale in images] + \
+            [(self.sound, path) for path in sounds]
+        if workers <= 1:
+            for task in tasks:
+                task[0](*task[1:])
+        else:
+            with ThreadPoolExecutor(workers, thread_name_prefix="decode") as executor:
+                # list() raises the exception of a failed file
+                list(executor.map(lambda task: task[0](*task[1:]), tasks))
+        return self.misses - misses
+
+    def clean(self, keep):
+        """Remove the entries of files that have changed
+
+        Parameters
+        ----------
+        keep : iterable
+            the paths of the current stimulus files
+
+        Returns
+        -------
+        the number of removed entries
+        """
+        hashes = set(self.content_hash(path) for path in keep)
+        removed = 0
+        for filename in glob.glob(os.path.join(self.dirname, "*.npy")):
+            if os.path.basename(filename).split('_')[0] not in hashes:
+                os.remove(filename)
+                removed += 1
+        return removed
+
+
+def experiment_stimuli(trials_dirname="./trials", photos_dirname="./resources/photos",
+                       audio_dirname="./resources/audio"):
+    """List the stimulus files of the experiment
+
+    The photos of the trial sets of the manifest are shown at PHOTO_SCALE
+    and the other images at their own size.
+
+    Returns
+    -------
+    images : list
+        (path, scale) tuples
+    sounds : list
+        the paths of the wav files
+    """
+    manifest = compile_manifest(trials_dirname, photos_dirname, audio_dirname)
+    targets = set(os.path.normpath(trial_set.photo)
+                  for trial_sets in manifest.stages.values()
+                  for trial_set in trial_sets)
+
+    images = []
+    for path in sorted(glob.glob(os.path.join(photos_dirname, "*"))):
+        images.append((path, PHOTO_SCALE if os.path.normpath(path) in targets else 1))
+    sounds = sorted(glob.glob(os.path.join(audio_dirname, "*.wav")))
+    return images, sounds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sample-rate', type=int, default=SAMPLE_RATE,
+        help='the sample rate of the audio device, the rate of every file by default')
+    parser.add_argument('--dirname', default=CACHE_DIRNAME)
+    parser.add_argument('--workers', type=int, default=DECODE_WORKERS,
+        help='the threads that decode the files')
+    parser.add_argument('--clean', action='store_true',
+        help='remove the entries of files that have changed')
+    args = parser.parse_args()
+
+    store = StimulusStore(args.dirname, args.sample_rate)
+    images, sounds = experiment_stimuli()
+    print("%d entries created" % store.build(images, sounds, args.workers))
+    if args.clean:
+        print("%d entries removed" % store.clean([path for path, _ in images] + sounds))
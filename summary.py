@@ -0,0 +1,132 @@
+"""Summary statistics of the trial results
+
+The input of the summaries is a trial table, a pandas.DataFrame with one
+row per trial:
+
+    stage           str       stage1 or stage2
+    order           str       former or latter
+    type            str       the condition, one of TYPES
+    response_time   float     seconds from the onset of word1, NaN if the
+                              participant didn't respond
+    correct         object    True, False or 'no response', or a
+                              categorical of these
+
+Any other column (e.g. session or Participant) can be used as an extra
+grouping key.
+
+summarize() returns one row per group with the columns:
+
+    n               int       the number of trials
+    responses       int       the number of trials with a response
+    no_response     int       the number of trials without a response
+    mean_rt         float     the mean response time of the responses
+    median_rt       float     the median response time of the responses
+    sd_rt           float     the sample SD of the response times
+    correct_rt      float     the mean response time of the correct trials
+    accuracy        float     correct trials / n, a missing response is an
+                              error
+    ies             float     the inverse efficiency score,
+                              correct_rt / accuracy, NaN without any correct
+                              trial
+"""
+from records import TrialRecords
+from manifest import TYPES, TYPE_ALIASES
+import pandas as pd
+import numpy as np
+
+STAGE_KEYS = ["stage", "order"]
+KEYS = STAGE_KEYS + ["type"]
+
+
+def trial_table(data):
+    """Build the trial table of a session
+
+    Parameters
+    ----------
+    data : dict
+        the records.TrialRecords or the list of result rows of every stage,
+        keyed by names like stage1_former
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    frames = []
+    for name, rows in data.items():
+        if isinstance(rows, TrialRecords):
+            df = rows.to_frame()
+        else:
+            df = pd.DataFrame.from_dict(rows)
+        stage, _, order = name.partition('_')
+        df.insert(0, "stage", stage)
+        df.insert(1, "order", order)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=KEYS + ["response_time", "correct"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def summarize(trials, by=KEYS):
+    """Aggregate the trials of every group in one pass
+
+    Parameters
+    ----------
+    trials : pandas.DataFrame
+        a trial table, see the module documentation
+    by : list, optional
+        the grouping columns
+
+    Returns
+    -------
+    pandas.DataFrame
+        indexed by the grouping columns, see the module documentation
+    """
+    correct = trials["correct"]
+    no_response = (correct == 'no response') | trials["response_time"].isna()
+    is_correct = (correct == True) & ~no_response
+    rt = pd.to_numeric(trials["response_time"], errors='coerce').where(~no_response)
+
+    columns = {key : trials[key] for key in by}
+    if "type" in columns:
+        # replacing categories of a categorical can merge them wrongly
+        columns["type"] = columns["type"].astype(object).replace(TYPE_ALIASES)
+    columns.update({"rt" : rt,
+                    "correct_rt" : rt.where(is_correct),
+                    "is_correct" : is_correct.astype(np.float64),
+                    "no_response" : no_response.astype(np.int64)})
+    df = pd.DataFrame(columns)
+    for key in by:
+        df[key] = df[key].astype('category')
+
+    summary = df.groupby(list(by), observed=True, sort=True).agg(
+        n=("is_correct", "size"),
+        no_response=("no_response", "sum"),
+        mean_rt=("rt", "mean"),
+        median_rt=("rt", "median"),
+        sd_rt=("rt", "std"),
+        correct_rt=("correct_rt", "mean"),
+        accuracy=("is_correct", "mean"))
+    summary.insert(1, "responses", summary["n"] - summary["no_response"])
+    summary["ies"] = summary["correct_rt"] / summary["accuracy"].replace(0, np.nan)
+    return summary
+
+
+def condition_table(summary):
+    """Lay out a stage/order/type summary like statistic_data.xlsx
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per stage_order with the average_response_time_<type> and
+        correctness_rate_<type> columns
+    """
+    wide = summary[["mean_rt", "accuracy"]].unstack("type")
+    table = pd.DataFrame(index=["%s_%s" % index for index in wide.index])
+    for metric, prefix in [("mean_rt", "average_response_time_"),
+                           ("accuracy", "correctness_rate_")]:
+        for key in TYPES:
+            if key in wide[metric].columns:
+                table[prefix + key] = wide[metric][key].to_numpy()
+            else:
+                table[prefix + key] = np.nan
+    return table
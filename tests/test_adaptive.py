@@ -0,0 +1,95 @@
+"""The trial schedules of adaptive.py"""
+import math
+import random
+import pytest
+
+from records import TrialRecords, RIGHT, WRONG, NO_RESPONSE
+from adaptive import Exhaustive, ConditionStopping, Condition, MIN_TRIALS
+
+
+class Trial(object):
+    """The part of trial.TrialObject a schedule uses"""
+
+    def __init__(self, condition, number):
+        self.condition = condition
+        self.number = number
+
+    def type(self):
+        return self.condition
+
+
+def run_round(schedule, respond):
+    """Run the trials a schedule picks, respond gives the correctness code
+    and the response time of a trial"""
+    records = TrialRecords()
+    shown = []
+    while True:
+        obj = schedule.next()
+        if obj == None:
+            return records, shown
+        shown.append(obj)
+        index = records.append(0, 0, 0, *respond(obj))
+        schedule.update(obj, records, index)
+
+
+def test_beta_posterior_of_the_accuracy():
+    condition = Condition("音同形似")
+    assert condition.accuracy() == (0.5, math.sqrt(1 / 12))
+    for correct in [RIGHT] * 8 + [WRONG] * 2:
+        condition.add(correct, 0.6)
+    mean, sd = condition.accuracy()
+    assert mean == 9 / 12
+    assert sd == pytest.approx(math.sqrt(9 * 3 / (12 ** 2 * 13)))
+
+
+def test_missing_responses_have_no_response_time():
+    condition = Condition("音異形異")
+    condition.add(NO_RESPONSE, math.nan)
+    assert math.isnan(condition.mean_rt()[0])
+    condition.add(RIGHT, 0.7)
+    assert condition.mean_rt() == (0.7, math.inf)
+    condition.add(WRONG, 0.9)
+    mean, se = condition.mean_rt()
+    assert mean == pytest.approx(0.8)
+    assert se == pytest.approx(0.1)
+    # the missing response is an error
+    assert condition.accuracy()[0] == 2 / 5
+
+
+def test_exhaustive_stops_after_max_correctness():
+    trials = [Trial("音同形似", i) for i in range(10)]
+    schedule = Exhaustive(trials, max_correctness=3)
+    assert schedule.upcoming(2) == trials[:2]
+    records, shown = run_round(schedule,
+        lambda obj: (WRONG if obj.number % 2 else RIGHT, 0.8))
+    assert shown == trials[:5]
+    assert schedule.report() == {"trials" : 5, "remaining" : 5}
+
+
+def test_conditions_stop_once_converged():
+    rng = random.Random(11)
+    conditions = {"音同形似" : (0.95, 0.05), "音異形異" : (0.6, 0.3)}
+    trials = [Trial(name, i) for i in range(80) for name in conditions]
+    schedule = ConditionStopping(trials)
+
+    def respond(obj):
+        accuracy, sd = conditions[obj.condition]
+        return RIGHT if rng.random() < accuracy else WRONG, 0.7 + rng.gauss(0, sd)
+
+    records, shown = run_round(schedule, respond)
+    # the conditions below MIN_TRIALS take turns first
+    assert [obj.condition for obj in shown[:4]] == ["音同形似", "音異形異"] * 2
+    assert len(shown) < len(trials)
+
+    report = schedule.report()
+    for name in conditions:
+        assert report[name]["trials"] >= MIN_TRIALS
+        assert report[name]["trials"] + report[name]["remaining"] == 80
+        assert report[name]["converged"]
+        assert report[name]["accuracy_sd"] <= schedule.accuracy_sd
+        assert report[name]["rt_se"] <= schedule.rt_se
+    # the consistent condition converges sooner
+    assert report["音同形似"]["trials"] < report["音異形異"]["trials"]
+    # every condition takes its trials in the given order
+    numbers = [obj.number for obj in shown if obj.condition == "音同形似"]
+    assert numbers == sorted(numbers)
@@ -0,0 +1,137 @@
+"""The sharing and the memory accounting of assets.AssetCache"""
+import pytest
+
+pytest.importorskip("psychopy")
+
+from PIL import Image
+from assets import AssetCache, TEXT_NBYTES, image_nbytes
+from simulation import NullFactory, NullWindow
+
+
+class DecodingFactory(NullFactory):
+    """Builds null stimuli but lets the cache decode the files"""
+
+    headless = False
+
+
+def write_image(tmp_path, name="photo.png", size=(120, 80)):
+    filename = str(tmp_path / name)
+    Image.new('RGB', size, (200, 30, 30)).save(filename)
+    return filename
+
+
+def test_identical_requests_share_one_stimulus(tmp_path):
+    cache = AssetCache(factory=NullFactory())
+    win = NullWindow()
+    filename = write_image(tmp_path)
+
+    photo = cache.image(win, filename, 0.5)
+    assert cache.image(win, str(tmp_path / "." / "photo.png"), 0.5) is photo
+    assert cache.image(win, filename, 1) is not photo
+    assert cache.text(win, "蘋果", 2) is cache.text(win, "蘋果", 2)
+    # another station gets stimuli of its own
+    assert cache.image(NullWindow(), filename, 0.5) is not photo
+
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (4, 2, 4)
+    assert cache.is_loaded(filename)
+
+
+def test_image_is_charged_at_the_size_it_is_shown_at(tmp_path):
+    cache = AssetCache(factory=DecodingFactory())
+    win = NullWindow()
+    filename = write_image(tmp_path)
+
+    cache.decode(filename, 0.5)
+    assert cache.stats()["decoded_nbytes"] == 60 * 40 * 4
+    cache.image(win, filename, 0.5)
+    # the decoded pixels became the texture of the stimulus
+    assert cache.stats()["decoded_nbytes"] == 0
+    assert cache.nbytes() == 60 * 40 * 4
+
+    # read by the factory, the texture has the size of the file
+    other = write_image(tmp_path, "other.png")
+    cache.image(win, other, 0.5)
+    assert cache.nbytes() == 60 * 40 * 4 + image_nbytes(other)
+    assert image_nbytes(other) == 120 * 80 * 4
+
+
+def test_clear_resets_the_cache(tmp_path):
+    cache = AssetCache(factory=NullFactory())
+    win = NullWindow()
+    cache.image(win, write_image(tmp_path), 1)
+    cache.text(win, "蘋果", 2)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes() == 0
+    assert cache.stats()["misses"] == 0
+    assert cache.text(win, "蘋果", 2).draws == 0
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = AssetCache(memory_cap=3 * TEXT_NBYTES, factory=NullFactory())
+    win = NullWindow()
+    first = cache.text(win, "小象", 2)
+    cache.text(win, "小球", 2)
+    cache.text(win, "小鹿", 2)
+    # first is used again, so 小球 is now the oldest
+    assert cache.text(win, "小象", 2) is first
+    cache.text(win, "小丑", 2)
+
+    assert len(cache) == 3
+    assert cache.stats()["evictions"] == 1
+    assert cache.nbytes() == 3 * TEXT_NBYTES
+    assert cache.text(win, "小象", 2) is first
+    misses = cache.stats()["misses"]
+    cache.text(win, "小球", 2)
+    assert cache.stats()["misses"] == misses + 1
+
+
+def test_evicted_image_is_no_longer_loaded(tmp_path):
+    small = write_image(tmp_path, "small.png", (10, 10))
+    large = write_image(tmp_path, "large.png", (100, 100))
+    cache = AssetCache(memory_cap=image_nbytes(large), factory=NullFactory())
+    win = NullWindow()
+
+    cache.image(win, small)
+    assert cache.is_loaded(small)
+    # larger than what is left, the oldest entry makes room
+    cache.image(win, large)
+    assert not cache.is_loaded(small)
+    assert cache.is_loaded(large)
+
+    # an entry over the whole cap is still kept until the next request
+    cache.memory_cap = 1
+    cache.image(win, small)
+    assert len(cache) == 1
+    assert cache.is_loaded(small)
+
+
+def test_decoded_files_count_against_the_cap(tmp_path):
+    photo = write_image(tmp_path, "photo.png", (200, 200))
+    other = write_image(tmp_path, "other.png", (200, 200))
+    cache = AssetCache(memory_cap=200 * 200 * 4 + TEXT_NBYTES,
+                       factory=DecodingFactory())
+    win = NullWindow()
+
+    cache.decode(photo)
+    assert cache.nbytes() == 200 * 200 * 4
+    # doesn't fit next to the decoded photo, dropped
+    cache.decode(other)
+    assert cache.stats()["decoded_nbytes"] == 200 * 200 * 4
+    cache.text(win, "小象", 2)
+    assert cache.nbytes() == cache.memory_cap
+    assert cache.stats()["evictions"] == 0
+
+    # read again by the factory, the text makes room for it
+    cache.image(win, other)
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 1
+    assert cache.is_loaded(other)
+
+    # the decoded photo becomes a stimulus, the other one makes room
+    cache.image(win, photo)
+    assert cache.stats()["decoded_nbytes"] == 0
+    assert cache.nbytes() == 200 * 200 * 4
+    assert not cache.is_loaded(other)
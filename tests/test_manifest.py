@@ -0,0 +1,104 @@
+"""The validation and the staleness check of the stimulus manifest"""
+import os
+import shutil
+import threading
+import pytest
+
+from manifest import Manifest, compile_manifest, get_manifest, STAGES
+from plan import read_layout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHOTOS_DIRNAME = os.path.join(ROOT, "resources", "photos")
+AUDIO_DIRNAME = os.path.join(ROOT, "resources", "audio")
+
+
+@pytest.fixture
+def trials_dirname(tmp_path):
+    dirname = str(tmp_path / "trials")
+    shutil.copytree(os.path.join(ROOT, "trials"), dirname)
+    return dirname
+
+
+def compile_copy(dirname):
+    return compile_manifest(dirname, PHOTOS_DIRNAME, AUDIO_DIRNAME)
+
+
+def test_manifest_matches_the_trial_files(trials_dirname):
+    manifest = compile_copy(trials_dirname)
+    assert sorted(manifest.stages) == sorted(STAGES)
+    assert manifest.layout() == read_layout(trials_dirname)
+    # the practice files name the conditions like the main rounds
+    practice = manifest.stages["stage1_practice"][0]
+    assert [type for _, type in practice.tests] == \
+        ["音同形似", "音異形似", "音同形異", "音異形異"]
+    assert practice.audio == None
+    recorded = manifest.stages["stage2_former"][0]
+    assert recorded.audio == os.path.join(AUDIO_DIRNAME, recorded.target + ".wav")
+
+
+def test_save_load_round_trip(trials_dirname, tmp_path):
+    manifest = compile_copy(trials_dirname)
+    filename = str(tmp_path / "cache" / "manifest.json")
+    manifest.save(filename)
+    loaded = Manifest.load(filename)
+    assert loaded.to_dict() == manifest.to_dict()
+    assert loaded.stages["stage1_former"][2].tests == \
+        manifest.stages["stage1_former"][2].tests
+
+
+def test_staleness(trials_dirname):
+    manifest = compile_copy(trials_dirname)
+    assert not manifest.is_stale()
+
+    filename = os.path.join(trials_dirname, "stage1_former.csv")
+    # touched by a checkout without a change
+    os.utime(filename, ns=(0, 0))
+    assert not manifest.is_stale()
+
+    with open(filename, 'a', encoding='utf-8') as file:
+        file.write("\n")
+    assert manifest.is_stale()
+    os.remove(filename)
+    assert manifest.is_stale()
+
+
+def test_every_problem_is_reported(trials_dirname):
+    filename = os.path.join(trials_dirname, "stage2_latter.csv")
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write("目標詞彙,音同形似,音同形似,形似\n"
+                   "罐子,灌子,冠子,喝子\n"
+                   "書包,輸包\n"
+                   "沒有照片,沒有,照片,了\n")
+    os.remove(os.path.join(trials_dirname, "stage1_latter.csv"))
+
+    with pytest.raises(ValueError) as info:
+        compile_copy(trials_dirname)
+    message = str(info.value)
+    assert "stage1_latter.csv: No such file" in message
+    assert "repeated condition 音同形似" in message
+    assert "unknown condition 形似" in message
+    assert "stage2_latter.csv:3: expected 4 words" in message
+    assert "stage2_latter.csv:4: missing photo" in message
+    assert "missing recording" in message
+
+
+def test_stations_compile_the_manifest_at_the_same_time(monkeypatch, tmp_path):
+    # get_manifest compiles the trial files of the working directory
+    monkeypatch.chdir(ROOT)
+    filename = str(tmp_path / "manifest.json")
+    errors = []
+
+    def station():
+        try:
+            get_manifest(filename)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=station) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert not Manifest.load(filename).is_stale()
+    assert os.listdir(str(tmp_path)) == ["manifest.json"]
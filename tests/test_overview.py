@@ -0,0 +1,73 @@
+"""The session rows of overview.OverviewStore"""
+import threading
+import pytest
+
+from overview import OverviewStore
+
+
+def session(participant, date, accuracy):
+    return {"Participant" : participant, "dateStr" : date, "type" : "1",
+            "correctness_rate_音同形似" : accuracy}
+
+
+def test_sessions_are_queried_in_the_order_they_were_recorded(tmp_path):
+    store = OverviewStore(str(tmp_path / "data" / "overview.sqlite"))
+    store.add_session(session("p01", "2024_Mar_04_0930", 0.75))
+    store.add_session(session("p02", "2024_Mar_11_1400", 0.5))
+    store.add_session(session("p01", "2024_Apr_02_1000", 0.875))
+
+    assert len(store) == 3
+    assert [row["dateStr"] for row in store.sessions("p01")] == \
+        ["2024_Mar_04_0930", "2024_Apr_02_1000"]
+    assert store.sessions("p02") == [session("p02", "2024_Mar_11_1400", 0.5)]
+    assert [row["Participant"] for row in store.sessions(since="2024_Mar_10")] == \
+        ["p02"]
+    assert store.sessions("p03") == []
+    store.close()
+
+    # the rows outlive the connection
+    store = OverviewStore(str(tmp_path / "data" / "overview.sqlite"))
+    assert len(store) == 3
+    store.close()
+
+
+def test_stations_write_concurrently(tmp_path):
+    filename = str(tmp_path / "overview.sqlite")
+    OverviewStore(filename).close()
+
+    def station(i):
+        store = OverviewStore(filename)
+        for j in range(20):
+            store.add_session(session("p%02d" % i, "2024_May_%02d" % (j + 1), j / 20))
+        store.close()
+
+    threads = [threading.Thread(target=station, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    store = OverviewStore(filename)
+    assert len(store) == 80
+    assert len(store.sessions("p03")) == 20
+    store.close()
+
+
+def test_excel_round_trip(tmp_path):
+    pytest.importorskip("openpyxl")
+    store = OverviewStore(str(tmp_path / "overview.sqlite"))
+    store.add_session(session("p01", "2024_Mar_04_0930", 0.75))
+    store.add_session({"Participant" : "p02", "dateStr" : "2024_Mar_11_1400",
+                       "type" : "2"})
+    filename = str(tmp_path / "overview.xlsx")
+    df = store.export_excel(filename)
+    assert list(df["Participant"]) == ["p01", "p02"]
+
+    imported = OverviewStore(str(tmp_path / "imported.sqlite"))
+    assert imported.import_excel(filename) == 2
+    rows = imported.sessions()
+    assert rows[0]["correctness_rate_音同形似"] == 0.75
+    # a missing value is stored as null, not NaN
+    assert rows[1]["correctness_rate_音同形似"] == None
+    store.close()
+    imported.close()
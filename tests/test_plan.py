@@ -0,0 +1,83 @@
+"""The seeded session plans of plan.py"""
+import json
+import os
+import types
+import pytest
+
+from plan import (SessionPlan, compile_plan, compile_cohort, read_layout,
+                  stage_layout, SESSION_ORDERS, STAGES)
+
+TRIALS_DIRNAME = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "trials")
+
+
+def test_layout_of_the_trial_files():
+    layout = read_layout(TRIALS_DIRNAME)
+    assert sorted(layout) == sorted(STAGES)
+    # a target word and four test words, in both orders
+    assert all(size == 8 for sizes in layout.values() for size in sizes)
+    assert len(layout["stage1_former"]) > 0
+
+
+def test_plan_is_reproduced_from_its_seed():
+    layout = read_layout(TRIALS_DIRNAME)
+    plan = compile_plan('3', layout, seed=1234)
+    assert plan.to_dict() == compile_plan('3', layout, seed=1234).to_dict()
+    assert compile_plan('3', layout, seed=1235).trials != plan.trials
+    assert plan.order == SESSION_ORDERS['3']
+    assert plan.seed == 1234
+
+
+def test_every_trial_of_a_round_once_and_distinct_practice_sets():
+    layout = {name : [8, 8, 4, 8] for name in STAGES}
+    plan = compile_plan('4', layout, seed=3, num_practices=3)
+    assert sorted(plan.trials["stage2_latter"]) == \
+        [(index, trial) for index, size in enumerate([8, 8, 4, 8])
+         for trial in range(size)]
+    practice = plan.trials["stage1_practice"]
+    assert len(practice) == 3
+    assert len({index for index, _ in practice}) == 3
+    assert all(trial < layout["stage1_practice"][index] for index, trial in practice)
+
+
+def test_resolve_picks_the_planned_trial_objects():
+    stage = [types.SimpleNamespace(trial_objects=["%s%d" % (target, i) for i in range(size)])
+             for target, size in [("象", 4), ("球", 6), ("鹿", 2)]]
+    layout = {name : stage_layout(stage) for name in STAGES}
+    assert layout["stage1_former"] == [4, 6, 2]
+    plan = compile_plan('2', layout, seed=99, num_practices=2)
+
+    resolved = plan.resolve("stage1_former", stage)
+    assert sorted(resolved) == sorted(name for objs in stage for name in objs.trial_objects)
+    assert resolved[0] == stage[plan.trials["stage1_former"][0][0]].trial_objects[
+        plan.trials["stage1_former"][0][1]]
+
+    plan.validate(layout)
+    with pytest.raises(ValueError):
+        plan.validate(dict(layout, stage1_former=[4, 6]))
+
+
+def test_save_load_round_trip(tmp_path):
+    plan = compile_plan('1', read_layout(TRIALS_DIRNAME), seed=7)
+    filename = str(tmp_path / "plan.json")
+    plan.save(filename)
+    loaded = SessionPlan.load(filename)
+    assert loaded.to_dict() == plan.to_dict()
+    # the pairs are tuples again, like those of a compiled plan
+    assert loaded.trials == plan.trials
+
+    with open(filename) as file:
+        saved = json.load(file)
+    saved["version"] = 0
+    with pytest.raises(ValueError):
+        SessionPlan.from_dict(saved)
+
+
+def test_cohort_cycles_the_session_types(tmp_path):
+    layout = read_layout(TRIALS_DIRNAME)
+    filenames = compile_cohort(str(tmp_path / "plans"), 6, seed=100, layout=layout)
+    plans = [SessionPlan.load(filename) for filename in filenames]
+    assert [plan.type for plan in plans] == ['1', '2', '3', '4', '1', '2']
+    assert [plan.seed for plan in plans] == list(range(100, 106))
+    assert plans[4].to_dict() == compile_plan('1', layout, seed=104).to_dict()
+    assert os.path.basename(filenames[2]) == "plan0002_type3.json"
@@ -0,0 +1,84 @@
+"""The incremental parsing of reanalyze.load_trials over an archive of raw
+data workbooks"""
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip("openpyxl")
+pytest.importorskip("pyarrow")
+
+from reanalyze import load_trials, parse, RAW_DATA_SUFFIX
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_workbook(dirname, session, trials, stages=True):
+    """Write a raw data workbook like sink.export_reports, trials are
+    (stage, order, type, word1, word2, response_time, correct)"""
+    columns = ["stage", "order", "type", "word1", "word2", "response_time",
+               "correct"]
+    df = pd.DataFrame(trials, columns=columns)
+    df["key_time"] = None
+    if not stages:
+        df = df.drop(columns=["stage", "order"])
+    filename = os.path.join(dirname, session + RAW_DATA_SUFFIX)
+    df.to_excel(filename)
+    return filename
+
+
+def test_parse_old_workbook_without_stages(tmp_path, monkeypatch):
+    # the stages are found through the trial files of the repository
+    monkeypatch.chdir(ROOT)
+    filename = write_workbook(str(tmp_path), "p01_2023_Oct_05",
+        [(None, None, "音同形似", "小象", "小像", 0.92, True),
+         (None, None, "音異形異", "粽子", "固子", "", 'no response')],
+        stages=False)
+
+    df = parse(filename)
+    assert list(df["session"]) == ["p01_2023_Oct_05"] * 2
+    assert list(df["stage"]) == ["stage1", "stage2"]
+    assert list(df["order"]) == ["former", "latter"]
+    assert list(df["correct"]) == [True, False]
+    assert df["response_time"][0] == 0.92
+    assert pd.isna(df["response_time"][1])
+
+
+def test_only_changed_workbooks_are_parsed_again(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    cache = str(tmp_path / "cache" / "trials.parquet")
+    write_workbook(str(data), "p01_2024_Mar_04",
+        [("stage1", "former", "音同形似", "小象", "小像", 0.8, True),
+         ("stage1", "former", "音異形似", "小球", "小救", 1.1, False)])
+    second = write_workbook(str(data), "p02_2024_Mar_11",
+        [("stage2", "latter", "音同形異", "罐子", "冠子", 0.7, True)])
+
+    trials, parsed = load_trials(str(data), cache, jobs=2)
+    assert parsed == 2
+    assert len(trials) == 3
+    assert os.path.exists(cache)
+
+    trials, parsed = load_trials(str(data), cache, jobs=2)
+    assert parsed == 0
+    assert sorted(trials["session"].unique()) == ["p01_2024_Mar_04", "p02_2024_Mar_11"]
+
+    write_workbook(str(data), "p02_2024_Mar_11",
+        [("stage2", "latter", "音同形異", "罐子", "冠子", 0.7, True),
+         ("stage2", "latter", "音異形異", "罐子", "喝子", 0.9, True)])
+    os.utime(second, (0, os.path.getmtime(second) + 10))
+    trials, parsed = load_trials(str(data), cache, jobs=2)
+    assert parsed == 1
+    assert (trials["session"] == "p02_2024_Mar_11").sum() == 2
+
+    os.remove(second)
+    trials, parsed = load_trials(str(data), cache, jobs=2)
+    assert parsed == 0
+    assert list(trials["session"].unique()) == ["p01_2024_Mar_04"]
+    # the removed session is gone from the cache as well
+    assert len(pd.read_parquet(cache)) == 2
+
+
+def test_empty_archive(tmp_path):
+    trials, parsed = load_trials(str(tmp_path), None)
+    assert parsed == 0
+    assert len(trials) == 0
@@ -0,0 +1,101 @@
+"""The columnar result buffer of records.TrialRecords"""
+import json
+import math
+import threading
+import pandas as pd
+import pytest
+
+from records import (TrialRecords, Categories, WORDS, TYPES, MEASURE_COLUMNS,
+                     RIGHT, WRONG, NO_RESPONSE, correctness_code)
+
+
+def fill(records, n):
+    """Record n trials that cycle through the three correctness codes"""
+    for i in range(n):
+        correct = [RIGHT, WRONG, NO_RESPONSE][i % 3]
+        rt = None if correct == NO_RESPONSE else 0.6 + i / 50
+        records.append(WORDS.code("靶%d" % i), WORDS.code("測%d" % i),
+            TYPES.code(["音異形似", "音同形異"][i % 2]), correct, rt,
+            None if rt == None else 40.0 + rt)
+        if i % 4 == 0:
+            records.measure({"dropped_frames" : i // 4, "photo_duration_ms" : 500.2})
+    return records
+
+
+def test_growing_keeps_the_recorded_trials():
+    records = fill(TrialRecords(2), 11)
+    assert len(records) == 11
+    assert len(records.correct) == 16
+    assert all(len(column) == 16 for column in records.measures.values())
+
+    rows = records.rows()
+    assert [row["correct"] for row in rows[:3]] == [True, False, 'no response']
+    assert rows[2]["response_time"] == None
+    assert rows[10]["response_time"] == pytest.approx(0.8)
+    assert rows[10]["key_time"] == pytest.approx(40.8)
+    assert rows[8]["dropped_frames"] == 2
+    assert isinstance(rows[8]["dropped_frames"], int)
+    assert rows[9]["photo_duration_ms"] == None
+    assert (rows[7]["word1"], rows[7]["type"]) == ("靶7", "音同形異")
+
+
+def test_every_row_has_the_same_keys():
+    records = TrialRecords(4)
+    fill(records, 2)
+    expected = ["response_time", "word1", "word2", "correct", "type",
+                "key_time"] + MEASURE_COLUMNS
+    assert list(records.row(0)) == expected
+    assert list(records.row(1)) == expected
+    # the columns are never added while a trial runs
+    columns = records.measures
+    records.measure({"av_asynchrony_ms" : 1.5})
+    assert records.measures is columns
+    assert len(columns) == len(MEASURE_COLUMNS)
+
+
+def test_from_rows_rebuilds_the_buffer():
+    rows = fill(TrialRecords(), 7).rows()
+    rebuilt = TrialRecords.from_rows(json.loads(json.dumps(rows)), capacity=20)
+    assert rebuilt.rows() == rows
+    assert len(rebuilt.correct) == 20
+    # a resumed stage keeps recording into the rebuilt buffer
+    rebuilt.append(WORDS.code("靶7"), WORDS.code("測7"), TYPES.code("音同形異"),
+                   correctness_code(True), 0.74)
+    assert rebuilt.rows()[-1]["response_time"] == 0.74
+    assert rebuilt.is_correct()
+
+
+def test_frame_and_arrow_views():
+    records = fill(TrialRecords(16), 6)
+    df = records.to_frame()
+    assert len(df) == 6
+    assert list(df["correct"].astype(object)[:3]) == [True, False, 'no response']
+    assert df["type"].iloc[1] == "音同形異"
+    assert math.isnan(df["response_time"].iloc[2])
+    assert df["dropped_frames"].iloc[4] == 1
+
+    pytest.importorskip("pyarrow")
+    table = records.to_arrow()
+    assert table.num_rows == 6
+    assert table.column("word1").to_pylist()[3] == "靶3"
+    assert table.column("correct").to_pylist()[:3] == ["True", "False", "no response"]
+    pd.testing.assert_series_equal(table.column("response_time").to_pandas(),
+        df["response_time"], check_names=False)
+
+
+def test_categories_give_one_code_per_name():
+    categories = Categories()
+    codes = {}
+
+    def add(i):
+        codes[i] = [categories.code("name%d" % (j % 50)) for j in range(500)]
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(categories) == 50
+    assert all(codes[i] == codes[0] for i in codes)
+    assert [categories.names[code] for code in codes[0][:50]] == \
+        ["name%d" % j for j in range(50)]
@@ -0,0 +1,103 @@
+"""Resuming an interrupted session from its result log"""
+import pytest
+
+from records import TrialRecords, WORDS, TYPES, RIGHT, WRONG
+from sink import ResultSink, read_log
+
+
+def round_records(words):
+    """Record a round where every other answer is wrong"""
+    records = TrialRecords(len(words))
+    for i, (target, test) in enumerate(words):
+        records.append(WORDS.code(target), WORDS.code(test),
+            TYPES.code("音異形似"), WRONG if i % 2 else RIGHT, 0.7 + i / 10,
+            3.2 + i)
+    records.measure({"av_asynchrony_ms" : 0.4}, 0)
+    return records
+
+
+FORMER = round_records([("小象", "小豫"), ("小球", "小救")])
+LATTER = round_records([("粽子", "粹子"), ("罐子", "歡子"), ("旗子", "棋子"),
+                        ("褲子", "庫子")])
+
+
+def interrupted_log(filename):
+    """Write the log of a session that crashed in its second round"""
+    sink = ResultSink(filename)
+    sink.write_session({"Participant" : "p01", "type" : "1", "seed" : 5})
+    sink.start_stage("stage1_former")
+    for i in range(len(FORMER)):
+        sink.write_record("stage1_former", FORMER, i)
+    sink.write_report("stage1_former", {"schedule" : {"trials" : 2}})
+    sink.end_stage("stage1_former")
+    sink.start_stage("stage1_latter")
+    sink.write_record("stage1_latter", LATTER, 0)
+    sink.write_record("stage1_latter", LATTER, 1)
+    sink.close()
+    with open(filename, 'a', encoding='utf-8') as file:
+        # cut short by the crash
+        file.write('{"event": "trial", "stage": "stage1_lat')
+
+
+def test_resumed_log_continues_after_the_cut_line(tmp_path):
+    filename = str(tmp_path / "trials.jsonl")
+    interrupted_log(filename)
+
+    expinfo, data, completed = read_log(filename)
+    assert expinfo == {"Participant" : "p01", "type" : "1", "seed" : 5}
+    assert completed == ["stage1_former"]
+    assert data == {"stage1_former" : FORMER.rows(),
+                    "stage1_latter" : LATTER.rows()[:2]}
+
+    # the resumed session appends to the same log
+    sink = ResultSink(filename)
+    sink.resume_stage("stage1_latter", len(data["stage1_latter"]))
+    sink.write_record("stage1_latter", LATTER, 2)
+    sink.write_record("stage1_latter", LATTER, 3)
+    sink.end_stage("stage1_latter")
+    sink.close()
+
+    with open(filename, encoding='utf-8') as file:
+        events = [line.split('"event": "')[1].split('"')[0] for line in file]
+    # only the cut line is lost
+    assert events[-5:] == ["trial", "stage_resume", "trial", "trial", "stage_end"]
+
+    _, data, completed = read_log(filename)
+    assert completed == ["stage1_former", "stage1_latter"]
+    assert data["stage1_latter"] == LATTER.rows()
+    assert TrialRecords.from_rows(data["stage1_latter"]).rows() == LATTER.rows()
+
+
+def test_session_resumes_the_finished_and_the_interrupted_stages(tmp_path):
+    pytest.importorskip("psychopy")
+    import exp
+
+    # the stimulus stack is imported once the dialog is closed
+    exp.import_modules()
+    filename = str(tmp_path / "trials.jsonl")
+    interrupted_log(filename)
+    session = exp.Session.resume(filename)
+    try:
+        assert session.resumed
+        assert session.type == "1"
+        assert session.expinfo["seed"] == 5
+        assert session.completed_stages == ["stage1_former"]
+
+        data = {}
+        assert session.resume_stages(data, ["stage1_former"])
+        assert data["stage1_former"].rows() == FORMER.rows()
+        # the interrupted stage runs again from its next trial
+        assert not session.resume_stages(data, ["stage1_former", "stage1_latter"])
+        assert session.resumed_data["stage1_latter"] == LATTER.rows()[:2]
+    finally:
+        session.sink.close()
+
+
+def test_log_without_session_cannot_be_resumed(tmp_path):
+    pytest.importorskip("psychopy")
+    import exp
+
+    filename = tmp_path / "trials.jsonl"
+    filename.write_text("")
+    with pytest.raises(ValueError):
+        exp.Session.resume(str(filename))
@@ -0,0 +1,104 @@
+"""The frame-locked flip loop of scheduler.FrameScheduler on a virtual
+clock"""
+import math
+import numpy as np
+import pytest
+
+pytest.importorskip("psychopy")
+
+from scheduler import FrameScheduler, Phase, ANY_KEY
+from simulation import NullWindow, NullStim, NullSound, ScriptedParticipant
+
+
+def trial_phases(fixation, word, sound=None):
+    return [Phase("fixation", [fixation], 0.5),
+            Phase("blank", [], 0.25),
+            # shorter than half a frame, never shown
+            Phase("flash", [fixation], 0.005),
+            Phase("word1", [word], 1.0, keyList=['q', 'p'], rt_start=True,
+                  sounds=[sound] if sound != None else ()),
+            Phase("feedback", [word], 0.2)]
+
+
+def test_phases_last_their_planned_frames():
+    win = NullWindow(frame_rate=60)
+    participant = ScriptedParticipant(win, [('q', 5.0)])
+    scheduler = FrameScheduler(win, kb=participant)
+    fixation, word = NullStim(), NullStim()
+
+    participant.start_trial(None)
+    assert scheduler.run(trial_phases(fixation, word), trial=0) == (None, None, None)
+    assert win.frames == 30 + 15 + 60 + 12
+    assert fixation.draws == 30
+    assert word.draws == 72
+
+    assert [entry["phase"] for entry in scheduler.log] == \
+        ["fixation", "blank", "word1", "feedback"]
+    for entry, onset in zip(scheduler.log, [0, 0.5, 0.75, 1.75]):
+        assert entry["planned_onset"] == pytest.approx(onset)
+        assert entry["actual_onset"] == pytest.approx(onset)
+    report = scheduler.precision_report()
+    assert report["word1"]["n"] == 1
+    assert report["word1"]["max_error_frames"] < 1e-6
+
+
+def test_response_time_is_measured_from_the_flip():
+    win = NullWindow(frame_rate=60)
+    participant = ScriptedParticipant(win, [('p', 0.4321)])
+    scheduler = FrameScheduler(win, kb=participant)
+    table = scheduler.compile(trial_phases(NullStim(), NullStim()))
+
+    participant.start_trial(None)
+    keys, rt, key_time = scheduler.run(table, trial=0)
+    assert keys == ['p']
+    assert rt == pytest.approx(0.4321)
+    word1 = scheduler.log[-1]
+    assert word1["phase"] == "word1"
+    assert key_time - rt == pytest.approx(word1["actual_onset"] + 1 / 60)
+    # the trial ends on the first flip after the key press
+    assert win.frames == 30 + 15 + math.ceil(0.4321 * 60) + 1
+
+
+def test_compiled_table_binds_the_stimuli_of_every_run():
+    win = NullWindow(frame_rate=60)
+    participant = ScriptedParticipant(win, [('q', 0.31), ('q', 0.31)])
+    scheduler = FrameScheduler(win, kb=participant)
+    table = scheduler.compile(trial_phases(NullStim(), NullStim()))
+    assert table.frames == [30, 15, 0, 60, 12]
+
+    words = [NullStim(), NullStim()]
+    for trial, word in enumerate(words):
+        table.set("word1", stims=[word])
+        participant.start_trial(None)
+        keys, rt, _ = scheduler.run(table, trial=trial)
+        assert keys == ['q']
+        assert rt == pytest.approx(0.31)
+    assert [word.draws for word in words] == [20, 20]
+
+
+def test_wait_lasts_until_any_key():
+    win = NullWindow(frame_rate=60)
+    participant = ScriptedParticipant(win, [], operator_delay=2.5)
+    scheduler = FrameScheduler(win, kb=participant)
+    instructions = NullStim()
+
+    keys, rt, key_time = scheduler.run(
+        [Phase("instructions", [instructions], math.inf, keyList=ANY_KEY)])
+    assert keys == ['space']
+    assert rt == None
+    assert key_time == pytest.approx(2.5)
+    assert instructions.draws == win.frames
+    assert win.time >= 2.5
+
+
+def test_sound_starts_with_the_flip_of_its_phase():
+    win = NullWindow(frame_rate=60)
+    participant = ScriptedParticipant(win, [('q', 0.2)])
+    scheduler = FrameScheduler(win, kb=participant)
+    sound = NullSound(np.zeros(4410), sampleRate=44100)
+
+    participant.start_trial(None)
+    scheduler.run(trial_phases(NullStim(), NullStim(), sound), trial=0)
+    assert sound.plays == 1
+    assert sound.start_time == pytest.approx(0.75 + 1 / 60)
+    assert scheduler.asynchrony == pytest.approx(0)
@@ -0,0 +1,118 @@
+"""The result log written by sink.ResultSink and read by read_log"""
+import json
+import time
+import pytest
+
+from records import TrialRecords, WORDS, TYPES, MEASURE_COLUMNS, RIGHT, WRONG, NO_RESPONSE
+from sink import ResultSink, read_log, export_reports
+
+
+def practice_records():
+    records = TrialRecords(4)
+    for word1, word2, correct, rt in [("牙刷", "牙齒", RIGHT, 0.81),
+                                      ("小丑", "小鹿", WRONG, 1.2),
+                                      ("旗子", "棋子", NO_RESPONSE, None)]:
+        records.append(WORDS.code(word1), WORDS.code(word2),
+            TYPES.code("音同形似"), correct, rt,
+            None if rt == None else 12.5 + rt)
+    return records
+
+
+def test_trials_are_read_back_with_every_column(tmp_path):
+    filename = str(tmp_path / "trials.jsonl")
+    written = []
+    sink = ResultSink(filename, listener=written.append)
+    sink.write_session({"Participant" : "p03", "type" : "2"})
+    sink.start_stage("stage1_practice")
+    records = practice_records()
+    # a row has every measure column before the trial is measured
+    assert set(records.row(0)) == set(records.row(1))
+    assert all(records.row(0)[name] == None for name in MEASURE_COLUMNS)
+    records.measure({"dropped_frames" : 2, "word1_duration_ms" : 1016.7}, 0)
+    for i in range(len(records)):
+        sink.write_record("stage1_practice", records, i)
+    sink.end_stage("stage1_practice")
+    sink.close()
+
+    expinfo, data, completed = read_log(filename)
+    assert expinfo == {"Participant" : "p03", "type" : "2"}
+    assert completed == ["stage1_practice"]
+    rows = data["stage1_practice"]
+    assert rows == records.rows()
+    assert [row["correct"] for row in rows] == [True, False, 'no response']
+    assert rows[0]["dropped_frames"] == 2
+    assert rows[1]["dropped_frames"] == None
+    assert all(set(row) == set(rows[0]) for row in rows)
+    assert [record["event"] for record in written] == \
+        ["session", "stage_start", "trial", "trial", "trial", "stage_end"]
+
+
+def test_restarted_stage_drops_its_rows(tmp_path):
+    filename = str(tmp_path / "trials.jsonl")
+    records = practice_records()
+    sink = ResultSink(filename)
+    sink.write_session({"Participant" : "p02"})
+    sink.start_stage("stage2_former")
+    sink.write_record("stage2_former", records, 0)
+    sink.write_record("stage2_former", records, 1)
+    sink.end_stage("stage2_former")
+    sink.start_stage("stage2_former")
+    sink.write_record("stage2_former", records, 2)
+    sink.close()
+
+    _, data, completed = read_log(filename)
+    assert data["stage2_former"] == [records.row(2)]
+    assert completed == []
+
+
+def test_read_log_without_session(tmp_path):
+    filename = tmp_path / "trials.jsonl"
+    filename.write_text("")
+    assert read_log(str(filename)) == (None, {}, [])
+
+
+def test_write_errors_stop_the_session(tmp_path):
+    sink = ResultSink(str(tmp_path / "trials.jsonl"))
+    sink.write("stage1_former", {"response_time" : object()})
+    deadline = time.monotonic() + 5
+    while sink.error == None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert isinstance(sink.error, TypeError)
+    with pytest.raises(RuntimeError):
+        sink.end_stage("stage1_former")
+    with pytest.raises(RuntimeError):
+        sink.close()
+
+
+def test_broken_listener_doesnt_stop_the_log(tmp_path):
+    filename = str(tmp_path / "trials.jsonl")
+
+    def listener(record):
+        raise ValueError(record["event"])
+
+    sink = ResultSink(filename, listener=listener)
+    sink.write_session({"Participant" : "p04"})
+    sink.start_stage("stage1_former")
+    sink.close()
+    assert sink.error == None
+    assert read_log(filename)[0] == {"Participant" : "p04"}
+
+
+def test_export_reports(tmp_path):
+    import pandas as pd
+
+    filename = str(tmp_path / "trials.jsonl")
+    records = practice_records()
+    sink = ResultSink(filename)
+    sink.write_session({"Participant" : "p05", "dateStr" : "2024_May_02_1130"})
+    sink.start_stage("stage1_former")
+    for i in range(len(records)):
+        sink.write_record("stage1_former", records, i)
+    sink.close()
+
+    json_filename, xlsx_filename = export_reports(filename)
+    assert json_filename == str(tmp_path / "p052024_May_02_1130data.json")
+    with open(json_filename) as file:
+        assert json.load(file) == {"stage1_former" : records.rows()}
+    df = pd.read_excel(xlsx_filename, index_col=0)
+    assert list(df["word1"]) == ["牙刷", "小丑", "旗子"]
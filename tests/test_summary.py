@@ -0,0 +1,96 @@
+"""The grouped statistics of summary.summarize against hand-computed
+values"""
+import math
+import numpy as np
+import pandas as pd
+import pytest
+
+from records import TrialRecords, WORDS, TYPES, correctness_code
+from summary import trial_table, summarize, condition_table
+from manifest import TYPES as CONDITIONS
+
+# (type, response_time, correct) of the trials of every stage
+TRIALS = {"stage1_former" : [("音同形似", 0.6, True),
+                             ("音同形似", 0.8, True),
+                             ("音同形似", 1.0, False),
+                             ("音同形似", None, 'no response'),
+                             # the name used by the practice files
+                             ("音似形似", 0.7, True),
+                             ("音異形異", 0.9, False),
+                             ("音異形異", None, 'no response')],
+          "stage2_latter" : [("音同形異", 0.5, True)]}
+
+
+def rows(trials):
+    return [{"response_time" : rt, "word1" : "w%d" % i, "word2" : "v%d" % i,
+             "correct" : correct, "type" : type, "key_time" : None}
+            for i, (type, rt, correct) in enumerate(trials)]
+
+
+def test_summary_of_the_trial_table():
+    summary = summarize(trial_table({name : rows(trials)
+                                     for name, trials in TRIALS.items()}))
+    assert list(summary.index) == [("stage1", "former", "音同形似"),
+                                   ("stage1", "former", "音異形異"),
+                                   ("stage2", "latter", "音同形異")]
+
+    same = summary.loc[("stage1", "former", "音同形似")]
+    assert (same["n"], same["responses"], same["no_response"]) == (5, 4, 1)
+    assert same["mean_rt"] == pytest.approx(0.775)
+    assert same["median_rt"] == pytest.approx(0.75)
+    assert same["sd_rt"] == pytest.approx(np.std([0.6, 0.8, 1.0, 0.7], ddof=1))
+    assert same["correct_rt"] == pytest.approx(0.7)
+    assert same["accuracy"] == pytest.approx(0.6)
+    assert same["ies"] == pytest.approx(0.7 / 0.6)
+
+    # no correct trial
+    different = summary.loc[("stage1", "former", "音異形異")]
+    assert (different["n"], different["responses"]) == (2, 1)
+    assert different["accuracy"] == 0
+    assert math.isnan(different["correct_rt"])
+    assert math.isnan(different["ies"])
+
+    # a single response has no SD
+    assert math.isnan(summary.loc[("stage2", "latter", "音同形異"), "sd_rt"])
+
+
+def test_records_and_rows_give_the_same_summary():
+    data = {}
+    for name, trials in TRIALS.items():
+        records = TrialRecords(len(trials))
+        for row in rows(trials):
+            records.append(WORDS.code(row["word1"]), WORDS.code(row["word2"]),
+                TYPES.code(row["type"]), correctness_code(row["correct"]),
+                row["response_time"])
+        data[name] = records
+    from_records = summarize(trial_table(data))
+    from_rows = summarize(trial_table({name : rows(trials)
+                                       for name, trials in TRIALS.items()}))
+    pd.testing.assert_frame_equal(from_records, from_rows)
+
+
+def test_extra_grouping_keys():
+    trials = trial_table({"stage1_former" : rows(TRIALS["stage1_former"])})
+    trials.insert(0, "session", ["a"] * 3 + ["b"] * 4)
+    summary = summarize(trials, ["session", "type"])
+    assert summary.loc[("a", "音同形似"), "n"] == 3
+    assert summary.loc[("b", "音同形似"), "n"] == 2
+    assert summary.loc[("b", "音同形似"), "accuracy"] == 0.5
+    assert summary["n"].sum() == 7
+
+
+def test_condition_table_has_every_condition():
+    summary = summarize(trial_table({name : rows(trials)
+                                     for name, trials in TRIALS.items()}))
+    table = condition_table(summary)
+    assert list(table.index) == ["stage1_former", "stage2_latter"]
+    assert list(table.columns) == \
+        ["average_response_time_" + name for name in CONDITIONS] + \
+        ["correctness_rate_" + name for name in CONDITIONS]
+    assert table.loc["stage1_former", "correctness_rate_音同形似"] == pytest.approx(0.6)
+    assert table.loc["stage2_latter", "average_response_time_音同形異"] == 0.5
+    assert math.isnan(table.loc["stage2_latter", "correctness_rate_音異形似"])
+
+
+def test_empty_trial_table():
+    assert len(summarize(trial_table({}))) == 0
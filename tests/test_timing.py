@@ -0,0 +1,89 @@
+"""The dropped frames and phase durations found by timing.FrameTimer"""
+import pytest
+
+from timing import FrameTimer
+
+FRAME = 1 / 60
+
+
+def record_trial(timer, trial, start, phases, late=()):
+    """Record the flips of the (label, frames) phases of a trial, the
+    flips in late come one extra frame late each"""
+    t = start
+    flip = 0
+    for label, frames in phases:
+        for frame in range(frames):
+            t += FRAME * (2 if flip in late else 1)
+            timer.record(trial, label, t, frames if frame == 0 else None)
+            flip += 1
+    return t
+
+
+def test_trial_quality_finds_the_dropped_frames():
+    timer = FrameTimer(60)
+    phases = [("fixation", 30), ("photo", 60), ("word1", 60), ("word2", 20)]
+    record_trial(timer, 0, 0.0, phases, late={40, 41, 80})
+
+    quality = timer.trial_quality(0)
+    assert quality["dropped_frames"] == 3
+    assert quality["max_frame_interval_ms"] == pytest.approx(2 * FRAME * 1000)
+    assert quality["photo_duration_ms"] == pytest.approx(63 * FRAME * 1000)
+    assert quality["word1_duration_ms"] == pytest.approx(60 * FRAME * 1000)
+    # the last phase has no following onset
+    assert quality["word2_duration_ms"] == None
+
+
+def test_repeated_trial_numbers_are_separate_runs():
+    timer = FrameTimer(60)
+    phases = [("photo", 30), ("word1", 30), ("word2", 10)]
+    end = record_trial(timer, 0, 0.0, phases, late={5})
+    # the next stage starts its trials at 0 again, after a pause
+    record_trial(timer, None, end, [("instructions", 120)])
+    record_trial(timer, 0, end + 10.0, phases)
+
+    assert timer.trial_quality(0)["dropped_frames"] == 0
+    report = timer.report()
+    # the pause and the instructions aren't frame intervals of a trial
+    assert report["dropped_frames"] == 1
+    assert report["flips"] == 70 + 120 + 70
+    assert report["phases"]["photo"]["n"] == 2
+    assert report["phases"]["photo"]["planned_ms"] == pytest.approx(500)
+    assert report["phases"]["photo"]["max_error_ms"] == pytest.approx(FRAME * 1000)
+    assert "instructions" not in report["phases"]
+
+
+def test_report_flags_a_session_that_drops_frames():
+    timer = FrameTimer(60)
+    record_trial(timer, 0, 0.0, [("photo", 100), ("word1", 100)],
+                 late=set(range(10, 20)))
+    report = timer.report(max_dropped_ratio=0.01)
+    assert report["dropped_frames"] == 10
+    assert report["dropped_ratio"] == pytest.approx(10 / 209)
+    assert report["flagged"]
+    assert sum(report["histogram_counts"]) == 199
+    # 16.7 ms and 33.3 ms intervals
+    counts = dict(zip(report["histogram_edges_ms"], report["histogram_counts"]))
+    assert counts[16] == 189
+    assert counts[33] == 10
+    assert not timer.report(max_dropped_ratio=0.1)["flagged"]
+
+
+def test_scheduler_reports_every_flip():
+    pytest.importorskip("psychopy")
+    from scheduler import FrameScheduler, Phase
+    from simulation import NullWindow, NullStim, ScriptedParticipant
+
+    win = NullWindow(frame_rate=60)
+    participant = ScriptedParticipant(win, [('q', 0.5)])
+    timer = FrameTimer(60)
+    scheduler = FrameScheduler(win, kb=participant, timer=timer)
+    participant.start_trial(None)
+    scheduler.run([Phase("photo", [NullStim()], 1.0),
+                   Phase("word1", [NullStim()], 2.0, keyList=['q'], rt_start=True)],
+                  trial=7)
+
+    assert len(timer.flips) == win.frames
+    quality = timer.trial_quality(7)
+    assert quality["dropped_frames"] == 0
+    assert quality["photo_duration_ms"] == pytest.approx(1000)
+    assert quality["word1_duration_ms"] == None
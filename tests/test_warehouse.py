@@ -0,0 +1,154 @@
+"""The Parquet warehouse of warehouse.Warehouse"""
+import os
+import random
+import threading
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from summary import trial_table, summarize
+from sink import ResultSink
+from warehouse import (Warehouse, compacted_sessions, COMPACT_FILES,
+                       COMPACTED_FILENAME)
+
+CONDITIONS = ["音同形似", "音異形似", "音同形異", "音異形異"]
+
+
+def session(participant, date, seed=0):
+    """Get the participant info and the rows of a session of 16 trials per
+    round"""
+    rng = random.Random(seed)
+    data = {}
+    for name in ["stage1_former", "stage2_latter"]:
+        data[name] = []
+        for i in range(16):
+            responded = rng.random() < 0.9
+            data[name].append({"response_time" : rng.uniform(0.4, 1.4) if responded else None,
+                               "word1" : "目標%d" % i,
+                               "word2" : "測試%d" % i,
+                               "correct" : rng.random() < 0.8 if responded else 'no response',
+                               "type" : CONDITIONS[i % 4],
+                               "key_time" : None,
+                               "dropped_frames" : 0})
+    expinfo = {"Participant" : participant, "dateStr" : date, "type" : "1",
+               "seed" : seed, "Gender" : "F", "Age" : 24}
+    return expinfo, data
+
+
+def add(store, participant, date, seed=0):
+    expinfo, data = session(participant, date, seed)
+    return store.add_session(expinfo, trial_table(data))
+
+
+def month_files(store, month):
+    return sorted(os.listdir(os.path.join(store.dirname, "month=" + month)))
+
+
+def test_queries_filter_the_sessions(tmp_path):
+    store = Warehouse(str(tmp_path / "warehouse"))
+    sessions = [session("p01", "2026-09-28_1030", 1),
+                session("p02", "2026-10-02_0915", 2),
+                session("p01", "2026-10-15_1400", 3)]
+    for expinfo, data in sessions:
+        assert store.add_session(expinfo, trial_table(data)) == 32
+
+    trials = store.trials()
+    assert len(trials) == 96
+    assert set(trials["month"]) == {"2026-09", "2026-10"}
+    assert len(store.trials(participant="p01")) == 64
+    assert len(store.trials(since="2026-10")) == 64
+    assert len(store.trials(since="2026-10-02", until="2026-10-15")) == 32
+    same = store.trials(["word1", "stage"], type="音同形似", stage="stage2")
+    assert list(same.columns) == ["word1", "stage"]
+    assert len(same) == 12
+
+    # the same statistics as the trial tables of the sessions
+    tables = []
+    for expinfo, data in sessions:
+        table = trial_table(data)
+        table.insert(0, "participant", expinfo["Participant"])
+        tables.append(table)
+    expected = summarize(pd.concat(tables, ignore_index=True), ["participant", "type"])
+    stored = store.summarize(["participant", "type"])
+    pd.testing.assert_frame_equal(stored[expected.columns].reset_index(drop=True),
+                                  expected.reset_index(drop=True), check_dtype=False)
+
+
+def test_months_are_compacted_on_ingestion(tmp_path):
+    store = Warehouse(str(tmp_path / "warehouse"))
+    for i in range(COMPACT_FILES - 1):
+        add(store, "p%02d" % i, "2026-10-%02d_1000" % (i + 1), i)
+    assert len(month_files(store, "2026-10")) == COMPACT_FILES - 1
+
+    add(store, "p99", "2026-10-20_1000", 99)
+    assert month_files(store, "2026-10") == [COMPACTED_FILENAME]
+    compacted = os.path.join(store.dirname, "month=2026-10", COMPACTED_FILENAME)
+    assert len(compacted_sessions(compacted)) == COMPACT_FILES
+    assert len(store.trials()) == COMPACT_FILES * 32
+
+    add(store, "p98", "2026-10-21_1000", 98)
+    assert len(month_files(store, "2026-10")) == 2
+    assert store.compact() == 1
+    assert month_files(store, "2026-10") == [COMPACTED_FILENAME]
+
+
+def test_adding_a_session_again_replaces_its_rows(tmp_path):
+    store = Warehouse(str(tmp_path / "warehouse"))
+    expinfo, data = session("p01", "2026-10-02_0915", 1)
+    store.add_session(expinfo, trial_table(data))
+    store.compact()
+    assert compacted_sessions(os.path.join(store.dirname, "month=2026-10",
+                                           COMPACTED_FILENAME)) == {"p012026-10-02_0915"}
+
+    # resumed, the session has a third round now
+    data["stage2_former"] = data["stage1_former"][:5]
+    store.add_session(expinfo, trial_table(data))
+    trials = store.trials(participant="p01")
+    assert len(trials) == 37
+    assert (trials["stage"] + "_" + trials["order"]).value_counts()["stage2_former"] == 5
+    assert compacted_sessions(os.path.join(store.dirname, "month=2026-10",
+                                           COMPACTED_FILENAME)) == set()
+
+
+def test_stations_add_sessions_concurrently(tmp_path):
+    store = Warehouse(str(tmp_path / "warehouse"))
+    errors = []
+
+    def station(i):
+        try:
+            for j in range(5):
+                add(store, "s%dp%d" % (i, j), "2026-10-%02d_1000" % (j + 1), i * 10 + j)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=station, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    trials = store.trials(["session"])
+    assert len(trials) == 20 * 32
+    assert trials["session"].nunique() == 20
+    assert len(month_files(store, "2026-10")) <= COMPACT_FILES
+
+
+def test_ingest_stores_the_completed_stages(tmp_path):
+    expinfo, data = session("p05", "2026-10-09_1100", 5)
+    filename = str(tmp_path / ("p052026-10-09_1100" + "trials.jsonl"))
+    sink = ResultSink(filename)
+    sink.write_session(expinfo)
+    for name, rows in data.items():
+        sink.start_stage(name)
+        for row in rows:
+            sink.write(name, row)
+    # the second round was cut short
+    sink.end_stage("stage1_former")
+    sink.close()
+
+    store = Warehouse(str(tmp_path / "warehouse"))
+    assert store.ingest_all(str(tmp_path)) == (1, 16)
+    trials = store.trials()
+    assert set(trials["stage"]) == {"stage1"}
+    assert set(trials["age"]) == {"24"}
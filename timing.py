@@ -0,0 +1,187 @@
+import numpy as np
+import math
+
+# a flip interval longer than this many frames means frames were dropped
+DROP_THRESHOLD = 1.5
+
+# a session is flagged when more of its frames than this were dropped
+MAX_DROPPED_RATIO = 0.01
+
+# the phases whose measured duration is attached to every result row
+MEASURED_PHASES = ["photo", "word1", "word2"]
+
+HISTOGRAM_WIDTH = 50
+
+
+class FrameTimer(object):
+    """
+    A class used to record the timestamp of every flip
+
+    The frame scheduler reports every flip to the timer with the trial and
+    the phase it belongs to. From those timestamps, the timer finds the
+    dropped frames, measures how long every phase was really on the
+    screen, and summarizes the whole session in a histogram of the flip
+    intervals.
+
+    The instrumentation is opt-in, a scheduler without a timer doesn't
+    record anything.
+    """
+
+    def __init__(self, frame_rate, drop_threshold=DROP_THRESHOLD):
+        """
+        Parameters
+        ----------
+        frame_rate : int, float
+            the refresh rate of the window in Hz
+        drop_threshold : float, optional
+            the flip interval, in frames, above which frames were dropped
+        """
+        self.frame_rate = frame_rate
+        self.frame_duration = 1.0 / frame_rate
+        self.drop_threshold = drop_threshold
+        self.flips = []
+        self.onsets = []
+        # the trial numbers start again in every TrialProcess, so the flips
+        # are grouped in segments of consecutive flips of the same trial
+        self.__segment = -1
+        self.__segments = {}
+
+    def record(self, trial, phase, t, frames=None):
+        """Record a flip
+
+        Parameters
+        ----------
+        trial : hashable, None
+            the trial of the flip
+        phase : str
+            the label of the phase of the flip
+        t : float
+            the timestamp of the flip
+        frames : int, optional
+            the planned number of frames of the phase, given on the first
+            flip of a phase
+        """
+        if not self.flips or self.flips[-1][1] != trial:
+            self.__segment += 1
+            self.__segments[trial] = (self.__segment, len(self.flips), len(self.onsets))
+        self.flips.append((self.__segment, trial, phase, t))
+        if frames != None:
+            self.onsets.append((self.__segment, trial, phase, t, frames))
+
+    def __dropped(self, intervals):
+        late = intervals[intervals > self.drop_threshold * self.frame_duration]
+        return int(np.sum(np.round(late / self.frame_duration) - 1))
+
+    def trial_quality(self, trial):
+        """Get the timing quality columns of the last run of a trial
+
+        Returns
+        -------
+        A dictionary with the number of dropped frames, the longest flip
+        interval and the measured duration of the MEASURED_PHASES, in
+        milliseconds. A phase that wasn't shown or was cut short by the
+        response has a None duration.
+        """
+        segment, first_flip, first_onset = self.__segments[trial]
+        flips = [t for flip_segment, _, _, t in self.flips[first_flip:]
+                 if flip_segment == segment]
+        intervals = np.diff(flips)
+        quality = {"dropped_frames" : self.__dropped(intervals) if len(intervals) else 0,
+                   "max_frame_interval_ms" : float(intervals.max() * 1000)
+                                             if len(intervals) else None}
+
+        onsets = [(phase, t) for onset_segment, _, phase, t, _
+                  in self.onsets[first_onset:] if onset_segment == segment]
+        durations = {}
+        for (phase, t), (_, next_t) in zip(onsets, onsets[1:]):
+            durations[phase] = (next_t - t) * 1000
+        for phase in MEASURED_PHASES:
+            quality[phase + "_duration_ms"] = durations.get(phase)
+        return quality
+
+    def report(self, max_dropped_ratio=MAX_DROPPED_RATIO):
+        """Summarize the timing of the session
+
+        Returns
+        -------
+        A dictionary with the number of flips and dropped frames, the
+        histogram of the flip intervals in 1 ms bins, the planned and
+        measured duration of every phase, and whether the session is
+        flagged because too many frames were dropped
+        """
+        times = np.array([t for _, _, _, t in self.flips])
+        segments = np.array([segment for segment, _, _, _ in self.flips])
+        in_trial = np.array([trial != None for _, trial, _, _ in self.flips], dtype=bool)
+        # intervals between two scheduler runs include the work done between
+        # them, only the intervals within a trial are frame intervals
+        same = (np.diff(segments) == 0) & in_trial[1:]
+        intervals = np.diff(times)[same]
+        dropped = self.__dropped(intervals) if len(intervals) else 0
+        ratio = dropped / (len(intervals) + dropped) if len(intervals) else 0
+
+        edges = np.arange(0, math.ceil(4 * self.frame_duration * 1000) + 2)
+        counts, edges = np.histogram(intervals * 1000, bins=edges)
+        counts[-1] += int(np.sum(intervals * 1000 > edges[-1]))
+
+        phases = {}
+        for (segment, trial, phase, t, frames), following in zip(self.onsets,
+                                                                 self.onsets[1:]):
+            if following[0] != segment or trial == None:
+                continue
+            phases.setdefault(phase, {"planned" : [], "measured" : []})
+            phases[phase]["planned"].append(frames * self.frame_duration * 1000)
+            phases[phase]["measured"].append((following[3] - t) * 1000)
+        for phase, values in phases.items():
+            planned = np.array(values["planned"])
+            measured = np.array(values["measured"])
+            finite = np.isfinite(planned)
+            error = measured[finite] - planned[finite]
+            phases[phase] = {"n" : len(measured),
+                             "planned_ms" : float(np.median(planned)),
+                             "mean_ms" : float(measured.mean()),
+                             "sd_ms" : float(measured.std()),
+                             "max_error_ms" : float(np.abs(error).max()) if len(error) else None}
+
+        return {"frame_rate" : self.frame_rate,
+                "flips" : len(self.flips),
+                "dropped_frames" : dropped,
+                "dropped_ratio" : ratio,
+                "flagged" : ratio > max_dropped_ratio,
+                "histogram_edges_ms" : edges.tolist(),
+                "histogram_counts" : counts.tolist(),
+                "phases" : phases}
+
+    def write_report(self, filename, max_dropped_ratio=MAX_DROPPED_RATIO):
+        """Write the report of the session as text, with an ASCII histogram
+        of the flip intervals
+
+        Returns
+        -------
+        the report, see report()
+        """
+        report = self.report(max_dropped_ratio)
+        counts = report["histogram_counts"]
+        edges = report["histogram_edges_ms"]
+        scale = HISTOGRAM_WIDTH / max(max(counts), 1)
+
+        lines = ["frame rate      %.2f Hz" % report["frame_rate"],
+                 "flips           %d" % report["flips"],
+                 "dropped frames  %d (%.3f%%)" % (report["dropped_frames"],
+                                                  report["dropped_ratio"] * 100),
+                 "flagged         %s" % report["flagged"],
+                 "",
+                 "phase           n      planned ms  mean ms   sd ms   max error ms"]
+        for phase, values in report["phases"].items():
+            lines.append("%-14s %5d  %10.2f  %8.2f  %6.2f  %s" % (phase,
+                values["n"], values["planned_ms"], values["mean_ms"],
+                values["sd_ms"], "%.2f" % values["max_error_ms"]
+                if values["max_error_ms"] != None else "-"))
+        lines += ["", "flip interval histogram (ms)"]
+        for low, count in zip(edges, counts):
+            if count:
+                lines.append("%3d-%-3d %8d %s" % (low, low + 1, count,
+                    '#' * max(int(count * scale), 1)))
+
+        with open(filename, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        return report
@@ -2,8 +2,13 @@ from psychopy import visual, core, event, gui, data, sound
 from psychopy.tools.filetools import fromFile, toFile
 from itertools import product
 import psychtoolbox as ptb
+from assets import ASSETS
+from scheduler import Phase, FrameScheduler, ANY_KEY
+from prefetch import LazyImage, LazySound, LazyWord, get_prefetcher, PREFETCH_WINDOW
+from records import TrialRecords, WORDS, TYPES, RIGHT, WRONG, NO_RESPONSE
+from stimcache import PHOTO_SCALE
+from adaptive import Exhaustive
 import numpy as np
-import pandas as pd
 import random
 import math
 
@@ -18,6 +23,28 @@ WORD2_CROSS_INTERVAL = math.inf
 
 WORD_SIZE = 3
 
+# the duration of the feedback image shown after a practice trial
+FEEDBACK_INTERVAL = 2
+
+ESCAPE_KEYS = ['escape']
+RESPONSE_KEYS = ['q', 'p', 'escape']
+
+# the phases of every trial: cross -> photo -> word1 -> word2, until a key
+# is pressed. TrialProcess compiles them once, and every trial object binds
+# its stimuli to the compiled table, see TrialObject.bind. The response
+# time is measured from the onset of word1, and from then on the
+# participant can answer until the end of the trial.
+TRIAL_PHASES = [
+    Phase("cross", [], CROSS_DISPLAY_INTERVAL, ESCAPE_KEYS),
+    Phase("cross_photo", [], CROSS_PHOTO_INTERVAL, ESCAPE_KEYS),
+    Phase("photo", [], PHOTO_DISPLAY_INTERVAL, ESCAPE_KEYS),
+    Phase("photo_word1", [], PHOTO_WORD1_INTERVAL, ESCAPE_KEYS),
+    Phase("word1", [], WORD1_DISPLAY_INTERVAL, RESPONSE_KEYS, rt_start=True),
+    Phase("word1_word2", [], WORD1_WORD2_INTERVAL, RESPONSE_KEYS),
+    Phase("word2", [], WORD2_DISPLAY_INTERVAL, RESPONSE_KEYS),
+    Phase("word2_cross", [], WORD2_CROSS_INTERVAL, RESPONSE_KEYS)
+]
+
 class TrialObject(object):
     """
     A class used to represent a trial object
@@ -31,6 +58,11 @@ class TrialObject(object):
     words with a short interval among them.The participants are required to
     press the p and q keys on the keyboard to choose the correct answer.
     
+    A trial object is a lightweight descriptor: its image and words are
+    lazy proxies that get their stimuli from the asset cache while the
+    trial is shown, so an item bank of thousands of targets only keeps the
+    stimuli of the current trials in memory.
+    
     Attributes
     ----------
     
@@ -38,6 +70,10 @@ class TrialObject(object):
     -------
     
     """
+
+    __slots__ = ("__img", "__word1_name", "__word2_name", "__type",
+                 "__word1", "__word2", "__codes", "__ans", "__response_time",
+                 "__key")
     
     def __init__(self, window, img, word1, word2, ans, _type):
         """
@@ -45,7 +81,7 @@ class TrialObject(object):
         ----------
         window : psychopy.visual.Window
             an object used to display the stimuli
-        img : psychopy.visual.ImageStim
+        img : prefetch.LazyImage
             an image stimulus that show the object in the trial
         word1 : str
             the first word that will be shown on the screen for participants
@@ -62,138 +98,75 @@ class TrialObject(object):
         self.__img = img
         self.__word1_name = word1
         self.__word2_name = word2
-        self.__window = window
         self.__type = _type
         
-        self.__word1 = visual.TextStim(window, text=word1, 
-            colorSpace='rgb', font="Songti SC", color=[0, 0, 0])
-        self.__word2 = visual.TextStim(window, text=word2, 
-            colorSpace='rgb', font="Songti SC", color=[0, 0, 0])
+        # pre-rendered textures, loaded from the asset cache for the trial
+        self.__word1 = LazyWord(window, word1, WORD_SIZE)
+        self.__word2 = LazyWord(window, word2, WORD_SIZE)
         
-        self.__word1.size = self.__word2.size = WORD_SIZE
-
+        # the categorical codes of the columns of TrialRecords
+        self.__codes = (WORDS.code(word1), WORDS.code(word2), TYPES.code(_type))
         
         self.__ans = ans
         self.__response_time = 0
         self.__key = None
         
-    def display(self, flip=True):
-        """Display the stimulus of the trial object and wait for a fix specific
-        time interval. The time interval is PHOTO_DISPLAY_INTERVAL. The function
-        will listen to the keyboard event. When the user type the 'escape' key,
-        the function will immediately return. The return value will be a key
-        list, but normally, the list will only contain a single key, the
-        'escape' key.
-
-        Parameters
-        ----------
-        flip : Boolean, optional
-            if flip is set the True, the window will flip automatically, which
-            means that the image or orther kind of visual sitmulus will appear
-            on the screen immediately.
-
-        Returns
-        -------
-        list : 
-            a key list that only contains the 'escape' key, if the user
-            types the 'escape' key on the keyboard when the object displayes.
-        None : 
-            if user doesn't type any key during the interval that the object
-            displayes.
-        """
-        self.__img.draw()
-        if flip:
-            self.__window.flip()
-        key = event.waitKeys(PHOTO_DISPLAY_INTERVAL, keyList=['escape'])
-        return key
-    
-    def display_image(self, flip=True):
-        """Display the image of the trial object
+    def bind(self, table):
+        """Load the stimuli of the trial into the slots of the compiled
+        TRIAL_PHASES
 
         Parameters
         ----------
-        flip : Boolean, optional, default is True
-            if flip is set the True, the window will flip automatically, which
-            means that the image will appear on the screen immediately.
+        table : scheduler.PhaseTable
+            the phases compiled by the trial process
         """
-        self.__img.draw()
-        if flip:
-            self.__window.flip()
-        
-    def display_word1(self, flip=True):
-        """Display the word1 of the trial object and wait for a fixed specific
-        time interval. The time interval is set to be WORD1_DISPLAY_INTERVAL.
+        table.set("photo", [self.__img.load()], sounds=())
+        table.set("word1", [self.__word1.load()])
+        table.set("word2", [self.__word2.load()])
 
-        Parameters
-        ----------
-        flip : Boolean, optional, default is True
-            if flip is set the True, the window will flip automatically, which
-            means that the image will appear on the screen immediately.
+    def unbind(self, table):
+        """Empty the slots filled by bind(), so the table doesn't keep the
+        stimuli of the trial alive"""
+        table.set("photo", [], sounds=())
+        table.set("word1", [])
+        table.set("word2", [])
 
-        Returns
-        -------
-        a list that contains keys that are pushed during the interval that 
-        word1 is display.
-        """
-        self.__word1.draw()
-        if flip:
-            self.__window.flip()
-        keys = event.waitKeys(WORD1_DISPLAY_INTERVAL, 
-                keyList=['q','p', 'escape'])
-        return keys
-    
-    def display_word2(self, flip=True):
-        """Display the word1 of the trial object and wait for a fixed specific
-        time interval. The time interval is set to be WORD2_DISPLAY_INTERVAL.
+    def stimuli(self):
+        """Get the lazily loaded stimuli of the trial object
 
-        Parameters
-        ----------
-        flip : Boolean, optional, default is True
-            if flip is set the True, the window will flip automatically, which
-            means that the image will appear on the screen immediately.
-        
         Returns
         -------
-        a list that contains keys that are pushed during the interval that 
-        word2 is display.
+        A list of prefetch.LazyImage, prefetch.LazyWord and
+        prefetch.LazySound
         """
+        return [self.__img, self.__word1, self.__word2]
 
-        self.__word2.draw()
-        if flip:
-            self.__window.flip()
-        keys = event.waitKeys(WORD2_DISPLAY_INTERVAL, 
-                keyList=['q','p', 'escape'])
-        return keys
-        
-        
-    def response(self, key, clk):
-        """Save user's response and the reaction time then return the 
-        correctness and the content of the object
+    def record(self, records, key, clk, key_time=None):
+        """Save user's response and the reaction time into a record buffer
         
         Parameters
         ----------
-        key : str 
-            user's input
+        records : records.TrialRecords
+            the buffer of the results of the stage
+        key : list, None
+            the pressed keys, None if the participant didn't respond
         clk : int, float
-            user's response time
+            user's response time, measured from the onset of word1
+        key_time : float, optional
+            the hardware timestamp of the key press
             
         Returns
         -------
-        A dictionary that contains two words, user's response time, and 
-        his/her reaction time
+        the index of the trial in the buffer
         """
         self.__response_time = clk
         if key == None:
-            crt = 'no response'
+            crt = NO_RESPONSE
         else:
             self.__key = key[0]
-            crt = self.is_correct()
-        
-        return {"response_time" : self.__response_time,
-                "word1" : self.__word1_name,
-                "word2" : self.__word2_name,
-                "correct" : crt,
-                "type" : self.__type}
+            crt = RIGHT if self.is_correct() else WRONG
+        word1, word2, _type = self.__codes
+        return records.append(word1, word2, _type, crt, clk, key_time)
         
     def is_correct(self, ans=None):
         """Check if user's key input is correct or not
@@ -228,7 +201,7 @@ class TrialObject(object):
         -------
         A chinese string that representsthe type of the test
         """
-        return self._type
+        return self.__type
 
 
 class TrialObjects(object):
@@ -242,18 +215,22 @@ class TrialObjects(object):
     
     """
     
-    def __init__(self, win, dir_path, array):
+    def __init__(self, win, trial_set):
         """
+        Parameters
+        ----------
+        win : psychopy.visual.Window
+        trial_set : manifest.TrialSet
+            a row of the trial file
         """
         
-        self.name = array['目標詞彙']
-        self.test = array[1:]
-        self.img = visual.ImageStim(win, dir_path + self.name + ".jpeg")
-        self.img.size *= 0.5
+        self.name = trial_set.target
+        self.test = trial_set.tests
+        self.img = LazyImage(win, trial_set.photo, PHOTO_SCALE)
         
         self.trial_objects = []
         
-        for key, value in self.test.items():
+        for value, key in self.test:
             self.trial_objects.append(
                 TrialObject(win, self.img, 
                     self.name, value, 'q', key))
@@ -266,27 +243,31 @@ class TrialObjects(object):
         return random.sample(self.trial_objects, len(self.trial_objects))
     
 class AudioTrialObject(TrialObject):
+
+    __slots__ = ("__audio",)
     
     def __init__(self, window, img, audio, word1, word2, ans, _type):
-        self.__window = window
         super().__init__(window, img, word1, word2, ans, _type)
         self.__audio = audio
-    
-    def display(self, flip=True):
-        self.__audio.play()
-        return super().display(flip)
+
+    def bind(self, table):
+        super().bind(table)
+        # play the audio together with the onset of the image
+        table.set("photo", sounds=[self.__audio.load()])
+
+    def stimuli(self):
+        return super().stimuli() + [self.__audio]
 
 class AudioTrialObjects(TrialObjects):
     
-    def __init__(self, window, img_directory_path, audio_directory_path, array):
-        self.name = array[0]
-        self.test = array[1:]
-        self.img = visual.ImageStim(window, img_directory_path + self.name + ".jpeg")
-        self.audio = sound.Sound(audio_directory_path + self.name + ".wav")
-        self.img.size *= 0.5
+    def __init__(self, window, trial_set):
+        self.name = trial_set.target
+        self.test = trial_set.tests
+        self.img = LazyImage(window, trial_set.photo, PHOTO_SCALE)
+        self.audio = LazySound(window, trial_set.audio)
         
         self.trial_objects = []
-        for key, value in self.test.items():
+        for value, key in self.test:
             self.trial_objects.append(AudioTrialObject(window, self.img, 
                 self.audio, self.name, value, 'q', key))
             self.trial_objects.append(AudioTrialObject(window, self.img,
@@ -294,40 +275,70 @@ class AudioTrialObjects(TrialObjects):
                 
         
 
+class SessionInterrupted(Exception):
+    """
+    Raised by TrialProcess.run when the participant presses escape
+
+    The rows of the trials before are in the result sink and the stage
+    isn't marked as finished, so resuming the session continues with the
+    trial that was interrupted, see exp.Session.resume.
+
+    Attributes
+    ----------
+    stage : str, None
+        the stage that was running
+    trials : int
+        the number of trials recorded in the stage
+    """
+
+    def __init__(self, stage, trials):
+        super().__init__("%s interrupted after %d trials" % (stage, trials))
+        self.stage = stage
+        self.trials = trials
+
+
 class TrialProcess(object):
     
-    def __init__(self, win, trial_objs_set, no_round=None):
+    def __init__(self, win, trial_objs_set, no_round=None, kb=None, timer=None,
+                 plan=None, stage=None):
         self.__win = win
         self.__trial_objs_set = trial_objs_set
-        self.__fixation = visual.GratingStim(self.__win, color=[0, 0, 0], 
-                        colorSpace='rgb', tex=None, mask='cross', size=WORD_SIZE)
+        self.__fixation = ASSETS.fixation(self.__win, WORD_SIZE)
                         
-        self.__slow_alert_text = visual.TextStim(self.__win, 
-            text="快點喔", color=[0, 0, 0], font="Songti SC")
-        
-        self.__slow_alert_text.size = WORD_SIZE
+        self.__slow_alert_text = ASSETS.text(self.__win, "快點喔", WORD_SIZE)
                         
-        self.__all_trial_objs = []
-        # yield all trial objects
-        for obj in self.__trial_objs_set:
-            self.__all_trial_objs += obj.get_trial_objects()
-        
-        # Should I randomize the test set here?
-        self.__all_trial_objs = random.sample(self.__all_trial_objs, 
-            len(self.__all_trial_objs))
+        if plan != None:
+            # the order of the trials has been drawn by the session plan
+            self.__all_trial_objs = plan.resolve(stage, self.__trial_objs_set)
+        else:
+            self.__all_trial_objs = []
+            # yield all trial objects
+            for obj in self.__trial_objs_set:
+                self.__all_trial_objs += obj.get_trial_objects()
+            
+            # Should I randomize the test set here?
+            self.__all_trial_objs = random.sample(self.__all_trial_objs, 
+                len(self.__all_trial_objs))
         
-        self.__right_feedback_img = visual.ImageStim(self.__win, "./resources/photos/right.jpeg")
-        self.__false_feedback_img = visual.ImageStim(self.__win, "./resources/photos/fault.jpeg")
-        self.__right_sound_effect = sound.Sound("./resources/audio/right_sound_effect.wav")
-        self.__false_sound_effect = sound.Sound("./resources/audio/false_sound_effect.wav")
+        self.__right_feedback_img = ASSETS.image(self.__win, "./resources/photos/right.jpeg")
+        self.__false_feedback_img = ASSETS.image(self.__win, "./resources/photos/fault.jpeg")
+        self.__right_sound_effect = ASSETS.sound(self.__win, "./resources/audio/right_sound_effect.wav")
+        self.__false_sound_effect = ASSETS.sound(self.__win, "./resources/audio/false_sound_effect.wav")
         
         self.setup_round_scene(no_round)
         
+        self.__scheduler = FrameScheduler(self.__win, kb=kb, timer=timer)
+        self.__trial_table = self.__scheduler.compile(TRIAL_PHASES)
+        self.__trial_table.set("cross", [self.__fixation])
+        self.__prefetcher = get_prefetcher()
+        # the schedule of the last run, see adaptive.py
+        self.schedule = None
+        
     def setup_round_scene(self, no_round):
         if no_round != None:
-            self.__round_img = visual.ImageStim(self.__win, "./resources/photos/round%d.png" % no_round)
-            self.__shot_effect = sound.Sound("./resources/audio/round%d_shot.wav" % no_round)
-            self.__round_sound = sound.Sound("./resources/audio/round%d.wav" % no_round)
+            self.__round_img = ASSETS.image(self.__win, "./resources/photos/round%d.png" % no_round)
+            self.__shot_effect = ASSETS.sound(self.__win, "./resources/audio/round%d_shot.wav" % no_round)
+            self.__round_sound = ASSETS.sound(self.__win, "./resources/audio/round%d.wav" % no_round)
         else:
             self.__round_img = None
             self.__shot_effect = None
@@ -336,127 +347,150 @@ class TrialProcess(object):
      
     def show_right_feedback(self):
         self.__right_feedback_img.draw()
-        self.__right_sound_effect.play()
+        self.__scheduler.audio.play_on_flip([self.__right_sound_effect])
         self.__win.flip()
         
     def show_false_feedback(self):
         self.__false_feedback_img.draw()
-        self.__false_sound_effect.play()
+        self.__scheduler.audio.play_on_flip([self.__false_sound_effect])
         self.__win.flip()
                         
-    def run(self, trial_objs=None, reaction=False, max_correctness=math.inf):
-        data = []
+    def run(self, trial_objs=None, reaction=False, max_correctness=math.inf,
+            sink=None, stage=None, schedule=None, resumed=None):
+        """Run the trials and collect the participant's responses
+
+        Parameters
+        ----------
+        trial_objs : list, optional
+            the trial objects to run, all trial objects of the process in a
+            random order by default
+        reaction : Boolean, optional
+            show the right/false feedback after every response
+        max_correctness : int, optional
+            stop after this many correct responses
+        sink : sink.ResultSink, optional
+            every result row is written to the sink as soon as it is
+            recorded
+        stage : str, optional
+            the name of the stage the rows are written under
+        schedule : callable, optional
+            builds the schedule that chooses the trials from trial_objs,
+            e.g. adaptive.ConditionStopping. By default every trial runs
+            in order until max_correctness, see adaptive.Exhaustive.
+        resumed : list, optional
+            the result rows of an interrupted run of the trials, they are
+            replayed through the schedule and the run continues with the
+            next trial
+
+        Returns
+        -------
+        A records.TrialRecords buffer of the results, including the resumed
+        rows
+
+        Raises
+        ------
+        SessionInterrupted
+            if the participant presses escape, the interrupted trial isn't
+            recorded
+        ValueError
+            if the resumed rows aren't the trials the schedule takes
+        """
         if trial_objs == None:
             trial_objs = self.__all_trial_objs
-            
-        
-        self.__correctness = 0
-        
-        def __shot():
-            if self.__shot_effect != None:
-                self.__shot_effect.play()
+        if resumed:
+            data = TrialRecords.from_rows(resumed, len(trial_objs))
+        else:
+            data = TrialRecords(len(trial_objs))
+        if schedule == None:
+            self.schedule = Exhaustive(trial_objs, max_correctness)
+        else:
+            self.schedule = schedule(trial_objs)
+        # the trial order comes from the session plan and the schedule only
+        # depends on the results, so replaying the rows restores its state
+        for index, row in enumerate(resumed or ()):
+            obj = self.schedule.next()
+            if obj == None or obj.words() != (row["word1"], row["word2"]):
+                raise ValueError("the rows of %s don't match its trials" % stage)
+            self.schedule.update(obj, data, index)
+        
+        # the shot after every trial, followed by the feedback in the practice
+        shot = Phase("shot", [], self.__scheduler.frame_duration,
+            sounds=[self.__shot_effect] if self.__shot_effect != None else [])
+        shot_table = self.__scheduler.compile([shot])
+        right_table = self.__scheduler.compile([shot, Phase("feedback",
+            [self.__right_feedback_img], FEEDBACK_INTERVAL, ANY_KEY,
+            sounds=[self.__right_sound_effect])])
+        false_table = self.__scheduler.compile([shot, Phase("feedback",
+            [self.__false_feedback_img], FEEDBACK_INTERVAL, ANY_KEY,
+            sounds=[self.__false_sound_effect])])
         
         def __show_reaction(obj, reaction):
-            __shot()
-            self.__win.flip()
-            if reaction:
-                if obj.is_correct():
-                    self.show_right_feedback()
-                    self.__correctness += 1
-                else:
-                    self.show_false_feedback()
-                event.waitKeys(2)
+            if not reaction:
+                self.__scheduler.run(shot_table)
+            elif obj.is_correct():
+                self.__scheduler.run(right_table)
+            else:
+                self.__scheduler.run(false_table)
         
         if self.__round_img != None and self.__round_sound != None:
-            self.__round_img.draw()
-            self.__win.flip()
-            self.__round_sound.play()
-            core.wait(self.__round_sound.getDuration())
+            self.__scheduler.run([Phase("round", [self.__round_img],
+                self.__round_sound.getDuration(),
+                sounds=[self.__round_sound])])
         
-        i = 0
-        while i < len(trial_objs) and self.__correctness < max_correctness:
-            obj = trial_objs[i]
-            i += 1
-            
-            # display cross
-            self.__fixation.draw()
-            self.__win.flip()
-            keys = event.waitKeys(CROSS_DISPLAY_INTERVAL, keyList=['escape'])
-            if keys != None:
-                break
-            
-            # the interval between the cross and the photo
-            self.__win.flip()
-            keys = event.waitKeys(CROSS_PHOTO_INTERVAL, keyList=['escape'])
-            if keys != None:
-                break
-            
-            # display the photo
-            keys = obj.display()
-            if keys != None:
-                break
-            self.__win.flip()
-            
-            # the interval between the photo and the word1
-            keys = event.waitKeys(PHOTO_WORD1_INTERVAL, keyList=['escape'])
-            if keys != None:
+        def __prefetch():
+            # the stimuli of the trials are looked up on the prefetch thread
+            self.__prefetcher.prefetch_trials(self.schedule.upcoming(PREFETCH_WINDOW))
+        
+        table = self.__trial_table
+        __prefetch()
+        
+        i = len(data)
+        while True:
+            obj = self.schedule.next()
+            if obj == None:
                 break
+            i += 1
             
-            # start measuring the repsonse time
-            clk = core.Clock()
-            
-            # show the first word and wait for WORD1_DISPLAY_INTERVAL
-            keys = obj.display_word1()
-            
-                
-            
-            # check if the subject has responsed or not
-            if keys != None:
-                if 'escape' in keys:
-                    break
-                else:
-                    data.append(obj.response(keys, clk.getTime()))
-                    __show_reaction(obj, reaction)
-                    continue
-                    
-            # clear the first word and wait for WORD1_WORD2_INTERVAL
-            self.__win.flip()
-            keys = event.waitKeys(WORD1_WORD2_INTERVAL, 
-                keyList=['q','p', 'escape'])
-            
-            # check the response
-            if keys != None:
-                if 'escape' in keys:
-                    break
-                else:
-                    data.append(obj.response(keys, clk.getTime()))
-                    __show_reaction(obj, reaction)
-                    continue
-                
-            # show the next word and wait for WORD2_DISPLAY_INTERVAL
-            keys = obj.display_word2()
-            
-            # check the response
-            if keys != None:
-                if 'escape' in keys:
-                    break
-                else:
-                    data.append(obj.response(keys, clk.getTime()))
-                    __show_reaction(obj, reaction)
-                    continue
-            
-            # clear the seconde word and wait for WORD2_CROSS_INTERVAL
-            self.__win.flip()
-            keys = event.waitKeys(WORD2_CROSS_INTERVAL, keyList=['q','p', 'escape'])
+            # the stimuli are built between the trials, not in the flip loop
+            obj.bind(table)
+            __prefetch()
+            self.__scheduler.kb.start_trial(obj)
+            keys, rt, key_time = self.__scheduler.run(table, i)
+            obj.unbind(table)
+            for stim in obj.stimuli():
+                stim.release()
+            if keys != None and 'escape' in keys:
+                raise SessionInterrupted(stage, len(data))
             
-            if keys != None:
-                if 'escape' in keys:
-                    break
-                else:
-                    data.append(obj.response(keys, clk.getTime()))
-                    __show_reaction(obj, reaction)
-                    continue
-
+            index = obj.record(data, keys, rt, key_time)
+            self.schedule.update(obj, data, index)
+            if self.__scheduler.timer != None:
+                # dropped frames and the measured phase durations
+                data.measure(self.__scheduler.timer.trial_quality(i))
+            if self.__scheduler.asynchrony != None:
+                data.measure({"av_asynchrony_ms" : self.__scheduler.asynchrony})
+            if sink != None:
+                # the row is built by the sink's thread
+                sink.write_record(stage, data, index)
+            __show_reaction(obj, reaction)
                     
         return data
+
+    def timing_log(self):
+        """Get the planned and actual onset of every phase shown so far
+
+        Returns
+        -------
+        A list of dictionaries, see scheduler.FrameScheduler
+        """
+        return self.__scheduler.log
+
+    def precision_report(self):
+        """Get the onset error of every phase, see scheduler.FrameScheduler"""
+        return self.__scheduler.precision_report()
+
+    def audio_report(self):
+        """Get the audio-visual asynchrony of the sounds, see
+        audio.AudioEngine"""
+        return self.__scheduler.audio.report()
     
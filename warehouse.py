@@ -0,0 +1,442 @@
+"""A Parquet warehouse of the trials of every session
+
+    python warehouse.py ingest [LOG ...]
+    python warehouse.py compact
+    python warehouse.py query [--by COLUMN ...] [--type TYPE ...]
+                              [--stage STAGE ...] [--participant NAME ...]
+                              [--since DATE] [--until DATE]
+
+Every trial row of every session is stored in a Parquet dataset with the
+participant info of the session joined in, partitioned by the month of the
+session:
+
+    experiment_data/warehouse/month=2026-10/<Participant><dateStr>.parquet
+    experiment_data/warehouse/month=2026-10/compacted.parquet
+
+exp.Session.write_results adds every finished session, and ingest adds the
+sessions of result logs (trials.jsonl), every log of the data directory by
+default. A session is added as one file, written to a temporary file and
+renamed, so the stations can add their sessions concurrently and adding a
+session again replaces its rows. Once a month has COMPACT_FILES session
+files, the session that adds the last one merges them into the
+compacted.parquet of the month, so a month never has more than
+COMPACT_FILES + 1 files and no separate compaction has to run.
+
+The queries read the dataset with pyarrow.dataset: the filters on the month
+skip whole directories, the rows are sorted by type and stage so the
+filters on them and on the other columns are pushed down to the row group
+statistics, and only the requested columns are read.
+
+For example, the mean response time of two conditions across every
+participant:
+
+    Warehouse().summarize(["type"], type=["音同形似", "音異形似"])
+"""
+from summary import trial_table, summarize
+from manifest import TYPE_ALIASES
+from sink import read_log
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyarrow as pa
+import contextlib
+import threading
+import argparse
+import glob
+import time
+import os
+
+WAREHOUSE_DIRNAME = os.path.join("experiment_data", "warehouse")
+DATA_DIRNAME = os.path.join("experiment_data", "data")
+
+LOG_SUFFIX = "trials.jsonl"
+COMPACTED_FILENAME = "compacted.parquet"
+LOCK_FILENAME = ".lock"
+
+# the directory level of the dataset, the first 7 characters of the dateStr
+# of the session
+PARTITION_COLUMNS = ["month"]
+
+# the session files of a month that are merged into its compacted file
+COMPACT_FILES = 8
+
+# the rows of a row group of a compacted file, a few condition and stage
+# runs of a month so their statistics skip the others
+ROW_GROUP_SIZE = 4096
+
+# the order of the rows of every file, the columns the queries filter on
+SORT_KEYS = [("type", "ascending"), ("stage", "ascending"),
+             ("date", "ascending"), ("session", "ascending")]
+
+# the seconds after which the lock of a month is taken over, its holder
+# has crashed
+LOCK_TIMEOUT = 60.0
+
+# the key of the schema metadata of a compacted file that lists its sessions
+SESSIONS_KEY = b"sessions"
+
+# the participant info joined to every trial, expinfo key -> column
+EXPINFO_COLUMNS = {"Participant" : "participant",
+                   "Number" : "number",
+                   "Gender" : "gender",
+                   "Age" : "age",
+                   "type" : "session_type",
+                   "dateStr" : "date",
+                   "seed" : "seed",
+                   "adaptive" : "adaptive"}
+
+# the columns of the files, the month is in the path
+SCHEMA = pa.schema([
+    ("type", pa.string()),
+    ("stage", pa.string()),
+    ("session", pa.string()),
+    ("participant", pa.string()),
+    ("number", pa.string()),
+    ("gender", pa.string()),
+    ("age", pa.string()),
+    ("session_type", pa.string()),
+    ("date", pa.string()),
+    ("seed", pa.int64()),
+    ("adaptive", pa.bool_()),
+    ("order", pa.string()),
+    ("trial", pa.int32()),
+    ("word1", pa.string()),
+    ("word2", pa.string()),
+    ("response_time", pa.float64()),
+    ("correct", pa.bool_()),
+    ("key_time", pa.float64()),
+    ("dropped_frames", pa.float64()),
+    ("max_frame_interval_ms", pa.float64()),
+    ("photo_duration_ms", pa.float64()),
+    ("word1_duration_ms", pa.float64()),
+    ("word2_duration_ms", pa.float64()),
+    ("av_asynchrony_ms", pa.float64())])
+
+PARTITIONING = ds.partitioning(pa.schema([(name, pa.string())
+                                          for name in PARTITION_COLUMNS]),
+                               flavor="hive")
+
+# the columns of the dataset
+DATASET_SCHEMA = pa.schema(list(SCHEMA) + list(PARTITIONING.schema))
+
+
+def session_id(expinfo):
+    """Get the name of a session, the prefix of its files in the data
+    directory"""
+    return str(expinfo['Participant']) + str(expinfo['dateStr'])
+
+
+def compacted_sessions(filename):
+    """Get the sessions of a compacted file from its footer, an empty set
+    if it doesn't exist"""
+    if not os.path.exists(filename):
+        return set()
+    metadata = pq.read_schema(filename).metadata or {}
+    sessions = metadata.get(SESSIONS_KEY, b"").decode('utf-8')
+    return set(sessions.split("\n")) if sessions else set()
+
+
+def expinfo_value(expinfo, key):
+    value = expinfo.get(key)
+    if value == None or value == '':
+        return None
+    if key == 'seed':
+        return int(value)
+    if key == 'adaptive':
+        return bool(value)
+    return str(value)
+
+
+class Warehouse(object):
+    """
+    A class used to store and query the trials of every session
+
+    Attributes
+    ----------
+    dirname : str
+        the root directory of the dataset
+    """
+
+    def __init__(self, dirname=WAREHOUSE_DIRNAME):
+        """
+        Parameters
+        ----------
+        dirname : str, optional
+            the root directory of the dataset, created if it doesn't exist
+        """
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.dirname = dirname
+
+    def __partition(self, month):
+        return os.path.join(self.dirname, "month=" + month)
+
+    def add_session(self, expinfo, trials):
+        """Store the trials of a session, replacing the rows it already has
+
+        Parameters
+        ----------
+        expinfo : dict
+            the participant info of the session, see EXPINFO_COLUMNS
+        trials : pandas.DataFrame
+            the trial table of the session, see summary.py
+
+        Returns
+        -------
+        the number of stored trials
+        """
+        session = session_id(expinfo)
+        dirname = self.__partition(str(expinfo['dateStr'])[:7])
+        trials = trials.reset_index(drop=True)
+        # the position of every trial in its round
+        trial = trials.groupby(["stage", "order"], sort=False).cumcount()
+
+        columns = {}
+        for field in SCHEMA:
+            if field.name == "session":
+                columns[field.name] = [session] * len(trials)
+            elif field.name == "type":
+                columns[field.name] = trials["type"].astype(object) \
+                    .replace(TYPE_ALIASES).astype(str).to_numpy()
+            elif field.name in EXPINFO_COLUMNS.values():
+                key = next(key for key, column in EXPINFO_COLUMNS.items()
+                           if column == field.name)
+                columns[field.name] = [expinfo_value(expinfo, key)] * len(trials)
+            elif field.name == "trial":
+                columns[field.name] = trial.to_numpy()
+            elif field.name == "correct":
+                # a missing response is an error with a NaN response_time
+                columns[field.name] = (trials["correct"].astype(object) == True).to_numpy()
+            elif field.name in trials.columns:
+                column = trials[field.name]
+                if pa.types.is_string(field.type):
+                    column = column.astype(str)
+                columns[field.name] = column.to_numpy()
+            else:
+                columns[field.name] = [None] * len(trials)
+        table = pa.table(columns, schema=SCHEMA).sort_by(SORT_KEYS)
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        with self.__lock(dirname):
+            # the rows of an earlier run of the session, e.g. before it
+            # was resumed
+            compacted = os.path.join(dirname, COMPACTED_FILENAME)
+            if session in compacted_sessions(compacted):
+                earlier = pq.read_table(compacted, schema=SCHEMA)
+                self.__write_compacted(dirname, earlier.filter(
+                    pc.not_equal(earlier["session"], session)))
+            self.__write(dirname, session + ".parquet", table)
+            if len(self.__session_files(dirname)) >= COMPACT_FILES:
+                self.__compact(dirname)
+        return len(trials)
+
+    def __session_files(self, dirname):
+        return sorted(name for name in os.listdir(dirname)
+                      if name.endswith(".parquet") and name != COMPACTED_FILENAME)
+
+    @contextlib.contextmanager
+    def __lock(self, dirname):
+        # the stations add their sessions to the same month concurrently,
+        # only one of them rewrites the compacted file at a time
+        path = os.path.join(dirname, LOCK_FILENAME)
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) > LOCK_TIMEOUT:
+                        os.remove(path)
+                except OSError:
+                    pass
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.remove(path)
+
+    def __write(self, dirname, filename, table, **kwargs):
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        path = os.path.join(dirname, filename)
+        # the dataset skips the files starting with a dot
+        temp = os.path.join(dirname, ".%s.%d.%d" % (filename, os.getpid(),
+                                                    threading.get_ident()))
+        pq.write_table(table, temp, **kwargs)
+        os.replace(temp, path)
+
+    def __write_compacted(self, dirname, table):
+        sessions = "\n".join(sorted(set(table["session"].to_pylist())))
+        table = table.sort_by(SORT_KEYS).replace_schema_metadata(
+            {SESSIONS_KEY : sessions.encode('utf-8')})
+        self.__write(dirname, COMPACTED_FILENAME, table,
+                     row_group_size=ROW_GROUP_SIZE)
+
+    def __compact(self, dirname):
+        # called with the lock of the month
+        files = self.__session_files(dirname)
+        if not files:
+            return 0
+        tables = [pq.read_table(os.path.join(dirname, name), schema=SCHEMA)
+                  for name in files]
+        sessions = pa.array([name[:-len(".parquet")] for name in files])
+        compacted = os.path.join(dirname, COMPACTED_FILENAME)
+        if os.path.exists(compacted):
+            # the rows of a session are replaced by its own file, which is
+            # newer
+            table = pq.read_table(compacted, schema=SCHEMA)
+            table = table.filter(pc.invert(
+                pc.is_in(table["session"], value_set=sessions)))
+            tables.insert(0, table)
+        self.__write_compacted(dirname, pa.concat_tables(tables))
+        for name in files:
+            os.remove(os.path.join(dirname, name))
+        return len(files)
+
+    def ingest(self, filename):
+        """Store the completed stages of a result log
+
+        Parameters
+        ----------
+        filename : str
+            the path of a trials.jsonl log, see sink.ResultSink
+
+        Returns
+        -------
+        the number of stored trials, 0 if the log has no session or no
+        completed stage
+        """
+        expinfo, data, completed = read_log(filename)
+        data = {name : rows for name, rows in data.items() if name in completed}
+        if expinfo == None or not data:
+            return 0
+        return self.add_session(expinfo, trial_table(data))
+
+    def ingest_all(self, data_dirname=DATA_DIRNAME):
+        """Store the result logs of the data directory
+
+        Returns
+        -------
+        the number of sessions and trials stored
+        """
+        sessions = 0
+        trials = 0
+        for filename in sorted(glob.glob(os.path.join(data_dirname, "*" + LOG_SUFFIX))):
+            n = self.ingest(filename)
+            if n:
+                sessions += 1
+                trials += n
+        return sessions, trials
+
+    def compact(self):
+        """Merge the session files of every month into its compacted file,
+        add_session does it once a month has COMPACT_FILES of them
+
+        Returns
+        -------
+        the number of merged files
+        """
+        merged = 0
+        for dirname in glob.glob(os.path.join(self.dirname, "month=*")):
+            with self.__lock(dirname):
+                merged += self.__compact(dirname)
+        return merged
+
+    def dataset(self):
+        """Get the pyarrow.dataset.Dataset of the warehouse"""
+        return ds.dataset(self.dirname, schema=DATASET_SCHEMA, format="parquet",
+                          partitioning=PARTITIONING)
+
+    def trials(self, columns=None, since=None, until=None, **where):
+        """Read the trials that match the filters
+
+        Parameters
+        ----------
+        columns : list, optional
+            the columns to read, every column by default
+        since, until : str, optional
+            only the sessions whose dateStr is not earlier than since and
+            earlier than until, e.g. '2025-09' or '2026-01-15'
+        where : str, list
+            a value or a list of values of a column, e.g.
+            type=['音同形似', '音異形似'] or participant='p01'
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        expression = None
+        conditions = []
+        for name, value in where.items():
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(ds.field(name).isin(list(value)))
+            else:
+                conditions.append(ds.field(name) == value)
+        if since != None:
+            # the month prunes the directories, the date the sessions
+            conditions.append(ds.field("month") >= since[:7])
+            conditions.append(ds.field("date") >= since)
+        if until != None:
+            conditions.append(ds.field("month") <= until[:7])
+            conditions.append(ds.field("date") < until)
+        if conditions:
+            expression = conditions[0]
+            for condition in conditions[1:]:
+                expression = expression & condition
+        table = self.dataset().to_table(columns=columns, filter=expression)
+        return table.to_pandas()
+
+    def summarize(self, by=("type",), since=None, until=None, **where):
+        """Summarize the trials that match the filters
+
+        Parameters
+        ----------
+        by : list, optional
+            the grouping columns, by condition across every session by
+            default
+        since, until, where :
+            the filters, see trials()
+
+        Returns
+        -------
+        pandas.DataFrame
+            see summary.summarize
+        """
+        columns = list(by) + ["response_time", "correct"]
+        return summarize(self.trials(columns, since, until, **where), list(by))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=WAREHOUSE_DIRNAME,
+        help='the root directory of the warehouse')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest',
+        help='add the sessions of result logs, every log of the data directory by default')
+    ingest.add_argument('logs', nargs='*', metavar='LOG')
+    commands.add_parser('compact', help='merge the session files of every month')
+    query = commands.add_parser('query', help='summarize the matching trials')
+    query.add_argument('--by', action='append', metavar='COLUMN',
+        help='a grouping column, type by default')
+    query.add_argument('--type', action='append', metavar='TYPE')
+    query.add_argument('--stage', action='append', metavar='STAGE')
+    query.add_argument('--participant', action='append', metavar='NAME')
+    query.add_argument('--since', metavar='DATE')
+    query.add_argument('--until', metavar='DATE')
+    args = parser.parse_args()
+
+    warehouse = Warehouse(args.dir)
+    if args.command == 'ingest':
+        if args.logs:
+            for log in args.logs:
+                print(log, warehouse.ingest(log), "trials")
+        else:
+            print("%d sessions, %d trials" % warehouse.ingest_all())
+    elif args.command == 'compact':
+        print("merged", warehouse.compact(), "files")
+    else:
+        where = {name : getattr(args, name) for name in ("type", "stage", "participant")
+                 if getattr(args, name) != None}
+        print(warehouse.summarize(args.by or ["type"], args.since, args.until,
+                                  **where).to_string())
@@ -0,0 +1,179 @@
+from psychopy import visual
+from assets import ASSETS, FONT, TEXT_NBYTES
+from PIL import Image
+import numpy as np
+import hashlib
+import glob
+import csv
+import os
+
+CACHE_DIRNAME = os.path.join("cache", "words")
+
+# the pixels kept around the ink of every word
+MARGIN = 4
+
+
+def csv_words(pattern="./trials/*.csv"):
+    """Get every unique word in the trial files
+
+    Parameters
+    ----------
+    pattern : str, optional
+        a glob pattern of the trial csv files
+
+    Returns
+    -------
+    A sorted list of the words, the headers are not included
+    """
+    words = set()
+    for filename in glob.glob(pattern):
+        with open(filename, encoding='utf-8-sig', newline='') as file:
+            rows = csv.reader(file)
+            next(rows, None)
+            for row in rows:
+                words.update(cell.strip() for cell in row if cell.strip())
+    return sorted(words)
+
+
+def cache_filename(win, text, size, font=FONT):
+    """Get the file the texture of the word is cached in
+
+    The name is a hash of everything that changes the rendered pixels, so a
+    different font, size, screen resolution or monitor calibration never
+    reuses a stale file: in deg or cm units, the pixels of a unit depend on
+    the viewing distance, width and resolution of the monitor.
+    """
+    monitor = win.monitor
+    calibration = (monitor.getDistance(), monitor.getWidth(),
+                   tuple(monitor.getSizePix() or ()))
+    key = "%s|%s|%s|%s|%s|%s" % (text, size, font, tuple(win.size), win.units,
+                                 calibration)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIRNAME, digest + ".png")
+
+
+def render(win, text, size, font=FONT):
+    """Rasterize a word once and return its pixels
+
+    The word is drawn in the center of the back buffer with the same
+    TextStim the trials used to create, read back, and cropped to the
+    smallest rectangle centered on the screen that holds all of its ink.
+    The black ink is turned into the alpha channel, so the texture blends
+    with any background.
+
+    Returns
+    -------
+    PIL.Image.Image
+        an RGBA image of the word in screen pixels
+    """
+    text_stim = visual.TextStim(win, text=text, color=[0, 0, 0],
+        colorSpace='rgb', font=font)
+    text_stim.size = size
+    win.clearBuffer()
+    text_stim.draw()
+    frame = win.getMovieFrame(buffer='back')
+    # getMovieFrame also keeps the frame for saveMovieFrames
+    win.movieFrames.pop()
+    win.clearBuffer()
+
+    gray = np.asarray(frame.convert('L'), dtype=np.uint8)
+    ink = 255 - gray
+    rows = np.flatnonzero(ink.max(axis=1))
+    cols = np.flatnonzero(ink.max(axis=0))
+    height, width = ink.shape
+    if len(rows) == 0:
+        return Image.new('RGBA', (1, 1))
+
+    cy, cx = height // 2, width // 2
+    half_h = max(cy - rows[0], rows[-1] - cy) + MARGIN
+    half_w = max(cx - cols[0], cols[-1] - cx) + MARGIN
+    ink = ink[max(cy - half_h, 0):cy + half_h, max(cx - half_w, 0):cx + half_w]
+
+    pixels = np.zeros(ink.shape + (4,), dtype=np.uint8)
+    pixels[..., 3] = ink
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def word_stim(win, text, size, font=FONT, use_disk_cache=True):
+    """Get the pre-rendered texture of a word from the asset cache
+
+    The word is rasterized the first time it is requested, or loaded from
+    the disk cache if an earlier launch has already rendered it. Every
+    trial object that shows the word shares the returned stimulus.
+
+    Parameters
+    ----------
+    win : psychopy.visual.Window
+        the window the word will be drawn on
+    text : str
+        the word
+    size : int, float
+        the size of the word, the same as the size of a TextStim
+    font : str, optional
+        the font of the word
+    use_disk_cache : Boolean, optional
+        read and write the rendered pixels in CACHE_DIRNAME
+
+    Returns
+    -------
+    psychopy.visual.ImageStim
+    """
+    if ASSETS.factory.headless:
+        # nothing is drawn, so there is nothing to rasterize
+        return ASSETS.text(win, text, size, font=font)
+
+    key = ('word', id(win), text, size, font)
+
+    def load():
+        filename = cache_filename(win, text, size, font)
+        if use_disk_cache and os.path.exists(filename):
+            img = Image.open(filename)
+            img.load()
+        else:
+            img = render(win, text, size, font)
+            if use_disk_cache:
+                os.makedirs(CACHE_DIRNAME, exist_ok=True)
+                img.save(filename)
+        return visual.ImageStim(win, image=img, units='pix', size=img.size,
+            interpolate=False)
+
+    return ASSETS.get(key, load, texture_nbytes)
+
+
+def texture_nbytes(stim):
+    """The size of the RGBA texture of a pre-rendered word"""
+    width, height = stim.size
+    return int(width * height * 4)
+
+
+def prepare_words(win, size, words=None, font=FONT, budget=None):
+    """Render the words of the trial files before the experiment starts
+
+    Parameters
+    ----------
+    win : psychopy.visual.Window
+        the window the words will be drawn on
+    size : int, float
+        the size of the words
+    words : list, optional
+        the words to render in the order they are needed, every word in
+        the trial files by default
+    budget : int, optional
+        the bytes of textures to render, the remaining words are rendered
+        when a trial needs them. Every word is rendered by default.
+
+    Returns
+    -------
+    A dictionary from every rendered word to its stimulus
+    """
+    if words == None:
+        words = csv_words()
+    stims = {}
+    nbytes = 0
+    for word in words:
+        if budget != None and nbytes >= budget:
+            break
+        stims[word] = word_stim(win, word, size, font)
+        # a headless word is a text stimulus, see word_stim
+        nbytes += TEXT_NBYTES if ASSETS.factory.headless else texture_nbytes(stims[word])
+    return stims